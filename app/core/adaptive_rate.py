@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import asyncio
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+from loguru import logger
+
+from app.core.rate_limiter import BaseRateLimiter, RateReservation
+
+
+@dataclass
+class LearnedRate:
+    """单个出口身份学到的速率"""
+    rate: float
+    successes: int = 0
+    quota_limits: int = 0
+    updated_at: float = 0.0
+
+
+class AdaptiveRateController:
+    """
+    AIMD 额度学习：限流器起作用时 (请求排过队或后面还有预订) 上游成功一次，速率加 increase (req/min)；
+    流量低于限速时的成功说明不了额度，不提速，否则空闲一阵后速率会涨到上限，下一波突发要连吃几轮 quota limit。
+    返回 400 quota limit，速率乘以 decrease。上游按 IP 计额度，所以按出口身份学习 (不区分模型)，
+    结果写入 JSON 文件，重启后从上次学到的速率开始。
+    """
+    def __init__(
+        self,
+        initial_rate: float,
+        min_rate: float,
+        max_rate: float,
+        increase: float,
+        decrease: float,
+        state_path: str = "",
+        flush_interval: float = 30.0,
+    ):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max(min_rate, max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.state_path = state_path
+        self.flush_interval = flush_interval
+        self._rates: Dict[str, LearnedRate] = {}
+        # 每个身份最近一次降速的时刻：在那之前预订的请求再报 quota limit 不重复降速
+        self._cut_at: Dict[str, float] = {}
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self.load()
+
+    def _clamp(self, rate: float) -> float:
+        return min(self.max_rate, max(self.min_rate, rate))
+
+    def _state(self, identity: str) -> LearnedRate:
+        state = self._rates.get(identity)
+        if state is None:
+            state = self._rates[identity] = LearnedRate(rate=self._clamp(self.initial_rate))
+        return state
+
+    def rate_for(self, identity: str) -> float:
+        """新建限流器时使用的初始速率 (有历史记录就用学到的值)"""
+        return self._state(identity).rate
+
+    def on_success(self, identity: str, limiter: BaseRateLimiter, reservation: RateReservation):
+        state = self._state(identity)
+        state.successes += 1
+        state.updated_at = time.time()
+        self._dirty = True
+        # available() < 0：后面还有请求预订了未来的时隙
+        if not reservation.queued and limiter.available() >= 0:
+            return
+        rate = self._clamp(state.rate + self.increase)
+        if rate != state.rate:
+            state.rate = rate
+            limiter.set_rate(rate)
+
+    def on_quota_limit(
+        self, identity: str, limiter: BaseRateLimiter, reservation: Optional[RateReservation] = None
+    ) -> bool:
+        """返回是否真的降了速：同一轮超额里排在降速之前的请求只算一次"""
+        state = self._state(identity)
+        state.quota_limits += 1
+        state.updated_at = time.time()
+        self._dirty = True
+        if reservation is not None and reservation.reserved_at < self._cut_at.get(identity, 0.0):
+            return False
+        old = state.rate
+        state.rate = self._clamp(old * self.decrease)
+        limiter.set_rate(state.rate)
+        self._cut_at[identity] = time.monotonic()
+        logger.warning(f"📉 [{identity}] 触发 quota limit，速率 {old:.2f} → {state.rate:.2f} req/min")
+        return True
+
+    # --- 持久化 ---
+    def load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for identity, raw in data.get("rates", {}).items():
+                if data.get("version", 1) < 2:
+                    # 旧版按 (身份, 模型) 记录：取该身份学到的最低速率
+                    raw = min(raw.values(), key=lambda item: item["rate"])
+                state = LearnedRate(**raw)
+                state.rate = self._clamp(state.rate)
+                self._rates[identity] = state
+            logger.info(f"📂 已加载 {len(self._rates)} 条学到的速率 ({self.state_path})")
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"⚠️ 读取速率学习记录失败，使用默认速率: {e}")
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {"version": 2, "rates": {identity: asdict(state) for identity, state in sorted(self._rates.items())}}
+
+    def _write(self, snapshot: Dict[str, Any]):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    async def save(self):
+        if not self.state_path or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, self._snapshot())
+        except OSError as e:
+            self._dirty = True
+            logger.warning(f"⚠️ 保存速率学习记录失败: {e}")
+
+    def start(self):
+        if self.state_path and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        await self.save()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.save()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "min_rate": self.min_rate,
+            "max_rate": self.max_rate,
+            "increase": self.increase,
+            "decrease": self.decrease,
+            "persistent": bool(self.state_path),
+            "rates": {
+                identity: {
+                    "rate_per_minute": round(state.rate, 3),
+                    "successes": state.successes,
+                    "quota_limits": state.quota_limits,
+                }
+                for identity, state in sorted(self._rates.items())
+            },
+        }
@@ -0,0 +1,86 @@
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.core import metrics
+
+
+def parse_timeout(value: Optional[str], default: float, maximum: float) -> float:
+    """X-Request-Timeout (秒)：缺省或非法时用默认值，且不超过上限"""
+    try:
+        timeout = float(value) if value else default
+    except ValueError:
+        timeout = default
+    if not math.isfinite(timeout) or timeout <= 0:
+        timeout = default
+    return min(timeout, maximum)
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    estimated_wait: float
+    status_code: int = 200
+    retry_after: float = 0.0
+    reason: str = ""
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class PendingAdmission:
+    """已放行、但还没进入公平队列 / 预订到时隙的请求；settle() 可重复调用"""
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self.settled = False
+        controller.pending += 1
+
+    def settle(self):
+        if not self.settled:
+            self.settled = True
+            self._controller.pending -= 1
+
+
+class AdmissionController:
+    """
+    准入控制：根据预计排队时间和请求剩余的时间预算，在占用任何额度之前决定是否放行。
+      - 预计等待超过预算 → 429，Retry-After 为排队积压消化到能赶上预算所需的时间
+      - 当前没有任何可用窗口 → 503，Retry-After 为窗口预计恢复时间
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        # 已放行但还没排上队的请求数 (估算时算作排在前面)
+        self.pending = 0
+        # 📊 统计
+        self.admitted = 0
+        self.rejected_overloaded = 0
+        self.rejected_unavailable = 0
+
+    def decide(self, estimated_wait: Optional[float], budget: float, recovery: float) -> AdmissionDecision:
+        """estimated_wait 为 None 表示当前无法服务 (没有窗口)"""
+        if not self.enabled:
+            return AdmissionDecision(True, estimated_wait or 0.0)
+        if estimated_wait is None:
+            self.rejected_unavailable += 1
+            metrics.ADMISSION_DECISIONS.inc(result="unavailable")
+            return AdmissionDecision(False, math.inf, 503, recovery, "no browser worker available")
+        if estimated_wait > budget:
+            self.rejected_overloaded += 1
+            metrics.ADMISSION_DECISIONS.inc(result="overloaded")
+            return AdmissionDecision(
+                False, estimated_wait, 429, estimated_wait - budget,
+                f"estimated wait {estimated_wait:.1f}s exceeds the {budget:.1f}s deadline",
+            )
+        self.admitted += 1
+        metrics.ADMISSION_DECISIONS.inc(result="admitted")
+        return AdmissionDecision(True, estimated_wait)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "pending": self.pending,
+            "admitted": self.admitted,
+            "rejected_overloaded": self.rejected_overloaded,
+            "rejected_unavailable": self.rejected_unavailable,
+        }
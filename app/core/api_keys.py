@@ -0,0 +1,106 @@
+import math
+import hmac
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+from app.core.rate_limiter import BaseRateLimiter, create_rate_limiter
+
+# 未开启鉴权时所有请求共用的身份
+ANONYMOUS = "anonymous"
+
+
+@dataclass
+class ApiKey:
+    """
+    一个调用方：weight 决定排队时分到的上游额度比例，
+    quota_per_minute > 0 时该 key 每分钟最多提交这么多次请求，超出直接 429。
+    admin 为真时可以访问管理接口 (/stats、/v1/cache)。
+    """
+    name: str
+    key: str = field(default="", repr=False)
+    weight: float = 1.0
+    quota_per_minute: float = 0.0
+    admin: bool = False
+    _quota: Optional[BaseRateLimiter] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.weight = max(0.01, float(self.weight))
+        if self.quota_per_minute > 0:
+            # 突发量等于每分钟额度：一分钟内可以一次用完，之后按平均速率恢复
+            self._quota = create_rate_limiter(
+                "gcra", self.quota_per_minute, max(1, math.ceil(self.quota_per_minute))
+            )
+
+    def take_quota(self) -> float:
+        """占用一次额度；返回 0 表示放行，否则为需要等待的秒数 (用于 Retry-After)"""
+        if self._quota is None:
+            return 0.0
+        wait = self._quota.peek()
+        if wait > 0:
+            return wait
+        self._quota.reserve()
+        return 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "quota_per_minute": self.quota_per_minute or None,
+            "quota_available": round(self._quota.available(), 3) if self._quota else None,
+        }
+
+
+class KeyRing:
+    """
+    API Key 表：API_MASTER_KEY 加上 API_KEYS 里配置的多个 key。
+    没有配置任何 key (API_MASTER_KEY 为空或 "1") 时不鉴权，所有请求都算作 anonymous (包括管理接口)。
+    API_MASTER_KEY 总是管理员，API_KEYS 里的 key 需要显式配置 "admin": true。
+    """
+    def __init__(self, master_key: str, keys: Dict[str, Dict[str, Any]]):
+        self.keys: List[ApiKey] = []
+        if master_key and master_key != "1":
+            self.keys.append(ApiKey(name="master", key=master_key, admin=True))
+        for index, (key, options) in enumerate(keys.items()):
+            options = dict(options or {})
+            name = str(options.pop("name", f"key-{index + 1}"))
+            self.keys.append(ApiKey(name=name, key=key, **options))
+        self.anonymous = ApiKey(name=ANONYMOUS, admin=True)
+        # 各 key 的后台 (批处理) 身份，见 background()
+        self._background: Dict[str, ApiKey] = {}
+        if self.enabled:
+            logger.info(f"🔑 已加载 {len(self.keys)} 个 API Key: {', '.join(k.name for k in self.keys)}")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.keys)
+
+    def authenticate(self, authorization: Optional[str]) -> Optional[ApiKey]:
+        """按 Authorization: Bearer <key> 查找调用方，鉴权失败返回 None"""
+        if not self.enabled:
+            return self.anonymous
+        if not authorization or not authorization.startswith("Bearer "):
+            return None
+        token = authorization[len("Bearer "):].strip()
+        for api_key in self.keys:
+            if hmac.compare_digest(api_key.key.encode(), token.encode()):
+                return api_key
+        return None
+
+    def get(self, name: str) -> ApiKey:
+        """按名字找回调用方 (例如恢复持久化的任务时)；找不到时按 anonymous 处理"""
+        return next((api_key for api_key in self.keys if api_key.name == name), self.anonymous)
+
+    def background(self, name: str, priority: float) -> ApiKey:
+        """
+        某个 key 提交的后台请求使用的身份：名字为 "<name>:batch"，权重为原 key 的 priority 倍，
+        在公平队列里单独计账，拥塞时让着交互式请求，空闲时照样用满额度。
+        """
+        api_key = self._background.get(name)
+        if api_key is None:
+            owner = self.get(name)
+            api_key = self._background[name] = ApiKey(name=f"{owner.name}:batch", weight=owner.weight * priority)
+        return api_key
+
+    def get_stats(self) -> Dict[str, Any]:
+        keys = self.keys if self.enabled else [self.anonymous]
+        return {api_key.name: api_key.get_stats() for api_key in keys}
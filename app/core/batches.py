@@ -0,0 +1,614 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import tempfile
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from loguru import logger
+
+from app.core import metrics
+from app.core.single_flight import CompletionBroadcast
+
+BATCH_VALIDATING = "validating"
+BATCH_FAILED = "failed"
+BATCH_IN_PROGRESS = "in_progress"
+BATCH_FINALIZING = "finalizing"
+BATCH_COMPLETED = "completed"
+BATCH_EXPIRED = "expired"
+BATCH_CANCELLING = "cancelling"
+BATCH_CANCELLED = "cancelled"
+BATCH_FINISHED_STATES = (BATCH_FAILED, BATCH_COMPLETED, BATCH_EXPIRED, BATCH_CANCELLED)
+
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions",)
+COMPLETION_WINDOWS = {"24h": 86400.0}
+# 校验失败时最多报告多少行错误
+MAX_REPORTED_ERRORS = 100
+
+
+class BatchRequestError(ValueError):
+    """文件 / 批任务请求本身不合法 (返回 400)"""
+
+
+@dataclass
+class StoredFile:
+    id: str
+    owner: str
+    filename: str
+    purpose: str
+    bytes: int
+    created_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "object": "file",
+            "bytes": self.bytes,
+            "created_at": int(self.created_at),
+            "filename": self.filename,
+            "purpose": self.purpose,
+            "status": "processed",
+        }
+
+
+@dataclass
+class Batch:
+    id: str
+    owner: str
+    input_file_id: str
+    endpoint: str
+    completion_window: str
+    expires_at: float
+    output_file_id: str
+    error_file_id: str
+    status: str = BATCH_VALIDATING
+    created_at: float = field(default_factory=time.time)
+    metadata: Optional[Dict[str, str]] = None
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+    in_progress_at: Optional[float] = None
+    finalizing_at: Optional[float] = None
+    completed_at: Optional[float] = None
+    failed_at: Optional[float] = None
+    expired_at: Optional[float] = None
+    cancelling_at: Optional[float] = None
+    cancelled_at: Optional[float] = None
+    # 结果文件是否有内容 (没有内容时不对外给出文件 ID)
+    has_output: bool = False
+    has_errors: bool = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in BATCH_FINISHED_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        def ts(value: Optional[float]) -> Optional[int]:
+            return int(value) if value is not None else None
+
+        return {
+            "id": self.id,
+            "object": "batch",
+            "endpoint": self.endpoint,
+            "errors": {"object": "list", "data": self.errors} if self.errors else None,
+            "input_file_id": self.input_file_id,
+            "completion_window": self.completion_window,
+            "status": self.status,
+            # 结果文件在批任务结束后才可下载
+            "output_file_id": self.output_file_id if self.finished and self.has_output else None,
+            "error_file_id": self.error_file_id if self.finished and self.has_errors else None,
+            "created_at": ts(self.created_at),
+            "in_progress_at": ts(self.in_progress_at),
+            "expires_at": ts(self.expires_at),
+            "finalizing_at": ts(self.finalizing_at),
+            "completed_at": ts(self.completed_at),
+            "failed_at": ts(self.failed_at),
+            "expired_at": ts(self.expired_at),
+            "cancelling_at": ts(self.cancelling_at),
+            "cancelled_at": ts(self.cancelled_at),
+            "request_counts": {"total": self.total, "completed": self.completed, "failed": self.failed},
+            "metadata": self.metadata,
+        }
+
+
+class BatchStore:
+    """
+    批任务持久层：文件内容放在 <directory>/files/ 下，文件和批任务的元数据放在 <directory>/batches.db (SQLite)。
+    没有配置目录时使用临时目录，重启后不保留。
+    """
+    def __init__(self, directory: str = ""):
+        self.persistent = bool(directory)
+        self.directory = directory or tempfile.mkdtemp(prefix="toolbaz-batches-")
+        self.files_dir = os.path.join(self.directory, "files")
+        os.makedirs(self.files_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.directory, "batches.db"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (id TEXT PRIMARY KEY, owner TEXT NOT NULL, created_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            "id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS batches_owner ON batches (owner, created_at)")
+        self._conn.commit()
+
+    def path(self, file_id: str) -> str:
+        return os.path.join(self.files_dir, f"{file_id}.jsonl")
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+        return rows
+
+    # --- 文件 ---
+    def _save_file(self, stored: StoredFile, content: Optional[bytes] = None):
+        if content is not None:
+            with open(self.path(stored.id), "wb") as f:
+                f.write(content)
+        self._execute(
+            "INSERT OR REPLACE INTO files (id, owner, created_at, data) VALUES (?, ?, ?, ?)",
+            (stored.id, stored.owner, stored.created_at, json.dumps(asdict(stored), ensure_ascii=False)),
+        )
+
+    def _load_file(self, file_id: str) -> Optional[StoredFile]:
+        rows = self._execute("SELECT data FROM files WHERE id = ?", (file_id,))
+        return StoredFile(**json.loads(rows[0][0])) if rows else None
+
+    def _delete_file(self, file_id: str):
+        self._execute("DELETE FROM files WHERE id = ?", (file_id,))
+        try:
+            os.remove(self.path(file_id))
+        except FileNotFoundError:
+            pass
+
+    # --- 批任务 ---
+    def _save_batch(self, batch: Batch):
+        self._execute(
+            "INSERT OR REPLACE INTO batches (id, owner, status, created_at, data) VALUES (?, ?, ?, ?, ?)",
+            (batch.id, batch.owner, batch.status, batch.created_at, json.dumps(asdict(batch), ensure_ascii=False)),
+        )
+
+    def _load_batch(self, batch_id: str) -> Optional[Batch]:
+        rows = self._execute("SELECT data FROM batches WHERE id = ?", (batch_id,))
+        return Batch(**json.loads(rows[0][0])) if rows else None
+
+    def _list_batches(self, owner: str, limit: int) -> List[Batch]:
+        rows = self._execute(
+            "SELECT data FROM batches WHERE owner = ? ORDER BY created_at DESC LIMIT ?", (owner, limit)
+        )
+        return [Batch(**json.loads(row[0])) for row in rows]
+
+    def _load_unfinished(self) -> List[Batch]:
+        rows = self._execute(
+            f"SELECT data FROM batches WHERE status NOT IN ({', '.join('?' for _ in BATCH_FINISHED_STATES)}) "
+            "ORDER BY created_at",
+            BATCH_FINISHED_STATES,
+        )
+        return [Batch(**json.loads(row[0])) for row in rows]
+
+    async def save_file(self, stored: StoredFile, content: Optional[bytes] = None):
+        await asyncio.to_thread(self._save_file, stored, content)
+
+    async def load_file(self, file_id: str) -> Optional[StoredFile]:
+        return await asyncio.to_thread(self._load_file, file_id)
+
+    async def delete_file(self, file_id: str):
+        await asyncio.to_thread(self._delete_file, file_id)
+
+    async def save_batch(self, batch: Batch):
+        await asyncio.to_thread(self._save_batch, batch)
+
+    async def load_batch(self, batch_id: str) -> Optional[Batch]:
+        return await asyncio.to_thread(self._load_batch, batch_id)
+
+    async def list_batches(self, owner: str, limit: int) -> List[Batch]:
+        return await asyncio.to_thread(self._list_batches, owner, limit)
+
+    async def load_unfinished(self) -> List[Batch]:
+        return await asyncio.to_thread(self._load_unfinished)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def parse_batch_input(content: bytes, endpoint: str, max_requests: int) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """解析输入 JSONL：返回 ([(custom_id, body)], 错误列表)；有任何错误时整个批任务失败"""
+    requests: List[Tuple[str, Dict[str, Any]]] = []
+    errors: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+
+    def error(line: int, message: str, param: Optional[str] = None):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"code": "invalid_request", "message": message, "param": param, "line": line})
+
+    for line_no, raw in enumerate(content.decode("utf-8", errors="replace").splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            item = json.loads(raw)
+        except ValueError:
+            error(line_no, "Line is not valid JSON.")
+            continue
+        if not isinstance(item, dict):
+            error(line_no, "Line must be a JSON object.")
+            continue
+        custom_id = item.get("custom_id")
+        body = item.get("body")
+        if not isinstance(custom_id, str) or not custom_id:
+            error(line_no, "custom_id must be a non-empty string.", "custom_id")
+        elif custom_id in seen:
+            error(line_no, f"Duplicate custom_id: {custom_id}", "custom_id")
+        elif item.get("method", "POST") != "POST":
+            error(line_no, "Only the POST method is supported.", "method")
+        elif item.get("url", endpoint) != endpoint:
+            error(line_no, f"url must match the batch endpoint ({endpoint}).", "url")
+        elif not isinstance(body, dict) or not isinstance(body.get("messages"), list) or not body["messages"]:
+            error(line_no, "body must be a chat completion request with a non-empty messages list.", "body")
+        else:
+            seen.add(custom_id)
+            requests.append((custom_id, body))
+    if not requests and not errors:
+        error(0, "The input file contains no requests.")
+    if len(requests) > max_requests:
+        error(0, f"The input file has {len(requests)} requests; at most {max_requests} are allowed per batch.")
+    return requests, errors
+
+
+def _read_checkpoint(path: str) -> Set[str]:
+    """
+    已写入结果文件的 custom_id。进程崩溃时最后一行可能只写了一半：
+    丢掉无法解析的行并重写文件，续跑时这些请求会重新执行。
+    """
+    if not os.path.exists(path):
+        return set()
+    done: Set[str] = set()
+    kept: List[str] = []
+    dirty = False
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for raw in f:
+            try:
+                custom_id = json.loads(raw)["custom_id"]
+            except (ValueError, KeyError, TypeError):
+                dirty = True
+                continue
+            if not raw.endswith("\n"):
+                raw += "\n"
+            done.add(custom_id)
+            kept.append(raw)
+    if dirty:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, path)
+    return done
+
+
+def _append_line(path: str, record: Dict[str, Any]):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class BatchManager:
+    """
+    OpenAI 兼容的批处理：上传 JSONL 输入文件，后台以低优先级 (公平队列里的低权重) 逐行执行，
+    每完成一行就追加到结果文件 (成功 → output 文件，失败 → error 文件)。
+    结果文件本身就是进度检查点：重启后跳过已写入的 custom_id，从中断处继续。
+    """
+    def __init__(
+        self,
+        run: Callable[[str, Dict[str, Any]], Awaitable[CompletionBroadcast]],
+        store: BatchStore,
+        concurrency: int = 4,
+        max_attempts: int = 3,
+        max_requests: int = 50000,
+        max_file_bytes: int = 100 * 1024 * 1024,
+    ):
+        self._run = run
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.max_requests = max_requests
+        self.max_file_bytes = max_file_bytes
+        self._active: Dict[str, Batch] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+
+        # 📊 统计
+        self.requests_completed = 0
+        self.requests_failed = 0
+        self.resumed = 0
+
+    async def start(self):
+        """继续执行上次未完成的批任务"""
+        for batch in await self.store.load_unfinished():
+            self._launch(batch)
+            self.resumed += 1
+        if self.resumed:
+            logger.info(f"📦 已恢复 {self.resumed} 个未完成的批任务")
+
+    async def stop(self):
+        """停止执行；进度已在结果文件里，下次启动时继续"""
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.store.close()
+
+    # --- 文件 ---
+    async def create_file(self, owner: str, filename: str, purpose: str, content: bytes) -> StoredFile:
+        if purpose != "batch":
+            raise BatchRequestError("Only files with purpose 'batch' can be uploaded.")
+        if len(content) > self.max_file_bytes:
+            raise BatchRequestError(f"File exceeds the {self.max_file_bytes} byte limit.")
+        stored = StoredFile(id=f"file-{uuid.uuid4().hex}", owner=owner, filename=filename, purpose=purpose, bytes=len(content))
+        await self.store.save_file(stored, content)
+        return stored
+
+    async def get_file(self, owner: str, file_id: str) -> Optional[StoredFile]:
+        stored = await self.store.load_file(file_id)
+        return stored if stored is not None and stored.owner == owner else None
+
+    def file_path(self, stored: StoredFile) -> str:
+        return self.store.path(stored.id)
+
+    async def delete_file(self, owner: str, file_id: str) -> bool:
+        stored = await self.get_file(owner, file_id)
+        if stored is None:
+            return False
+        await self.store.delete_file(file_id)
+        return True
+
+    # --- 批任务 ---
+    async def create_batch(
+        self,
+        owner: str,
+        input_file_id: str,
+        endpoint: str,
+        completion_window: str = "24h",
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> Batch:
+        if endpoint not in SUPPORTED_ENDPOINTS:
+            raise BatchRequestError(f"Unsupported endpoint: {endpoint}. Supported: {', '.join(SUPPORTED_ENDPOINTS)}")
+        if completion_window not in COMPLETION_WINDOWS:
+            raise BatchRequestError(f"Unsupported completion_window: {completion_window}")
+        stored = await self.get_file(owner, input_file_id)
+        if stored is None or stored.purpose != "batch":
+            raise BatchRequestError(f"No batch input file with id {input_file_id}.")
+        now = time.time()
+        batch = Batch(
+            id=f"batch_{uuid.uuid4().hex}",
+            owner=owner,
+            input_file_id=input_file_id,
+            endpoint=endpoint,
+            completion_window=completion_window,
+            expires_at=now + COMPLETION_WINDOWS[completion_window],
+            output_file_id=f"file-{uuid.uuid4().hex}",
+            error_file_id=f"file-{uuid.uuid4().hex}",
+            created_at=now,
+            metadata=metadata,
+        )
+        await self.store.save_batch(batch)
+        self._launch(batch)
+        return batch
+
+    async def get_batch(self, owner: str, batch_id: str) -> Optional[Batch]:
+        batch = self._active.get(batch_id) or await self.store.load_batch(batch_id)
+        return batch if batch is not None and batch.owner == owner else None
+
+    async def list_batches(self, owner: str, limit: int = 20) -> List[Batch]:
+        batches = await self.store.list_batches(owner, limit)
+        # 运行中的以内存里的最新进度为准
+        return [self._active.get(batch.id, batch) for batch in batches]
+
+    async def cancel_batch(self, owner: str, batch_id: str) -> Optional[Batch]:
+        batch = await self.get_batch(owner, batch_id)
+        if batch is None or batch.finished:
+            return batch
+        batch.status = BATCH_CANCELLING
+        batch.cancelling_at = time.time()
+        await self.store.save_batch(batch)
+        task = self._tasks.get(batch_id)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if not batch.finished:
+            # 还没开始执行就被取消，_execute 不会运行
+            self._tasks.pop(batch_id, None)
+            await self._finalize(batch, BATCH_CANCELLED)
+        return batch
+
+    # --- 执行 ---
+    def _launch(self, batch: Batch):
+        self._active[batch.id] = batch
+        self._tasks[batch.id] = asyncio.create_task(self._execute(batch))
+
+    async def _execute(self, batch: Batch):
+        try:
+            if batch.status == BATCH_CANCELLING:
+                await self._finalize(batch, BATCH_CANCELLED)
+                return
+            with open(self.store.path(batch.input_file_id), "rb") as f:
+                content = await asyncio.to_thread(f.read)
+            requests, errors = parse_batch_input(content, batch.endpoint, self.max_requests)
+            if errors:
+                batch.errors = errors
+                logger.warning(f"📦 批任务 {batch.id} 的输入文件校验失败 ({len(errors)} 处错误)")
+                await self._finalize(batch, BATCH_FAILED)
+                return
+
+            output_path = self.store.path(batch.output_file_id)
+            error_path = self.store.path(batch.error_file_id)
+            succeeded = await asyncio.to_thread(_read_checkpoint, output_path)
+            failed = await asyncio.to_thread(_read_checkpoint, error_path)
+            batch.total = len(requests)
+            batch.completed = len(succeeded)
+            batch.failed = len(failed)
+            if batch.status == BATCH_VALIDATING:
+                batch.status = BATCH_IN_PROGRESS
+                batch.in_progress_at = time.time()
+            await self.store.save_batch(batch)
+
+            pending = [(custom_id, body) for custom_id, body in requests if custom_id not in succeeded and custom_id not in failed]
+            if pending and batch.completed + batch.failed:
+                logger.info(f"📦 批任务 {batch.id} 从检查点继续: 已完成 {batch.completed + batch.failed}/{batch.total}")
+            status = await self._run_pending(batch, pending, output_path, error_path)
+            await self._finalize(batch, status)
+        except asyncio.CancelledError:
+            if self._stopping:
+                # 服务关闭：保持当前状态，下次启动时从检查点继续
+                return
+            await self._finalize(batch, BATCH_CANCELLED)
+        except Exception as e:
+            logger.error(f"❌ 批任务 {batch.id} 执行异常: {e}")
+            batch.errors = [{"code": "internal_error", "message": str(e) or type(e).__name__, "param": None, "line": None}]
+            await self._finalize(batch, BATCH_FAILED)
+        finally:
+            self._tasks.pop(batch.id, None)
+
+    async def _run_pending(
+        self, batch: Batch, pending: List[Tuple[str, Dict[str, Any]]], output_path: str, error_path: str
+    ) -> str:
+        """并发执行剩余的请求，直到全部完成或超出 completion_window；返回批任务的最终状态"""
+        lines = iter(pending)
+        in_flight: Set[str] = set()
+        writes: Set[asyncio.Task] = set()
+        write_lock = asyncio.Lock()
+
+        async def record(path: str, line: Dict[str, Any], ok: bool):
+            async with write_lock:
+                await asyncio.to_thread(_append_line, path, line)
+                if ok:
+                    batch.completed += 1
+                    self.requests_completed += 1
+                else:
+                    batch.failed += 1
+                    self.requests_failed += 1
+                metrics.BATCH_REQUESTS.inc(result="completed" if ok else "failed")
+                await self.store.save_batch(batch)
+
+        async def worker():
+            for custom_id, body in lines:
+                in_flight.add(custom_id)
+                line, ok = await self._run_line(batch.owner, custom_id, body)
+                # 结果已经拿到：移出 in_flight 和写入结果在同一步完成，超时取消打断不了已开始的写入，
+                # 不会再被当作未完成记一条 batch_expired
+                in_flight.discard(custom_id)
+                write = asyncio.ensure_future(record(output_path if ok else error_path, line, ok))
+                writes.add(write)
+                write.add_done_callback(writes.discard)
+                await asyncio.shield(write)
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending))))),
+                timeout=max(0.0, batch.expires_at - time.time()),
+            )
+            return BATCH_COMPLETED
+        except asyncio.TimeoutError:
+            # 超出完成窗口：没跑完的请求记为 batch_expired
+            logger.warning(f"⏰ 批任务 {batch.id} 超出完成窗口 ({batch.completion_window})")
+            # 等被打断时正在写的结果落盘
+            await asyncio.gather(*writes, return_exceptions=True)
+            unfinished = sorted(in_flight) + [custom_id for custom_id, _ in lines]
+            for custom_id in unfinished:
+                await record(error_path, self._error_line(custom_id, "batch_expired", "This request could not be executed before the completion window expired."), False)
+            return BATCH_EXPIRED
+
+    async def _run_line(self, owner: str, custom_id: str, body: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """执行一行请求 (失败按退避重试)，返回 (结果行, 是否成功)"""
+        body = {**body, "stream": False}
+        model = body.get("model")
+        request_id = f"req_{uuid.uuid4().hex}"
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                flight = await self._run(owner, body)
+                try:
+                    text = await flight.result()
+                finally:
+                    flight.unsubscribe()
+                completion = {
+                    "id": f"chatcmpl-{uuid.uuid4()}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                }
+                return self._response_line(custom_id, request_id, 200, completion), True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status_code = getattr(e, "status_code", 500)
+                message = str(getattr(e, "detail", "") or e) or type(e).__name__
+                # 4xx (429 除外) 是请求本身的问题，重试没有意义
+                if attempt >= self.max_attempts or (400 <= status_code < 500 and status_code != 429):
+                    error_body = {"error": {"message": message, "type": type(e).__name__, "code": status_code}}
+                    return self._response_line(custom_id, request_id, status_code, error_body), False
+                await asyncio.sleep(5 * attempt)
+
+    @staticmethod
+    def _response_line(custom_id: str, request_id: str, status_code: int, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": custom_id,
+            "response": {"status_code": status_code, "request_id": request_id, "body": body},
+            "error": None,
+        }
+
+    @staticmethod
+    def _error_line(custom_id: str, code: str, message: str) -> Dict[str, Any]:
+        return {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": custom_id,
+            "response": None,
+            "error": {"code": code, "message": message},
+        }
+
+    async def _finalize(self, batch: Batch, status: str):
+        """登记结果文件并写入最终状态"""
+        now = time.time()
+        if status != BATCH_FAILED:
+            batch.status = BATCH_FINALIZING
+            batch.finalizing_at = now
+        sizes = {}
+        for file_id, kind in ((batch.output_file_id, "output"), (batch.error_file_id, "error")):
+            path = self.store.path(file_id)
+            sizes[kind] = os.path.getsize(path) if os.path.exists(path) else 0
+            if sizes[kind]:
+                await self.store.save_file(StoredFile(
+                    id=file_id, owner=batch.owner, filename=f"{batch.id}_{kind}.jsonl",
+                    purpose="batch_output", bytes=sizes[kind], created_at=now,
+                ))
+        batch.has_output = sizes["output"] > 0
+        batch.has_errors = sizes["error"] > 0
+        batch.status = status
+        setattr(batch, f"{status}_at", now)
+        self._active.pop(batch.id, None)
+        await self.store.save_batch(batch)
+        logger.info(
+            f"📦 批任务 {batch.id} 结束: {status} (成功 {batch.completed}，失败 {batch.failed}，共 {batch.total})"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "persistent": self.store.persistent,
+            "active": len(self._active),
+            "concurrency": self.concurrency,
+            "requests_completed": self.requests_completed,
+            "requests_failed": self.requests_failed,
+            "resumed": self.resumed,
+            "active_batches": {
+                batch.id: {"status": batch.status, "total": batch.total, "completed": batch.completed, "failed": batch.failed}
+                for batch in self._active.values()
+            },
+        }
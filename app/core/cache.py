@@ -0,0 +1,280 @@
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+
+def make_cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    model: str
+    text: str
+    created_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.text.encode("utf-8"))
+
+
+class _SQLiteTier:
+    """磁盘层：容器重启后仍可命中。所有调用都放到线程里执行，不阻塞事件循环"""
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, model, text, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def _put(self, entry: CacheEntry):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, text, created_at) VALUES (?, ?, ?, ?)",
+                (entry.key, entry.model, entry.text, entry.created_at),
+            )
+            self._conn.commit()
+
+    def _delete(self, key: Optional[str] = None) -> int:
+        with self._lock:
+            if key is not None:
+                cur = self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            else:
+                cur = self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            return cur.rowcount
+
+    def _sweep(self, older_than: Optional[float]) -> Tuple[int, int]:
+        """删除过期条目；超出 max_bytes 时再从最旧的开始删，直到总字节数回到上限内。返回 (过期数, 淘汰数)"""
+        with self._lock:
+            expired = 0
+            if older_than is not None:
+                expired = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (older_than,)).rowcount
+            evicted = 0
+            if self.max_bytes > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(LENGTH(CAST(text AS BLOB))) "
+                    "OVER (ORDER BY created_at DESC, key) AS total FROM responses) WHERE total > ?)",
+                    (self.max_bytes,),
+                ).rowcount
+            self._conn.commit()
+            return expired, evicted
+
+    def _size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(LENGTH(CAST(text AS BLOB))), 0) FROM responses").fetchone()[0]
+
+    def _count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, entry: CacheEntry):
+        await asyncio.to_thread(self._put, entry)
+
+    async def delete(self, key: Optional[str] = None) -> int:
+        return await asyncio.to_thread(self._delete, key)
+
+    async def sweep(self, older_than: Optional[float]) -> Tuple[int, int]:
+        return await asyncio.to_thread(self._sweep, older_than)
+
+    async def count(self) -> int:
+        return await asyncio.to_thread(self._count)
+
+    async def size(self) -> int:
+        return await asyncio.to_thread(self._size)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    补全结果缓存：内存 LRU (按字节数淘汰) + 可选 SQLite 持久层，两层共用同一个 TTL。
+    持久层由后台任务每 sweep_interval 秒清理一次：删除过期条目，并按 disk_max_bytes 淘汰最旧的条目。
+    """
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: float,
+        sqlite_path: str = "",
+        disk_max_bytes: int = 0,
+        sweep_interval: float = 600.0,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+        self.disk: Optional[_SQLiteTier] = None
+        if sqlite_path:
+            try:
+                self.disk = _SQLiteTier(sqlite_path, disk_max_bytes)
+                logger.info(f"💾 响应缓存持久层已启用: {sqlite_path}")
+            except Exception as e:
+                logger.warning(f"⚠️ 无法打开缓存数据库 {sqlite_path}，仅使用内存缓存: {e}")
+
+        # 📊 统计
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stores = 0
+        self.disk_expirations = 0
+        self.disk_evictions = 0
+
+    def start(self):
+        """启动持久层的定期清理 (启动时先清理一次)"""
+        if self.disk and self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def sweep(self):
+        """清理一次持久层：过期条目 + 超出容量上限的最旧条目"""
+        if not self.disk:
+            return
+        older_than = time.time() - self.ttl if self.ttl > 0 else None
+        expired, evicted = await self.disk.sweep(older_than)
+        self.disk_expirations += expired
+        self.disk_evictions += evicted
+        if expired or evicted:
+            logger.info(f"🧹 缓存数据库已清理: 过期 {expired} 条，超出容量淘汰 {evicted} 条")
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"⚠️ 清理缓存数据库失败: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return self.ttl > 0 and time.time() - entry.created_at > self.ttl
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.bytes -= entry.size
+
+    def _insert(self, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            return
+        self._drop(entry.key)
+        self._entries[entry.key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes and self._entries:
+            oldest_key = next(iter(self._entries))
+            self._drop(oldest_key)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry and self._expired(entry):
+            self._drop(key)
+            self.expirations += 1
+            entry = None
+        if entry:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        if self.disk:
+            try:
+                entry = await self.disk.get(key)
+            except Exception as e:
+                logger.warning(f"⚠️ 读取缓存数据库失败: {e}")
+                entry = None
+            if entry and self._expired(entry):
+                self.expirations += 1
+                await self.disk.delete(key=key)
+                entry = None
+            if entry:
+                self._insert(entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, model: str, text: str):
+        entry = CacheEntry(key=key, model=model, text=text, created_at=time.time())
+        self._insert(entry)
+        self.stores += 1
+        if self.disk:
+            try:
+                await self.disk.put(entry)
+            except Exception as e:
+                logger.warning(f"⚠️ 写入缓存数据库失败: {e}")
+
+    async def purge(self, key: Optional[str] = None) -> int:
+        """清空缓存 (指定 key 时只删除该条)，返回删除的条数"""
+        if key is not None:
+            removed = 1 if key in self._entries else 0
+            self._drop(key)
+        else:
+            removed = len(self._entries)
+            self._entries.clear()
+            self.bytes = 0
+        if self.disk:
+            removed = max(removed, await self.disk.delete(key=key))
+        return removed
+
+    def list_entries(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """内存层条目，最近使用的在前"""
+        now = time.time()
+        entries = list(reversed(self._entries.values()))[:limit]
+        return [
+            {"key": e.key, "model": e.model, "bytes": e.size, "age": round(now - e.created_at, 1)}
+            for e in entries
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "persistent": self.disk is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stores": self.stores,
+            "disk_max_bytes": self.disk.max_bytes if self.disk else 0,
+            "disk_expirations": self.disk_expirations,
+            "disk_evictions": self.disk_evictions,
+        }
+
+    def close(self):
+        if self._sweep_task:
+            self._sweep_task.cancel()
+        if self.disk:
+            self.disk.close()
@@ -0,0 +1,142 @@
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.core import metrics
+
+
+class FairTicket:
+    """一次准入：持有期间占用一个名额，release() 可重复调用"""
+    def __init__(self, queue: "WeightedFairQueue", tenant: str):
+        self._queue = queue
+        self.tenant = tenant
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._queue._release()
+
+
+class _TenantStats:
+    __slots__ = ("waiting", "admitted", "total_wait", "max_wait", "last_finish")
+
+    def __init__(self):
+        self.waiting = 0
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # 该租户最近一次准入的虚拟完成时间
+        self.last_finish = 0.0
+
+
+class WeightedFairQueue:
+    """
+    加权公平队列 (start-time fair queuing)：同一时刻最多 capacity 个请求在预订时隙 / 租用窗口 / 等待发送，
+    其余请求按虚拟完成时间排队。每个租户的请求依次占用 1/weight 的虚拟时间，
+    所以权重为 4 的 key 在拥塞时拿到的额度是权重为 1 的 key 的 4 倍，且不会被对方的积压挡在后面。
+    """
+    def __init__(self, capacity: Callable[[], int]):
+        self._capacity = capacity
+        self.in_use = 0
+        self.virtual_time = 0.0
+        self._heap: List[Tuple[float, int, asyncio.Future, str, float]] = []
+        self._seq = itertools.count()
+        self._tenants: Dict[str, _TenantStats] = {}
+
+    @property
+    def capacity(self) -> int:
+        return max(1, self._capacity())
+
+    @property
+    def waiting(self) -> int:
+        return sum(t.waiting for t in self._tenants.values())
+
+    def waiting_for(self, tenant: str) -> int:
+        stats = self._tenants.get(tenant)
+        return stats.waiting if stats else 0
+
+    def ahead(self, tenant: str, weight: float = 1.0) -> int:
+        """如果该租户现在入队，前面会排着多少个请求 (有空闲名额时为 0)"""
+        if self.in_use < self.capacity and not any(not entry[2].done() for entry in self._heap):
+            return 0
+        stats = self._tenants.get(tenant)
+        start = max(self.virtual_time, stats.last_finish if stats else 0.0)
+        finish = start + 1.0 / weight
+        return sum(1 for entry in self._heap if entry[0] <= finish and not entry[2].done())
+
+    def _tenant(self, tenant: str) -> _TenantStats:
+        stats = self._tenants.get(tenant)
+        if stats is None:
+            stats = self._tenants[tenant] = _TenantStats()
+        return stats
+
+    def _tag(self, stats: _TenantStats, weight: float) -> Tuple[float, float]:
+        start = max(self.virtual_time, stats.last_finish)
+        finish = start + 1.0 / weight
+        stats.last_finish = finish
+        return start, finish
+
+    def _admit(self, tenant: str, start: float, waited: float) -> FairTicket:
+        stats = self._tenant(tenant)
+        stats.admitted += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        metrics.FAIR_QUEUE_WAIT_SECONDS.observe(waited, key=tenant)
+        return FairTicket(self, tenant)
+
+    async def acquire(self, tenant: str, weight: float = 1.0) -> FairTicket:
+        stats = self._tenant(tenant)
+        start, finish = self._tag(stats, weight)
+        enqueued_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, next(self._seq), future, tenant, start))
+        stats.waiting += 1
+        # 有空闲名额时立即放行 (future 直接完成，await 不会让出)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额刚分到手就被取消，交给下一个
+                self.in_use -= 1
+                self._dispatch()
+            elif stats.last_finish == finish:
+                # 排队时被取消且是该租户最后一个请求：退回它占的虚拟时间，租户不为没做的工作受罚
+                stats.last_finish = start
+            raise
+        finally:
+            stats.waiting -= 1
+        # 名额已由 _dispatch 占好
+        return self._admit(tenant, start, time.monotonic() - enqueued_at)
+
+    def _release(self):
+        self.in_use -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._heap and self.in_use < self.capacity:
+            _, _, future, tenant, start = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self.in_use += 1
+            self.virtual_time = max(self.virtual_time, start)
+            future.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "keys": {
+                name: {
+                    "waiting": stats.waiting,
+                    "admitted": stats.admitted,
+                    "avg_wait": round(stats.total_wait / stats.admitted, 3) if stats.admitted else 0.0,
+                    "max_wait": round(stats.max_wait, 3),
+                }
+                for name, stats in self._tenants.items()
+            },
+        }
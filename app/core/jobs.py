@@ -0,0 +1,463 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import socket
+import sqlite3
+import ipaddress
+import threading
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Set
+from urllib.parse import urlsplit
+from loguru import logger
+import httpx
+
+from app.core.single_flight import CompletionBroadcast
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+_COLUMNS = (
+    "id", "owner", "model", "request", "status", "created_at", "started_at", "finished_at",
+    "estimated_start_at", "attempts", "result", "error", "webhook_url", "webhook_status",
+)
+
+
+class JobQueueFull(Exception):
+    """排队中的任务数已达上限"""
+
+
+class WebhookURLError(ValueError):
+    """webhook_url 不合法或指向不允许回调的地址"""
+
+
+async def check_webhook_url(url: str, allowed_hosts: Sequence[str] = ()):
+    """
+    防 SSRF：webhook 必须是 http(s) URL；配置了 allowed_hosts 时主机名必须在列表里，
+    否则主机解析出的每个地址都必须是公网地址 (回环、内网、链路本地如 169.254.169.254 等一律拒绝)。
+    """
+    parts = urlsplit(str(url))
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise WebhookURLError("webhook_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if allowed_hosts:
+        if host not in {h.lower() for h in allowed_hosts}:
+            raise WebhookURLError(f"webhook host {host} is not in the allowed list")
+        return
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+        raise WebhookURLError(f"webhook host {host} cannot be resolved: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global:
+            raise WebhookURLError(f"webhook host {host} resolves to a non-public address ({address})")
+
+
+@dataclass
+class Job:
+    id: str
+    owner: str
+    model: str
+    request: Dict[str, Any]
+    status: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    estimated_start_at: Optional[float] = None
+    attempts: int = 0
+    result: Optional[str] = None
+    error: Optional[str] = None
+    webhook_url: Optional[str] = None
+    webhook_status: Optional[str] = None
+    # 运行期状态，不落盘
+    flight: Optional[CompletionBroadcast] = field(default=None, init=False, repr=False, compare=False)
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, init=False, repr=False, compare=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_row(self) -> tuple:
+        values = [getattr(self, name) for name in _COLUMNS]
+        values[_COLUMNS.index("request")] = json.dumps(self.request, ensure_ascii=False)
+        return tuple(values)
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Job":
+        values = dict(zip(_COLUMNS, row))
+        values["request"] = json.loads(values["request"])
+        return cls(**values)
+
+    def completion_body(self) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{self.id}",
+            "object": "chat.completion",
+            "created": int(self.finished_at or time.time()),
+            "model": self.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.result or ""}, "finish_reason": "stop"}],
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        body = {
+            "id": self.id,
+            "object": "job",
+            "status": self.status,
+            "model": self.model,
+            "created_at": self.created_at,
+            "estimated_start_at": self.estimated_start_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "attempts": self.attempts,
+            "error": self.error,
+        }
+        if self.webhook_url:
+            body["webhook"] = {"url": self.webhook_url, "status": self.webhook_status}
+        if self.status == JOB_COMPLETED:
+            body["result"] = self.completion_body()
+        return body
+
+
+class JobStore:
+    """任务持久层 (SQLite)：所有调用放到线程里执行；没有配置路径时用内存数据库"""
+    def __init__(self, path: str = ""):
+        self.path = path or ":memory:"
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, owner TEXT NOT NULL, model TEXT NOT NULL, request TEXT NOT NULL, "
+            "status TEXT NOT NULL, created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+            "estimated_start_at REAL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, "
+            "webhook_url TEXT, webhook_status TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.commit()
+
+    @property
+    def persistent(self) -> bool:
+        return self.path != ":memory:"
+
+    def _save(self, job: Job):
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO jobs ({', '.join(_COLUMNS)}) VALUES ({placeholders})", job.to_row())
+            self._conn.commit()
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def _load_unfinished(self) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JOB_QUEUED, JOB_RUNNING),
+            ).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def _purge(self, older_than: float) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' for _ in FINISHED_STATES)}) AND finished_at < ?",
+                (*FINISHED_STATES, older_than),
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    async def save(self, job: Job):
+        await asyncio.to_thread(self._save, job)
+
+    async def load(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._load, job_id)
+
+    async def load_unfinished(self) -> List[Job]:
+        return await asyncio.to_thread(self._load_unfinished)
+
+    async def purge(self, older_than: float) -> int:
+        return await asyncio.to_thread(self._purge, older_than)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobManager:
+    """
+    异步任务：提交后立即返回任务 ID，后台按普通请求的路径 (公平队列 → 限流 → 上游) 执行，
+    结果落盘，客户端可以轮询 / 长轮询 / 挂上 SSE 流，完成后可回调 webhook。
+    排队中的任务只是一个等待中的协程，几千个也不占多少资源；重启后未完成的任务会重新排队。
+    """
+    def __init__(
+        self,
+        run: Callable[[Job], Awaitable[CompletionBroadcast]],
+        estimate_start: Callable[[Job], Optional[float]],
+        store: JobStore,
+        max_pending: int = 10000,
+        max_attempts: int = 3,
+        retention: float = 86400.0,
+        webhook_timeout: float = 10.0,
+        webhook_retries: int = 3,
+        webhook_allowed_hosts: Sequence[str] = (),
+    ):
+        self._run = run
+        self._estimate_start = estimate_start
+        self.store = store
+        self.max_pending = max_pending
+        self.max_attempts = max(1, max_attempts)
+        self.retention = retention
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self.webhook_allowed_hosts = list(webhook_allowed_hosts)
+        self._active: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._purge_task: Optional[asyncio.Task] = None
+        self._webhook_client: Optional[httpx.AsyncClient] = None
+        self._webhook_tasks: Set[asyncio.Task] = set()
+        self._stopping = False
+
+        # 📊 统计
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.resumed = 0
+        self.webhooks_delivered = 0
+        self.webhooks_failed = 0
+
+    async def start(self):
+        """恢复上次未完成的任务 (运行到一半的也从头排队)"""
+        for job in await self.store.load_unfinished():
+            job.status = JOB_QUEUED
+            job.started_at = None
+            self._launch(job)
+            self.resumed += 1
+        if self.resumed:
+            logger.info(f"📋 已恢复 {self.resumed} 个未完成的异步任务")
+        if self.retention > 0:
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        """停止执行；排队 / 运行中的任务保留在库里，下次启动时继续"""
+        self._stopping = True
+        if self._purge_task:
+            self._purge_task.cancel()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 正在投递的 webhook 给几秒收尾，之后取消
+        webhooks = list(self._webhook_tasks)
+        if webhooks:
+            _, unfinished = await asyncio.wait(webhooks, timeout=self.webhook_timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*webhooks, return_exceptions=True)
+        if self._webhook_client:
+            await self._webhook_client.aclose()
+        self.store.close()
+
+    @property
+    def pending(self) -> int:
+        return len(self._active)
+
+    async def submit(self, owner: str, model: str, request: Dict[str, Any], webhook_url: Optional[str] = None) -> Job:
+        if self.pending >= self.max_pending:
+            raise JobQueueFull(f"too many pending jobs ({self.max_pending})")
+        job = Job(id=f"job-{uuid.uuid4().hex}", owner=owner, model=model, request=request, webhook_url=webhook_url)
+        estimate = self._estimate_start(job)
+        if estimate is not None:
+            job.estimated_start_at = round(job.created_at + estimate, 3)
+        await self.store.save(job)
+        self.submitted += 1
+        self._launch(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return self._active.get(job_id) or await self.store.load(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """长轮询：等到任务结束或超时，返回最新状态"""
+        job = self._active.get(job_id)
+        if job is None:
+            return await self.store.load(job_id)
+        deadline = time.monotonic() + timeout
+        while not job.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not await job.wait_change(remaining):
+                break
+        return job
+
+    async def stream(self, job: Job) -> AsyncIterator[str]:
+        """任务输出的文本片段：运行中的从头回放并跟随，已完成的一次给出全部结果"""
+        while not job.finished and job.flight is None:
+            await job.wait_change(30.0)
+        flight = job.flight
+        if flight is not None:
+            flight.subscribe()
+            try:
+                async for piece in flight.replay():
+                    yield piece
+                return
+            finally:
+                flight.unsubscribe()
+        if job.status == JOB_COMPLETED:
+            if job.result:
+                yield job.result
+        else:
+            raise RuntimeError(job.error or f"job {job.status}")
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._active.get(job_id)
+        if job is None:
+            return await self.store.load(job_id)
+        task = self._tasks.get(job_id)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if not job.finished:
+            # 任务还没开始执行就被取消，_execute 不会运行到收尾逻辑
+            self._tasks.pop(job_id, None)
+            job.status = JOB_CANCELLED
+            self.cancelled += 1
+            await self._finish(job)
+        return job
+
+    def _launch(self, job: Job):
+        self._active[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: Job):
+        try:
+            while True:
+                job.attempts += 1
+                try:
+                    flight = await self._run(job)
+                    job.flight = flight
+                    job.notify()
+                    try:
+                        await flight.wait_started()
+                        job.status = JOB_RUNNING
+                        job.started_at = time.time()
+                        job.notify()
+                        await self.store.save(job)
+                        job.result = await flight.result()
+                    finally:
+                        job.flight = None
+                        flight.unsubscribe()
+                    job.status = JOB_COMPLETED
+                    self.completed += 1
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    job.error = str(e) or type(e).__name__
+                    if job.attempts >= self.max_attempts:
+                        job.status = JOB_FAILED
+                        self.failed += 1
+                        logger.warning(f"📋 任务 {job.id} 失败 (第 {job.attempts} 次): {job.error}")
+                        break
+                    # 回到排队状态，稍后重试 (多半是上游额度不足)
+                    job.status = JOB_QUEUED
+                    job.started_at = None
+                    job.notify()
+                    await self.store.save(job)
+                    await asyncio.sleep(5 * job.attempts)
+        except asyncio.CancelledError:
+            if self._stopping:
+                # 服务关闭：保持排队状态，下次启动时恢复
+                return
+            job.status = JOB_CANCELLED
+            self.cancelled += 1
+        finally:
+            self._tasks.pop(job.id, None)
+        await self._finish(job)
+
+    async def _finish(self, job: Job):
+        job.finished_at = time.time()
+        self._active.pop(job.id, None)
+        job.notify()
+        await self.store.save(job)
+        if job.webhook_url and job.status != JOB_CANCELLED:
+            task = asyncio.create_task(self._deliver_webhook(job))
+            self._webhook_tasks.add(task)
+            task.add_done_callback(self._webhook_tasks.discard)
+
+    async def _deliver_webhook(self, job: Job):
+        if self._webhook_client is None:
+            self._webhook_client = httpx.AsyncClient(timeout=self.webhook_timeout)
+        payload = job.to_dict()
+        error = ""
+        delivered = False
+        for attempt in range(self.webhook_retries + 1):
+            try:
+                # 投递前重新检查：提交之后 DNS 可能已经改指向内网 (不合法的地址不再重试)
+                await check_webhook_url(job.webhook_url, self.webhook_allowed_hosts)
+            except WebhookURLError as e:
+                error = str(e)
+                break
+            try:
+                resp = await self._webhook_client.post(job.webhook_url, json=payload)
+                if resp.status_code < 300:
+                    delivered = True
+                    break
+                error = f"HTTP {resp.status_code}"
+            except httpx.HTTPError as e:
+                error = str(e) or type(e).__name__
+            if attempt < self.webhook_retries:
+                await asyncio.sleep(2 ** attempt)
+        if delivered:
+            job.webhook_status = "delivered"
+            self.webhooks_delivered += 1
+        else:
+            job.webhook_status = f"failed: {error}"
+            self.webhooks_failed += 1
+            logger.warning(f"📋 任务 {job.id} 的 webhook 回调失败: {error}")
+        await self.store.save(job)
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(600)
+            try:
+                removed = await self.store.purge(time.time() - self.retention)
+                if removed:
+                    logger.info(f"🧹 已清理 {removed} 个过期的异步任务")
+            except Exception as e:
+                logger.warning(f"⚠️ 清理异步任务失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "persistent": self.store.persistent,
+            "pending": self.pending,
+            "running": sum(1 for job in self._active.values() if job.status == JOB_RUNNING),
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "resumed": self.resumed,
+            "webhooks_delivered": self.webhooks_delivered,
+            "webhooks_failed": self.webhooks_failed,
+        }
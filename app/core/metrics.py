@@ -0,0 +1,238 @@
+import bisect
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# 采集回调返回单个数值，或 [(标签字典, 数值), ...]
+Sample = Union[float, Iterable[Tuple[Dict[str, str], float]]]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器；inc 只是一次字典更新，热路径上开销可以忽略"""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    瞬时值。可以直接 set/inc/dec，也可以传 collect 回调在抓取时现取
+    (池子、限流器这类已有状态的对象用回调，请求路径上零开销)。
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Sample]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        if self.collect is None:
+            return sorted(self._values.items())
+        sample = self.collect()
+        if isinstance(sample, (int, float)):
+            return [((), float(sample))]
+        return [(self._key(labels), float(value)) for labels, value in sample]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签: [各桶计数 (非累计)..., +Inf 桶], 总和
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key in sorted(self._counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), self._counts[key]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # 同名重复注册时以最新的为准 (例如 provider 重建后重新绑定回调)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              collect: Optional[Callable[[], Sample]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} 采集失败: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = MetricsRegistry()
+
+# --- 请求路径上直接更新的指标 (池子 / 限流器的瞬时状态由 provider 以回调方式注册) ---
+FAIR_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "toolbaz_fair_queue_wait_seconds", "请求在加权公平队列里排队的时间 (按 API Key)", ("key",),
+    buckets=(0, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300),
+)
+ADMISSION_DECISIONS = REGISTRY.counter(
+    "toolbaz_admission_decisions_total", "准入控制结果 (admitted / overloaded / unavailable)", ("result",)
+)
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "toolbaz_rate_limiter_wait_seconds", "预订到的限流时隙距预订时刻的等待时间",
+    buckets=(0, 1, 2.5, 5, 10, 15, 30, 60, 120, 300),
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "toolbaz_upstream_responses_total", "上游响应数 (按出口身份、接口和状态码，网络错误记为 error)", ("identity", "endpoint", "status")
+)
+UPSTREAM_QUOTA_LIMITS = REGISTRY.counter(
+    "toolbaz_upstream_quota_limit_total", "writing.php 返回 400 quota limit 的次数 (按出口身份)", ("identity",)
+)
+WORKER_INITS = REGISTRY.counter(
+    "toolbaz_worker_init_total", "浏览器窗口 (重新) 初始化次数", ("result",)
+)
+WORKER_RECYCLES = REGISTRY.counter(
+    "toolbaz_worker_recycle_total", "窗口轮换次数 (reason: uses / age / failure，mode: spare 热备顶替 / inplace 原地重建)",
+    ("reason", "mode"),
+)
+MINT_FAILURES = REGISTRY.counter(
+    "toolbaz_mint_failures_total", "铸造凭证失败次数 (按出口身份和原因)", ("identity", "cause")
+)
+MINT_FAILOVERS = REGISTRY.counter(
+    "toolbaz_mint_failovers_total", "铸造失败后立即重试的次数 (target: worker 换窗口 / reservoir 改用预铸凭证)", ("target",)
+)
+BROWSER_CRASHES = REGISTRY.counter(
+    "toolbaz_browser_crashes_total", "Chromium 断开 (崩溃 / 被杀) 次数 (按浏览器分片)", ("shard",)
+)
+BROWSER_RECOVERY_SECONDS = REGISTRY.histogram(
+    "toolbaz_browser_recovery_seconds", "从 Chromium 崩溃到各恢复阶段的耗时 (stage: relaunch 浏览器重启 / serving 首个窗口就绪 / full 全部窗口就绪)",
+    ("stage",), buckets=(1, 2, 3, 5, 8, 13, 20, 30, 60, 120),
+)
+RESOURCE_REQUESTS = REGISTRY.counter(
+    "toolbaz_resource_requests_total", "窗口发出的请求数 (按资源类型，action: allowed 放行 / blocked 拦截)", ("type", "action")
+)
+POOL_INVARIANT_VIOLATIONS = REGISTRY.counter(
+    "toolbaz_pool_invariant_violations_total", "窗口池账目 (total == idle + leased + recycling) 由正常变为不一致的次数"
+)
+WORKER_INIT_SECONDS = REGISTRY.histogram(
+    "toolbaz_worker_init_duration_seconds", "浏览器窗口 (重新) 初始化耗时",
+    buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120),
+)
+BATCH_REQUESTS = REGISTRY.counter(
+    "toolbaz_batch_requests_total", "批处理里已执行完的请求数 (completed / failed)", ("result",)
+)
+SSE_ACTIVE_STREAMS = REGISTRY.gauge(
+    "toolbaz_sse_active_streams", "正在下发的 SSE 流数量"
+)
+SSE_BYTES = REGISTRY.counter(
+    "toolbaz_sse_bytes_total", "已下发给客户端的 SSE 字节数"
+)
@@ -0,0 +1,214 @@
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Dict, Any, Optional
+
+
+class RateReservation:
+    """一次已预订的发送时隙：持有者在 slot_at 之前自行等待，无需占用任何锁"""
+    def __init__(self, limiter: "BaseRateLimiter", slot_at: float, interval: float):
+        self.limiter = limiter
+        self.slot_at = slot_at
+        self.interval = interval
+        self.reserved_at = time.monotonic()
+        self.cancelled = False
+
+    @property
+    def delay(self) -> float:
+        return max(0.0, self.slot_at - time.monotonic())
+
+    @property
+    def queued(self) -> bool:
+        """预订时是否需要等待 (限流器当时正在起作用)"""
+        return self.slot_at > self.reserved_at
+
+    async def wait(self):
+        delay = self.delay
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def cancel(self):
+        """放弃该时隙 (上游请求还没发出时)；只有它是最后一个预订时才把额度退还给限流器，返回是否退还"""
+        if self.cancelled:
+            return False
+        self.cancelled = True
+        return self.limiter.refund(self)
+
+
+class BaseRateLimiter(ABC):
+    """
+    限流器接口：reserve() 为 O(1) 的同步调用，立即算出并占下自己的时隙；
+    等待发生在调用方自己的协程里，互相之间没有锁竞争。
+    """
+    algorithm = "base"
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(1, burst)
+        # 最近一次预订：只有退掉它时才能回滚状态，退掉中间的预订会让后面的预订和新预订挤进同一段时间
+        self._tail: Optional[RateReservation] = None
+        # 📊 统计
+        self.reserved = 0
+        self.refunded = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def interval(self) -> float:
+        return 60.0 / self.rate_per_minute
+
+    def set_rate(self, rate_per_minute: float):
+        """调整速率 (自适应限流用)，已经发出的预订不受影响"""
+        self.rate_per_minute = rate_per_minute
+        # 间隔变了，旧预订已经无法按原间隔精确回滚
+        self._tail = None
+
+    @abstractmethod
+    def peek(self) -> float:
+        """如果现在预订，需要等待多少秒 (不占用时隙)"""
+
+    @abstractmethod
+    def available(self) -> float:
+        """当前可立即使用的额度；为负表示已有请求预订了未来的时隙 (欠账)"""
+
+    def slot_delay(self, ahead: int = 0) -> float:
+        """前面还有 ahead 个请求要预订时，自己的时隙大约在多少秒之后 (用于准入估算，不占用时隙)"""
+        return max(0.0, (ahead + 1 - self.available()) * self.interval)
+
+    @abstractmethod
+    def _reserve_slot(self, now: float) -> float:
+        """占下一个时隙，返回其 monotonic 时间点"""
+
+    @abstractmethod
+    def _refund_slot(self, reservation: RateReservation):
+        """回滚最后一个预订占用的时隙"""
+
+    def reserve(self) -> RateReservation:
+        now = time.monotonic()
+        slot_at = self._reserve_slot(now)
+        reservation = RateReservation(self, slot_at, self.interval)
+        self._tail = reservation
+        wait = slot_at - now
+        self.reserved += 1
+        if wait > 0:
+            self.delayed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return reservation
+
+    def refund(self, reservation: RateReservation) -> bool:
+        """退还时隙：只回滚最后一个预订，中间的预订留下空档 (宁可少发也不让后面的时隙重叠)"""
+        if reservation is not self._tail:
+            return False
+        self._tail = None
+        self.refunded += 1
+        self._refund_slot(reservation)
+        return True
+
+    async def acquire(self) -> RateReservation:
+        reservation = self.reserve()
+        await reservation.wait()
+        return reservation
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "algorithm": self.algorithm,
+            "rate_per_minute": round(self.rate_per_minute, 3),
+            "burst": self.burst,
+            "next_slot_in": round(self.peek(), 3),
+            "available": round(self.available(), 3),
+            "reserved": self.reserved,
+            "refunded": self.refunded,
+            "delayed": self.delayed,
+            "avg_wait": round(self.total_wait / self.delayed, 3) if self.delayed else 0.0,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+
+class GCRARateLimiter(BaseRateLimiter):
+    """通用信元速率算法：状态只有一个 TAT (理论到达时间)"""
+    algorithm = "gcra"
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        super().__init__(rate_per_minute, burst)
+        self.tat = 0.0
+
+    @property
+    def tolerance(self) -> float:
+        return (self.burst - 1) * self.interval
+
+    def peek(self) -> float:
+        now = time.monotonic()
+        return max(0.0, max(self.tat, now) - self.tolerance - now)
+
+    def available(self) -> float:
+        now = time.monotonic()
+        return self.burst - max(0.0, self.tat - now) / self.interval
+
+    def _reserve_slot(self, now: float) -> float:
+        tat = max(self.tat, now)
+        slot_at = max(now, tat - self.tolerance)
+        self.tat = tat + self.interval
+        return slot_at
+
+    def _refund_slot(self, reservation: RateReservation):
+        self.tat -= reservation.interval
+
+    def set_rate(self, rate_per_minute: float):
+        # 降速时把尚未消化的欠账按新间隔拉长；提速时不提前，避免和已预订的时隙挤在一起
+        now = time.monotonic()
+        backlog = max(0.0, self.tat - now) / self.interval
+        super().set_rate(rate_per_minute)
+        self.tat = max(self.tat, now + backlog * self.interval)
+
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """令牌桶：允许令牌数为负 (欠账)，欠多少就往后排多少"""
+    algorithm = "token_bucket"
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        super().__init__(rate_per_minute, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at) / self.interval)
+        self.updated_at = now
+
+    def peek(self) -> float:
+        now = time.monotonic()
+        tokens = min(float(self.burst), self.tokens + (now - self.updated_at) / self.interval)
+        return max(0.0, (1 - tokens) * self.interval)
+
+    def available(self) -> float:
+        now = time.monotonic()
+        return min(float(self.burst), self.tokens + (now - self.updated_at) / self.interval)
+
+    def _reserve_slot(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1
+        return now + max(0.0, -self.tokens * self.interval)
+
+    def _refund_slot(self, reservation: RateReservation):
+        self._refill(time.monotonic())
+        self.tokens = min(float(self.burst), self.tokens + 1)
+
+    def set_rate(self, rate_per_minute: float):
+        # 先按旧速率结算已补充的令牌
+        self._refill(time.monotonic())
+        super().set_rate(rate_per_minute)
+
+
+RATE_LIMITERS = {
+    GCRARateLimiter.algorithm: GCRARateLimiter,
+    TokenBucketRateLimiter.algorithm: TokenBucketRateLimiter,
+}
+
+
+def create_rate_limiter(algorithm: str, rate_per_minute: float, burst: int = 1) -> BaseRateLimiter:
+    try:
+        limiter_cls = RATE_LIMITERS[algorithm]
+    except KeyError:
+        raise ValueError(f"未知的限流算法: {algorithm} (可选: {', '.join(RATE_LIMITERS)})")
+    return limiter_cls(rate_per_minute, burst)
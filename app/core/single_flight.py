@@ -0,0 +1,151 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+from loguru import logger
+
+
+class CompletionBroadcast:
+    """
+    一次上游调用的结果广播：按顺序记录全部文本片段，
+    每个订阅者都会从第一个片段开始完整回放，不受加入时间早晚影响。
+    """
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.started = False
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.abandoned = False
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @classmethod
+    def from_text(cls, text: str) -> "CompletionBroadcast":
+        """用一段现成的文本 (如缓存命中) 构造一个已完成的广播"""
+        broadcast = cls()
+        broadcast.subscribe()
+        broadcast.started = True
+        if text:
+            broadcast.pieces.append(text)
+        broadcast.done = True
+        return broadcast
+
+    @property
+    def closed(self) -> bool:
+        return self.done or self.error is not None or self.abandoned
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _wait_change(self):
+        await self._changed.wait()
+
+    # --- 生产者 ---
+    def mark_started(self):
+        """上游已接受请求 (响应头 200)"""
+        self.started = True
+        self._notify()
+
+    def publish(self, piece: str):
+        self.pieces.append(piece)
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self._notify()
+
+    def fail(self, error: BaseException):
+        if self.error is None and not self.done:
+            self.error = error
+            self._notify()
+
+    def add_done_callback(self, callback: Callable[[], Any]):
+        """生产者协程结束 (包括还没开始就被取消) 时回调"""
+        if self._task is None or self._task.done():
+            callback()
+        else:
+            self._task.add_done_callback(lambda _: callback())
+
+    # --- 订阅者 ---
+    def subscribe(self):
+        self.subscribers += 1
+
+    def unsubscribe(self):
+        """最后一个订阅者离开且结果还没出来时，取消上游调用"""
+        self.subscribers -= 1
+        if self.subscribers <= 0 and not self.closed:
+            self.abandoned = True
+            if self._task and not self._task.done():
+                self._task.cancel()
+
+    async def wait_started(self):
+        while not self.started and self.error is None and not self.done:
+            await self._wait_change()
+        if not self.started and self.error is not None:
+            raise self.error
+
+    async def replay(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            while index < len(self.pieces):
+                yield self.pieces[index]
+                index += 1
+            if self.error is not None:
+                raise self.error
+            if self.done:
+                return
+            await self._wait_change()
+
+    async def result(self) -> str:
+        while not self.done and self.error is None:
+            await self._wait_change()
+        if self.error is not None:
+            raise self.error
+        return "".join(self.pieces)
+
+
+class SingleFlight:
+    """相同 key 的并发请求共用同一次上游调用"""
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[Hashable, CompletionBroadcast] = {}
+        # 📊 统计
+        self.started = 0
+        self.joined = 0
+
+    def join(self, key: Hashable, produce: Callable[[CompletionBroadcast], Awaitable[Any]]) -> CompletionBroadcast:
+        """加入正在进行的同 key 调用；没有则启动一个新的。返回的广播已为调用方订阅好"""
+        flight = self._flights.get(key) if self.enabled else None
+        if flight is not None and not flight.closed:
+            flight.subscribe()
+            self.joined += 1
+            logger.info(f"🔗 合并到进行中的相同请求 (当前订阅者: {flight.subscribers})")
+            return flight
+
+        flight = CompletionBroadcast()
+        flight.subscribe()
+        flight._task = asyncio.create_task(produce(flight))
+        self.started += 1
+        if self.enabled:
+            self._flights[key] = flight
+            flight._task.add_done_callback(lambda _: self._forget(key, flight))
+        return flight
+
+    def in_flight(self, key: Hashable) -> bool:
+        """是否已有相同 key 的调用在进行 (加入它不会产生新的上游调用)"""
+        flight = self._flights.get(key) if self.enabled else None
+        return flight is not None and not flight.closed
+
+    def _forget(self, key: Hashable, flight: CompletionBroadcast):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.started + self.joined
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "upstream_calls": self.started,
+            "coalesced": self.joined,
+            "coalesce_ratio": round(self.joined / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,268 @@
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from loguru import logger
+import httpx
+
+
+class Span:
+    """一个计时阶段；start / end 为 perf_counter 读数"""
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "end", "attrs")
+
+    def __init__(self, trace: "RequestTrace", name: str, parent_id: Optional[str], attrs: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def set(self, key: str, value: Any):
+        if self.attrs is None:
+            self.attrs = {}
+        self.attrs[key] = value
+
+
+# 当前协程所在的 span；asyncio 任务创建时会复制上下文，子任务里记录的阶段会归到同一个请求
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _SpanScope:
+    """span() 返回的上下文管理器，同时支持 with 和 async with"""
+    __slots__ = ("_name", "_attrs", "_span", "_token")
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]]):
+        self._name = name
+        self._attrs = attrs
+        self._span: Optional[Span] = None
+        self._token = None
+
+    def __enter__(self) -> Optional[Span]:
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        self._span = parent.trace.open(self._name, parent.span_id, self._attrs)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is None:
+            return False
+        self._span.end = time.perf_counter()
+        if exc_type is not None:
+            self._span.set("error", exc_type.__name__)
+        _current_span.reset(self._token)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def span(name: str, **attrs) -> _SpanScope:
+    """记录一个阶段；当前上下文没有请求追踪时什么也不做"""
+    return _SpanScope(name, attrs or None)
+
+
+def current_trace() -> Optional["RequestTrace"]:
+    current = _current_span.get()
+    return current.trace if current else None
+
+
+def annotate(key: str, value: Any):
+    """给当前 span 加一个属性 (例如是否命中凭证池)"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(key, value)
+
+
+class RequestTrace:
+    """
+    单个请求的阶段记录。
+    Server-Timing / x_timings 只包含响应发出前已结束的阶段；
+    流式响应在 SSE 结束后才 end()，完整的阶段在导出的 OTLP 数据里。
+    """
+    def __init__(self, name: str, exporter: Optional["OTLPExporter"] = None):
+        self.trace_id = os.urandom(16).hex()
+        self.exporter = exporter
+        self.started_ns = time.time_ns()
+        self.spans: List[Span] = []
+        self.root = Span(self, name, None)
+        self.ended = False
+        # 交给流式响应后由 SSE 结束时负责 end()
+        self.deferred = False
+        self._token = _current_span.set(self.root)
+
+    def open(self, name: str, parent_id: Optional[str], attrs: Optional[Dict[str, Any]] = None) -> Span:
+        child = Span(self, name, parent_id, attrs)
+        self.spans.append(child)
+        return child
+
+    def detach(self):
+        """离开 chat_completion 时恢复上下文，避免追踪泄漏到同一任务里的后续代码"""
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                pass
+            self._token = None
+
+    def end(self):
+        if self.ended:
+            return
+        self.ended = True
+        self.root.end = time.perf_counter()
+        if self.exporter is not None:
+            self.exporter.submit(self)
+
+    def totals(self) -> Dict[str, float]:
+        """已结束阶段按名称汇总的耗时 (毫秒)"""
+        totals: Dict[str, float] = {}
+        for s in self.spans:
+            if s.end is not None:
+                totals[s.name] = totals.get(s.name, 0.0) + (s.end - s.start) * 1000
+        return totals
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.totals().items()]
+        parts.append(f"total;dur={self.root.duration * 1000:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> Dict[str, float]:
+        timings = {name: round(ms, 1) for name, ms in self.totals().items()}
+        timings["total"] = round(self.root.duration * 1000, 1)
+        return timings
+
+    def _wall_ns(self, perf: float) -> int:
+        return self.started_ns + int((perf - self.root.start) * 1e9)
+
+    def to_otlp_spans(self) -> List[Dict[str, Any]]:
+        result = []
+        for s in [self.root, *self.spans]:
+            if s.end is None:
+                continue
+            item = {
+                "traceId": self.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 2 if s is self.root else 1,
+                "startTimeUnixNano": str(self._wall_ns(s.start)),
+                "endTimeUnixNano": str(self._wall_ns(s.end)),
+                "attributes": [_otlp_attr(k, v) for k, v in (s.attrs or {}).items()],
+            }
+            if s.parent_id:
+                item["parentSpanId"] = s.parent_id
+            if s.attrs and "error" in s.attrs:
+                item["status"] = {"code": 2}
+            result.append(item)
+        return result
+
+
+def start_trace(name: str, exporter: Optional["OTLPExporter"] = None) -> RequestTrace:
+    """开始记录一个请求，并把它设为当前上下文的根 span"""
+    return RequestTrace(name, exporter)
+
+
+def _otlp_attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class OTLPExporter:
+    """
+    把结束的请求以 OTLP/HTTP JSON 格式批量发给本地 collector (如 http://127.0.0.1:4318/v1/traces)。
+    队列满时直接丢弃，导出失败只记日志，不影响请求处理。
+    """
+    def __init__(self, endpoint: str, service_name: str, batch_size: int = 64,
+                 flush_interval: float = 2.0, max_queue: int = 2048):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: List[RequestTrace] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        # 📊 统计
+        self.exported = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def submit(self, trace: RequestTrace):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(trace)
+        if self._task is None:
+            self._task = asyncio.create_task(self._export_loop())
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _export_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._queue:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            payload = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [_otlp_attr("service.name", self.service_name)]},
+                    "scopeSpans": [{
+                        "scope": {"name": self.service_name},
+                        "spans": [s for trace in batch for s in trace.to_otlp_spans()],
+                    }],
+                }]
+            }
+            try:
+                if self._client is None:
+                    self._client = httpx.AsyncClient(timeout=5.0)
+                resp = await self._client.post(self.endpoint, json=payload)
+                if resp.status_code >= 300:
+                    raise ValueError(f"HTTP {resp.status_code}")
+                self.exported += len(batch)
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"⚠️ 导出追踪数据失败 ({len(batch)} 条): {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "queued": len(self._queue),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failures": self.failures,
+        }
+
+    async def aclose(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        await self.flush()
+        if self._client:
+            await self._client.aclose()
+            self._client = None
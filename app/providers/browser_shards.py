@@ -0,0 +1,75 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from app.providers.browser_supervisor import BrowserSupervisor
+from app.providers.egress import EgressIdentity
+from app.providers.pool_autoscaler import container_memory_limit
+
+ASSIGN_MODES = ("load", "round_robin")
+
+
+def cpu_limit() -> int:
+    """可用的 CPU 核数：取亲和性掩码和 cgroup 配额 (cpu.max / cfs_quota) 中较小的一个"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    for path, period_path in (
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+    ):
+        try:
+            with open(path) as f:
+                fields = f.read().split()
+            if period_path:
+                with open(period_path) as f:
+                    fields.append(f.read().strip())
+        except OSError:
+            continue
+        try:
+            quota, period = int(fields[0]), int(fields[1])
+        except (ValueError, IndexError):
+            # cpu.max 为 "max 100000" 表示不限
+            break
+        if quota > 0 and period > 0:
+            cpus = min(cpus, max(1, quota // period))
+        break
+    return max(1, cpus)
+
+
+def auto_shard_count(max_workers: int, memory_per_shard_mb: int) -> int:
+    """
+    自动决定 Chromium 进程数：每个分片一个核、memory_per_shard_mb 内存，且不多于窗口数
+    (容器没有内存上限时按物理内存算)。
+    """
+    count = cpu_limit()
+    memory = container_memory_limit()
+    if not memory and hasattr(os, "sysconf"):
+        try:
+            memory = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError):
+            memory = 0
+    if memory and memory_per_shard_mb > 0:
+        count = min(count, memory // (memory_per_shard_mb * 2**20))
+    return max(1, min(count, max_workers))
+
+
+class BrowserShard:
+    """
+    一个独立的 Chromium 进程及其窗口。每个分片有自己的崩溃监督：
+    一个分片崩溃只作废它自己的窗口并单独重启，其余分片照常服务。
+    """
+    def __init__(self, index: int):
+        self.index = index
+        self.name = f"shard-{index}"
+        self.browser: Optional[Any] = None
+        self.supervisor: Optional[BrowserSupervisor] = None
+        # 崩溃时本分片各身份的窗口数，重建时按原样恢复
+        self.rebuild_plan: List[EgressIdentity] = []
+
+    @property
+    def connected(self) -> bool:
+        return self.browser is not None
+
+    def get_stats(self, workers: int) -> Dict[str, Any]:
+        return {"workers": workers, **self.supervisor.get_stats()}
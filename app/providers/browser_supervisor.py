@@ -0,0 +1,127 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+from loguru import logger
+
+from app.core import metrics
+
+
+class BrowserCrashedError(Exception):
+    """Chromium 已崩溃 / 断开，正在排队租窗口的请求直接失败 (不再等待重建)"""
+    # 对调用方而言是暂时不可用 (批处理据此判断是否重试)
+    status_code = 503
+
+
+class BrowserSupervisor:
+    """
+    浏览器进程监督：监听 browser.on("disconnected")，Chromium 崩溃 (常见于 Docker shm 不足导致的 OOM) 后立即
+      1. on_crash：作废所有窗口，让排队租窗口的请求快速失败
+      2. 只重启一次浏览器 (多次断开信号合并为一次恢复，启动失败按指数退避重试)
+      3. rebuild：在新浏览器里并发重建它原有的全部窗口
+    并记录从崩溃到重新可用 (第一个窗口就绪) / 完全恢复 (全部窗口就绪) 的耗时。
+    """
+    def __init__(
+        self,
+        launch: Callable[[], Awaitable[Any]],
+        on_crash: Callable[[], None],
+        rebuild: Callable[[Any], Awaitable[None]],
+        max_backoff: float = 30.0,
+        name: str = "shard-0",
+    ):
+        self.name = name
+        self._launch = launch
+        self._on_crash = on_crash
+        self._rebuild = rebuild
+        self.max_backoff = max_backoff
+        self.browser: Optional[Any] = None
+        self.closing = False
+        self._task: Optional[asyncio.Task] = None
+        self._crashed_at = 0.0
+        self._awaiting_serving = False
+
+        # 📊 统计
+        self.crashes = 0
+        self.relaunch_failures = 0
+        self.last_relaunch_seconds: Optional[float] = None
+        self.last_time_to_serving: Optional[float] = None
+        self.last_time_to_recovery: Optional[float] = None
+
+    @property
+    def recovering(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def watch(self, browser):
+        """开始监督一个 (新启动的) 浏览器"""
+        self.browser = browser
+        browser.on("disconnected", self._on_disconnected)
+
+    def _on_disconnected(self, browser):
+        # 同一个浏览器的多次断开信号只处理一次 (处理后 self.browser 已置空)
+        if self.closing or browser is not self.browser:
+            return
+        if self.recovering:
+            # 重建期间新浏览器又崩了：放弃这一轮，从头恢复
+            self._task.cancel()
+        self._crashed_at = time.monotonic()
+        self._awaiting_serving = True
+        self.crashes += 1
+        metrics.BROWSER_CRASHES.inc(shard=self.name)
+        logger.error(f"💥 [{self.name}] Chromium 已断开 (进程崩溃或被杀)，重启浏览器...")
+        self.browser = None
+        self._on_crash()
+        self._task = asyncio.create_task(self._recover())
+
+    async def _recover(self):
+        backoff = 1.0
+        while not self.closing:
+            try:
+                browser = await self._launch()
+                break
+            except Exception as e:
+                self.relaunch_failures += 1
+                logger.error(f"❌ [{self.name}] 重启 Chromium 失败，{backoff:.0f} 秒后重试: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        else:
+            return
+        self.last_relaunch_seconds = time.monotonic() - self._crashed_at
+        metrics.BROWSER_RECOVERY_SECONDS.observe(self.last_relaunch_seconds, stage="relaunch")
+        logger.info(f"🚀 [{self.name}] Chromium 已重启 ({self.last_relaunch_seconds:.1f}s)，并发重建窗口...")
+        self.watch(browser)
+        await self._rebuild(browser)
+        self.last_time_to_recovery = time.monotonic() - self._crashed_at
+        metrics.BROWSER_RECOVERY_SECONDS.observe(self.last_time_to_recovery, stage="full")
+        logger.info(f"✅ [{self.name}] 窗口已全部恢复，耗时 {self.last_time_to_recovery:.1f}s")
+
+    def mark_serving(self):
+        """重建后第一个窗口就绪：服务恢复可用 (每次崩溃只记录一次)"""
+        if not self._awaiting_serving:
+            return
+        self._awaiting_serving = False
+        self.last_time_to_serving = time.monotonic() - self._crashed_at
+        metrics.BROWSER_RECOVERY_SECONDS.observe(self.last_time_to_serving, stage="serving")
+        logger.info(f"🟢 [{self.name}] 首个窗口已就绪，服务恢复 (距崩溃 {self.last_time_to_serving:.1f}s)")
+
+    async def stop(self):
+        self.closing = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 3) if value is not None else None
+
+        return {
+            "connected": self.browser is not None,
+            "recovering": self.recovering,
+            "crashes": self.crashes,
+            "relaunch_failures": self.relaunch_failures,
+            "last_relaunch_seconds": rounded(self.last_relaunch_seconds),
+            "last_time_to_serving": rounded(self.last_time_to_serving),
+            "last_time_to_recovery": rounded(self.last_time_to_recovery),
+        }
@@ -0,0 +1,129 @@
+import heapq
+import itertools
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit, unquote
+from loguru import logger
+
+from app.core.rate_limiter import BaseRateLimiter
+from app.providers.token_reservoir import TokenReservoir
+from app.utils.http_client import PooledHttpClient
+
+DIRECT = "direct"
+
+
+def playwright_proxy(proxy_url: str) -> Dict[str, str]:
+    """把代理 URL 转成 Playwright new_context(proxy=...) 的格式 (Chromium 的 SOCKS 代理不支持认证)"""
+    parts = urlsplit(proxy_url)
+    server = f"{parts.scheme}://{parts.hostname}"
+    if parts.port:
+        server += f":{parts.port}"
+    proxy = {"server": server}
+    if parts.username:
+        proxy["username"] = unquote(parts.username)
+        proxy["password"] = unquote(parts.password or "")
+    return proxy
+
+
+def proxy_display_name(proxy_url: str) -> str:
+    """日志 / 指标里使用的名字：scheme://host:port，不带账号密码"""
+    parts = urlsplit(proxy_url)
+    return f"{parts.scheme}://{parts.hostname}:{parts.port}" if parts.port else f"{parts.scheme}://{parts.hostname}"
+
+
+class EgressIdentity:
+    """
+    一个出口身份 (直连或某个代理)：上游按 IP 计额度，
+    所以每个身份都有自己的浏览器窗口、HTTP 连接池、限流器和预铸凭证池，互不混用。
+    所有模型共用该身份的一个限流器：额度按 IP 计，多一个模型名不会多一份额度。
+    """
+    def __init__(
+        self,
+        name: str,
+        proxy_url: Optional[str],
+        make_limiter: Callable[[str], BaseRateLimiter],
+    ):
+        self.name = name
+        self.proxy_url = proxy_url
+        self.rate_limiter = make_limiter(name)
+        self.http: Optional[PooledHttpClient] = None
+        self.token_reservoir: Optional[TokenReservoir] = None
+
+    @property
+    def playwright_proxy(self) -> Optional[Dict[str, str]]:
+        return playwright_proxy(self.proxy_url) if self.proxy_url else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "proxy": proxy_display_name(self.proxy_url) if self.proxy_url else None,
+            "rate_limiter": self.rate_limiter.get_stats(),
+            "token_reservoir": self.token_reservoir.get_stats() if self.token_reservoir else None,
+            "upstream_http": self.http.get_stats() if self.http else None,
+        }
+
+    async def aclose(self):
+        if self.token_reservoir:
+            await self.token_reservoir.stop()
+        if self.http:
+            await self.http.aclose()
+
+
+def build_identities(
+    proxies: List[str],
+    include_direct: bool,
+    make_limiter: Callable[[str], BaseRateLimiter],
+) -> List[EgressIdentity]:
+    """按配置生成出口身份列表；没有配置代理时只有一个直连身份"""
+    identities = []
+    if include_direct or not proxies:
+        identities.append(EgressIdentity(DIRECT, None, make_limiter))
+    for proxy_url in proxies:
+        identities.append(EgressIdentity(proxy_display_name(proxy_url), proxy_url, make_limiter))
+    if len(identities) > 1:
+        logger.info(f"🌍 出口身份: {', '.join(i.name for i in identities)}")
+    return identities
+
+
+class EgressScheduler:
+    """
+    把每次上游调用分配给最早有空闲时隙的身份；时隙相同时选排队最少的，再相同则轮流分配。
+    身份之间的额度互相独立，吞吐随身份数线性增长。
+    """
+    def __init__(self, identities: List[EgressIdentity], waiters_for):
+        self.identities = identities
+        self._waiters_for = waiters_for
+        self._turn = itertools.count()
+        # 📊 统计
+        self.assigned: Dict[str, int] = {i.name: 0 for i in identities}
+
+    def pick(self) -> EgressIdentity:
+        if len(self.identities) == 1:
+            identity = self.identities[0]
+        else:
+            offset = next(self._turn)
+            count = len(self.identities)
+            identity = min(
+                self.identities,
+                key=lambda i: (
+                    round(i.rate_limiter.peek(), 3),
+                    self._waiters_for(i.name),
+                    (self.identities.index(i) - offset) % count,
+                ),
+            )
+        self.assigned[identity.name] += 1
+        return identity
+
+    def estimate_start(self, ahead: int = 0) -> float:
+        """
+        前面还有 ahead 个请求排队时，新请求大约多少秒后能拿到时隙：
+        把各身份接下来的时隙按时间合并，取第 ahead + 1 个
+        """
+        limiters = [i.rate_limiter for i in self.identities]
+        slots = [(limiter.slot_delay(0), index, 0) for index, limiter in enumerate(limiters)]
+        heapq.heapify(slots)
+        for _ in range(ahead):
+            _, index, k = heapq.heappop(slots)
+            heapq.heappush(slots, (limiters[index].slot_delay(k + 1), index, k + 1))
+        return slots[0][0]
+
+    def get(self, name: str) -> Optional[EgressIdentity]:
+        return next((i for i in self.identities if i.name == name), None)
@@ -0,0 +1,202 @@
+import os
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from loguru import logger
+
+from app.providers.worker_pool import WorkerPool
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _children_map() -> Dict[int, List[int]]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                stat = f.read()
+            # comm 字段可能带空格/括号，从最后一个 ')' 之后开始解析
+            ppid = int(stat[stat.rindex(b")") + 2:].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def _process_memory(pid: int) -> int:
+    """进程实际占用内存 (字节)：优先 PSS (共享页按比例分摊)，拿不到时退回 RSS"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_tree_memory(root_pid: Optional[int] = None) -> int:
+    """
+    本进程派生出的全部子进程 (Playwright driver + Chromium 的 browser/renderer/gpu 进程) 的内存总和。
+    不在 Linux 上时返回 0。
+    """
+    if not os.path.isdir("/proc"):
+        return 0
+    root_pid = root_pid or os.getpid()
+    children = _children_map()
+    total = 0
+    stack = list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        total += _process_memory(pid)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+def container_memory_limit() -> int:
+    """cgroup v2 / v1 的内存上限 (字节)，没有限制时返回 0"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                raw = f.read().strip()
+        except OSError:
+            continue
+        if raw.isdigit() and int(raw) < 1 << 60:
+            return int(raw)
+    return 0
+
+
+class PoolAutoscaler:
+    """
+    浏览器池弹性伸缩：
+      - 有请求排队等窗口 → 扩容 (不超过 max_size，且预计内存不超过预算)
+      - 空闲窗口闲置超过 idle_timeout → 关闭最久未使用的窗口 (不低于 min_size，且每个出口身份至少保留一个窗口)
+      - Chromium 进程树内存超出预算 → 立即关闭最久未使用的空闲窗口
+    """
+    def __init__(
+        self,
+        pool: WorkerPool,
+        spawn: Callable[[], None],
+        close: Callable[[Any], Awaitable[None]],
+        min_size: int,
+        max_size: int,
+        memory_budget: int = 0,
+        interval: float = 2.0,
+        idle_timeout: float = 120.0,
+        scale_up_waiters: int = 1,
+        scale_up_cooldown: float = 5.0,
+    ):
+        self.pool = pool
+        self._spawn = spawn
+        self._close = close
+        self.min_size = max(0, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.memory_budget = memory_budget
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.scale_up_waiters = max(1, scale_up_waiters)
+        self.scale_up_cooldown = scale_up_cooldown
+        self._task: Optional[asyncio.Task] = None
+        self._last_scale_up = 0.0
+
+        # 📊 统计
+        self.memory = 0
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.memory_blocked = 0
+        self.memory_evictions = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            budget = f"{self.memory_budget / 2**20:.0f}MB" if self.memory_budget else "不限"
+            logger.info(f"📈 浏览器池弹性伸缩已启动 (范围: {self.min_size}~{self.max_size}, 内存预算: {budget})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    @property
+    def per_worker_memory(self) -> float:
+        """每个窗口的平均内存 (用当前进程树内存粗略估算)"""
+        size = self.pool.size
+        return self.memory / size if size else 0.0
+
+    def _memory_allows(self, extra_workers: int) -> bool:
+        if not self.memory_budget:
+            return True
+        return self.memory + self.per_worker_memory * extra_workers <= self.memory_budget
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.step()
+            except Exception as e:
+                logger.error(f"❌ 弹性伸缩出错: {e}")
+
+    async def step(self):
+        """执行一轮伸缩决策"""
+        self.memory = await asyncio.to_thread(process_tree_memory)
+
+        pool = self.pool
+        # 正在初始化的窗口很快就会接走排队的请求，扩容时不重复计算
+        pending = pool.waiters - pool.recycling
+        now = time.monotonic()
+        if (
+            pending >= self.scale_up_waiters
+            and pool.size < self.max_size
+            and now - self._last_scale_up >= self.scale_up_cooldown
+        ):
+            grow = min(pending, self.max_size - pool.size)
+            while grow > 0 and not self._memory_allows(grow):
+                grow -= 1
+            if grow <= 0:
+                self.memory_blocked += 1
+                logger.warning(f"🧠 内存已接近预算 ({self.memory / 2**20:.0f}MB)，暂不扩容 (排队: {pool.waiters})")
+            else:
+                for _ in range(grow):
+                    self._spawn()
+                self._last_scale_up = now
+                self.scale_ups += grow
+                logger.info(f"📈 扩容 {grow} 个窗口 (排队: {pool.waiters}, 当前: {pool.size}/{self.max_size})")
+            return
+
+        if pool.size <= self.min_size:
+            return
+
+        over_budget = bool(self.memory_budget) and self.memory > self.memory_budget
+        worker = pool.retire_idle(0 if over_budget else self.idle_timeout)
+        if worker is None:
+            return
+        self.scale_downs += 1
+        if over_budget:
+            self.memory_evictions += 1
+            logger.warning(f"🧠 内存超出预算 ({self.memory / 2**20:.0f}MB)，关闭最久未使用的窗口 [Worker-{worker.id}]")
+        else:
+            logger.info(f"📉 缩容：关闭闲置窗口 [Worker-{worker.id}] (剩余: {pool.size})")
+        await self._close(worker)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "memory_mb": round(self.memory / 2**20, 1),
+            "memory_budget_mb": round(self.memory_budget / 2**20, 1) if self.memory_budget else None,
+            "per_worker_mb": round(self.per_worker_memory / 2**20, 1),
+            "scale_ups": self.scale_ups,
+            "scale_downs": self.scale_downs,
+            "memory_blocked": self.memory_blocked,
+            "memory_evictions": self.memory_evictions,
+        }
@@ -0,0 +1,102 @@
+import asyncio
+from typing import Dict, List, Sequence, Set
+from loguru import logger
+from playwright.async_api import Error as PlaywrightError
+
+from app.core import metrics
+
+# 诊断时最多记录多少条被拦截的 URL
+MAX_RECORDED_URLS = 200
+
+
+class ResourcePolicy:
+    """
+    窗口的资源拦截策略 (按顺序判断)：
+      1. URL 命中 allow_urls → 放行
+      2. URL 命中 deny_urls (广告 / 统计等) → 拦截
+      3. 资源类型在 allow_types 里 (默认只有 document / script，xA1pY 和 SessionID 只需要这些) → 放行，否则拦截
+    URL 规则为子串匹配。enabled=False 时全部放行 (仍然统计流量，用作诊断时的对照组)。
+    """
+    def __init__(
+        self,
+        allow_types: Sequence[str] = ("document", "script"),
+        allow_urls: Sequence[str] = (),
+        deny_urls: Sequence[str] = (),
+        enabled: bool = True,
+    ):
+        self.allow_types = set(allow_types)
+        self.allow_urls = list(allow_urls)
+        self.deny_urls = list(deny_urls)
+        self.enabled = enabled
+
+    @classmethod
+    def allow_all(cls) -> "ResourcePolicy":
+        return cls(enabled=False)
+
+    def allows(self, url: str, resource_type: str) -> bool:
+        if not self.enabled:
+            return True
+        if any(pattern in url for pattern in self.allow_urls):
+            return True
+        if any(pattern in url for pattern in self.deny_urls):
+            return False
+        return resource_type in self.allow_types
+
+
+class ResourceTracker:
+    """
+    挂在一个浏览器上下文上：通过 context.route 按策略放行 / 拦截每个请求，
+    统计放行请求实际下载的字节数 (响应头 + 响应体) 和按类型分的拦截次数。
+    """
+    def __init__(self, policy: ResourcePolicy, record_urls: bool = False):
+        self.policy = policy
+        self.record_urls = record_urls
+        self.allowed = 0
+        self.bytes = 0
+        self.blocked: Dict[str, int] = {}
+        self.blocked_urls: List[str] = []
+        self._pending: Set[asyncio.Task] = set()
+
+    @property
+    def blocked_total(self) -> int:
+        return sum(self.blocked.values())
+
+    async def attach(self, context):
+        await context.route("**/*", self._handle)
+        context.on("requestfinished", self._on_finished)
+
+    async def _handle(self, route):
+        request = route.request
+        kind = request.resource_type
+        try:
+            if self.policy.allows(request.url, kind):
+                self.allowed += 1
+                metrics.RESOURCE_REQUESTS.inc(type=kind, action="allowed")
+                await route.continue_()
+                return
+            self.blocked[kind] = self.blocked.get(kind, 0) + 1
+            metrics.RESOURCE_REQUESTS.inc(type=kind, action="blocked")
+            if self.record_urls and len(self.blocked_urls) < MAX_RECORDED_URLS:
+                self.blocked_urls.append(f"{kind} {request.url}")
+            await route.abort("blockedbyclient")
+        except PlaywrightError as e:
+            # 上下文已关闭 (窗口重置 / 浏览器崩溃)，请求本来就不会再完成
+            logger.debug(f"拦截规则处理请求失败 (上下文已关闭?): {e}")
+
+    def _on_finished(self, request):
+        task = asyncio.ensure_future(self._count_bytes(request))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _count_bytes(self, request):
+        try:
+            sizes = await request.sizes()
+        except PlaywrightError:
+            return
+        self.bytes += sizes.get("responseHeadersSize", 0) + max(0, sizes.get("responseBodySize", 0))
+
+    async def settle(self, timeout: float = 5.0):
+        """等已完成请求的字节数统计落账 (预热结束时调用)"""
+        if self._pending:
+            await asyncio.wait(list(self._pending), timeout=timeout)
+
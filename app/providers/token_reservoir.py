@@ -0,0 +1,160 @@
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, Any, Optional
+from collections import deque
+from loguru import logger
+
+
+@dataclass
+class SecurityToken:
+    """一组可直接用于 writing.php 的完整凭证"""
+    session_id: str
+    payload_token: str
+    capcha_token: str
+    minted_at: float = field(default_factory=time.time)
+    expires_at: float = 0.0
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.minted_at
+
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) >= self.expires_at
+
+
+class TokenReservoir:
+    """
+    预铸凭证池：后台持续保持 N 组 (SessionID, xA1pY token, capcha token)，
+    请求路径直接弹出一组即可，省掉浏览器取 Token + token.php 两次串行往返。
+    凭证有效期会根据上游的接受/拒绝情况自动学习。
+    """
+    def __init__(
+        self,
+        mint: Callable[[], Awaitable[Optional[SecurityToken]]],
+        size: int,
+        ttl: float,
+        min_ttl: float,
+        max_ttl: float,
+    ):
+        self._mint = mint
+        self.size = size
+        self.learned_ttl = ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self._tokens: Deque[SecurityToken] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.running = False
+
+        # 📊 统计
+        self.hits = 0
+        self.misses = 0
+        self.minted = 0
+        self.expired = 0
+        self.rejected = 0
+        self.mint_failures = 0
+
+    def start(self):
+        if self.size <= 0 or self._task:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._refill_loop())
+        logger.info(f"🪙 凭证池已启动 (容量: {self.size}, 初始有效期: {self.learned_ttl:.0f}s)")
+
+    async def stop(self):
+        self.running = False
+        self._wakeup.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        self._tokens.clear()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def pop(self) -> Optional[SecurityToken]:
+        """取出一组未过期的凭证，没有则返回 None (记一次 miss)"""
+        self._purge_expired()
+        token = self._tokens.popleft() if self._tokens else None
+        if token:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._wakeup.set()
+        return token
+
+    def report_accepted(self, token: SecurityToken):
+        """上游接受了该凭证：若它已接近当前有效期上限，说明有效期可以放宽"""
+        if token.age >= self.learned_ttl * 0.8:
+            self.learned_ttl = min(self.max_ttl, self.learned_ttl * 1.1)
+
+    def report_rejected(self, token: SecurityToken):
+        """上游拒绝了该凭证：把有效期收紧到它被拒绝时年龄的 80%"""
+        self.rejected += 1
+        self.learned_ttl = max(self.min_ttl, min(self.learned_ttl, token.age * 0.8))
+        logger.warning(f"🪙 预铸凭证被拒绝 (年龄 {token.age:.1f}s)，有效期收紧为 {self.learned_ttl:.1f}s")
+        # 同批次更老的凭证大概率也已失效
+        self._purge_expired()
+
+    def stamp(self, token: SecurityToken) -> SecurityToken:
+        """按当前学到的有效期给凭证打上过期时间"""
+        token.expires_at = token.minted_at + self.learned_ttl
+        return token
+
+    def _purge_expired(self):
+        now = time.time()
+        while self._tokens and (
+            self._tokens[0].is_expired(now) or self._tokens[0].age >= self.learned_ttl
+        ):
+            self._tokens.popleft()
+            self.expired += 1
+
+    async def _refill_loop(self):
+        while self.running:
+            try:
+                self._purge_expired()
+                if len(self._tokens) >= self.size:
+                    # 等到最早的凭证过期或有人取走凭证再补货
+                    timeout = max(0.5, self._tokens[0].expires_at - time.time())
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                token = await self._mint()
+                if token is None:
+                    # 当前没有可让出的窗口，稍后再试
+                    await asyncio.sleep(0.5)
+                    continue
+                self._tokens.append(self.stamp(token))
+                self.minted += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.mint_failures += 1
+                logger.warning(f"⚠️ 凭证池补货失败: {e}")
+                await asyncio.sleep(5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._tokens),
+            "capacity": self.size,
+            "learned_ttl": round(self.learned_ttl, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "miss_rate": round(self.misses / lookups, 4) if lookups else 0.0,
+            "minted": self.minted,
+            "expired": self.expired,
+            "expiry_waste_rate": round(self.expired / self.minted, 4) if self.minted else 0.0,
+            "rejected": self.rejected,
+            "mint_failures": self.mint_failures,
+        }
@@ -1,33 +1,95 @@
 import json
+import math
 import time
 import uuid
 import asyncio
 import random
-import re
-import html
-from typing import Dict, Any, Optional, List
-from fastapi import HTTPException
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
+from fastapi import HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from playwright.async_api import async_playwright, Page, BrowserContext, Error as PlaywrightError
 from loguru import logger
 import httpx
 
 from app.core.config import settings
+from app.core.rate_limiter import BaseRateLimiter, RateReservation, create_rate_limiter
+from app.core.adaptive_rate import AdaptiveRateController
+from app.core.api_keys import ApiKey, ANONYMOUS
+from app.core.fair_queue import WeightedFairQueue, FairTicket
+from app.core.admission import AdmissionController, AdmissionDecision, PendingAdmission
 from app.utils.sse_utils import create_sse_data, create_chat_completion_chunk, DONE_CHUNK
+from app.utils.text_utils import clean_response_text, StreamingTextCleaner
+from app.utils.http_client import PooledHttpClient
+from app.utils.disconnect import run_until_disconnect, ClientDisconnected
+from app.providers.token_reservoir import TokenReservoir, SecurityToken
+from app.providers.worker_pool import WorkerPool
+from app.providers.pool_autoscaler import PoolAutoscaler, container_memory_limit
+from app.providers.worker_recycler import WorkerRecycler
+from app.providers.browser_supervisor import BrowserSupervisor, BrowserCrashedError
+from app.providers.browser_shards import ASSIGN_MODES, BrowserShard, auto_shard_count
+from app.providers.resource_policy import ResourcePolicy, ResourceTracker
+from app.providers.egress import EgressIdentity, EgressScheduler, build_identities
+from app.core.single_flight import SingleFlight, CompletionBroadcast
+from app.core.cache import ResponseCache, make_cache_key
+from app.core import tracing
+from app.core import metrics
+from app.core.tracing import OTLPExporter
+
+class QuotaLimitError(Exception):
+    """writing.php 返回 400 quota limit：不是窗口的问题，是当前 IP 没额度了"""
+    # 对调用方而言等同于限流 (批处理据此判断是否重试)
+    status_code = 429
+
+
+class MintError(Exception):
+    """
+    铸造凭证失败。cause 为失败原因 (计数用)；worker_fault 表示问题出在窗口本身，
+    该窗口要送去后台重置，否则 (如 token.php 网络错误) 窗口照常归还。
+    """
+    def __init__(self, cause: str, message: str, worker_fault: bool = True):
+        super().__init__(message)
+        self.cause = cause
+        self.worker_fault = worker_fault
+
 
 # --- 单个工作单元 (Worker) ---
 class BrowserWorker:
-    """代表一个独立的浏览器无痕窗口"""
-    def __init__(self, browser):
+    """代表一个独立的浏览器无痕窗口 (绑定到某个出口身份，位于某个浏览器分片)"""
+    def __init__(
+        self,
+        browser,
+        identity: Optional[EgressIdentity] = None,
+        shard: Optional[BrowserShard] = None,
+        policy: Optional[ResourcePolicy] = None,
+        record_blocked: bool = False,
+    ):
         self.browser = browser
+        self.identity = identity
+        self.shard = shard
+        # 🚫 资源拦截策略 (None 表示不拦截也不统计)；record_blocked 时记下被拦截的 URL (诊断用)
+        self.policy = policy
+        self.record_blocked = record_blocked
+        self.resources: Optional[ResourceTracker] = None
+        # 最近一次预热：打开页面的耗时 (秒) 和期间下载的字节数
+        self.warmup_seconds = 0.0
+        self.warmup_bytes = 0
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
         self.uses_count = 0
         self.created_at = 0
+        self.last_used = 0.0
         self.id = str(uuid.uuid4())[:8]
 
     async def init(self):
         """初始化这个窗口"""
+        started = time.monotonic()
+        success = await self._init()
+        metrics.WORKER_INITS.inc(result="success" if success else "failure")
+        metrics.WORKER_INIT_SECONDS.observe(time.monotonic() - started)
+        return success
+
+    async def _init(self):
         try:
             if self.context:
                 await self.close()
@@ -40,8 +102,12 @@ class BrowserWorker:
                 timezone_id="Asia/Shanghai",
                 java_script_enabled=True,
                 bypass_csp=True,
-                ignore_https_errors=True
+                ignore_https_errors=True,
+                proxy=self.identity.playwright_proxy if self.identity else None
             )
+            if self.policy:
+                self.resources = ResourceTracker(self.policy, record_urls=self.record_blocked)
+                await self.resources.attach(self.context)
             
             self.page = await self.context.new_page()
             # 屏蔽 webdriver 特征
@@ -56,11 +122,13 @@ class BrowserWorker:
                     # 随机延迟
                     await asyncio.sleep(random.uniform(1, 2))
                     
+                    goto_started = time.monotonic()
                     await self.page.goto(
-                        "https://toolbaz.com/writer/chat-gpt-alternative", 
+                        settings.TOOLBAZ_WRITER_URL, 
                         wait_until="domcontentloaded", 
                         timeout=45000
                     )
+                    self.warmup_seconds = time.monotonic() - goto_started
                     break 
                 except PlaywrightError as e:
                     if "ERR_CONNECTION_CLOSED" in str(e) or "Timeout" in str(e):
@@ -75,6 +143,10 @@ class BrowserWorker:
             try:
                 await self.page.mouse.move(random.randint(100, 500), random.randint(100, 500))
             except: pass
+
+            if self.resources:
+                await self.resources.settle()
+                self.warmup_bytes = self.resources.bytes
             
             self.created_at = time.time()
             self.uses_count = 0
@@ -86,23 +158,30 @@ class BrowserWorker:
             return False
 
     async def get_token_data(self):
-        """在这个特定窗口中获取 Token"""
+        """
+        在这个特定窗口中获取 Token。
+        页面已关闭或 xA1pY 未就绪时直接返回错误，不在请求路径上重建 / 刷新页面：
+        调用方会换一个窗口重试，这个窗口送去后台重置。
+        """
         if not self.page or self.page.is_closed():
-            success = await self.init()
-            if not success:
-                return {"error": "Worker re-init failed"}
+            return {"error": "Page closed", "cause": "page_closed"}
 
         try:
-            await self.page.wait_for_function("typeof window.xA1pY === 'function' || typeof xA1pY === 'function'", timeout=5000)
-        except:
-            try:
-                logger.warning(f"⚠️ [Worker-{self.id}] 函数未就绪，尝试刷新页面...")
-                await self.page.reload(wait_until="domcontentloaded", timeout=30000)
-                await asyncio.sleep(2)
-            except Exception as e:
-                return {"error": f"Reload failed: {str(e)}"}
+            with tracing.span("wait_xa1py"):
+                await self.page.wait_for_function("typeof window.xA1pY === 'function' || typeof xA1pY === 'function'", timeout=5000)
+        except Exception as e:
+            return {"error": f"xA1pY not ready: {e}", "cause": "xa1py_missing"}
 
-        result = await self.page.evaluate("""() => {
+        with tracing.span("page_evaluate"):
+            result = await self._evaluate_token()
+        if result.get("error"):
+            result["cause"] = "evaluate_error"
+
+        self.uses_count += 1
+        return result
+
+    async def _evaluate_token(self):
+        return await self.page.evaluate("""() => {
             try {
                 function getCookie(name) {
                     const value = `; ${document.cookie}`;
@@ -126,9 +205,6 @@ class BrowserWorker:
                 return { sessionId, token };
             } catch (e) { return { error: e.toString() }; }
         }""")
-        
-        self.uses_count += 1
-        return result
 
     async def close(self):
         try:
@@ -141,22 +217,258 @@ class BrowserWorker:
 class ToolbazProvider:
     def __init__(self):
         self.playwright = None
-        self.browser = None
-        self.pool = asyncio.Queue()
-        self.api_token_url = "https://data.toolbaz.com/token.php"
-        self.api_writing_url = "https://data.toolbaz.com/writing.php"
-        
-        # 🔥 限流器变量
-        self.request_timestamps: List[float] = []
-        self.rate_limit_lock = asyncio.Lock()
+        # 窗口按出口身份分组：铸造凭证的窗口和发送请求的连接必须走同一个出口
+        self.pool = WorkerPool(key=lambda worker: worker.identity.name if worker.identity else None)
+        self.api_base_url = settings.TOOLBAZ_API_BASE_URL.rstrip("/")
+        self.api_token_url = f"{self.api_base_url}/token.php"
+        self.api_writing_url = f"{self.api_base_url}/writing.php"
+
+        # 📉 自适应限流：按出口身份学习上游真实额度
+        self.adaptive_rate: Optional[AdaptiveRateController] = None
+        if settings.RATE_LIMIT_ADAPTIVE:
+            self.adaptive_rate = AdaptiveRateController(
+                initial_rate=settings.RATE_LIMIT_PER_MINUTE,
+                min_rate=settings.RATE_LIMIT_MIN_PER_MINUTE,
+                max_rate=settings.RATE_LIMIT_MAX_PER_MINUTE,
+                increase=settings.RATE_LIMIT_INCREASE,
+                decrease=settings.RATE_LIMIT_DECREASE,
+                state_path=settings.RATE_LIMIT_STATE_PATH,
+            )
+
+        # 🌍 出口身份：每个身份有独立的限流器 (算法、速率、突发量见 Settings；自适应时每个模型一个)、
+        # 长连接客户端和预铸凭证池 (后两者在 initialize 中创建)
+        self.identities: List[EgressIdentity] = build_identities(
+            settings.EGRESS_PROXIES,
+            settings.EGRESS_INCLUDE_DIRECT,
+            self._create_rate_limiter,
+        )
+        self.scheduler = EgressScheduler(self.identities, self.pool.waiters_for)
         self.running = False
 
+        # ⚖️ 预订时隙之前按 API Key 权重排队，批量调用方不会占满全部额度
+        self.fair_queue: Optional[WeightedFairQueue] = None
+        if settings.FAIR_QUEUE_ENABLED:
+            self.fair_queue = WeightedFairQueue(
+                capacity=lambda: max(settings.FAIR_QUEUE_SLOTS_PER_IDENTITY, settings.RATE_LIMIT_BURST) * len(self.identities)
+            )
+
+        # 🔗 相同 (model, prompt) 的并发请求合并为一次上游调用
+        self.single_flight = SingleFlight(enabled=settings.SINGLE_FLIGHT_ENABLED)
+        # 💾 响应缓存 (initialize 中创建)
+        self.cache: Optional[ResponseCache] = None
+        # 📊 客户端提前断开的次数 / 因此退还的限流时隙数
+        self.client_disconnects = 0
+        self.disconnect_refunds = 0
+        # 最近几次铸造凭证的耗时 (秒，指数滑动平均)，用来决定提前多久租用窗口
+        self.mint_latency = 2.0
+        # 📊 铸造失败次数 (按原因) / 失败后换窗口或改用预铸凭证重试的次数
+        self.mint_failures: Dict[str, int] = {}
+        self.mint_failovers = 0
+        # 🚪 准入控制用到的耗时估计 (秒，指数滑动平均)：
+        # writing.php 发出到响应头 / 到正文结束，以及窗口 (重新) 初始化
+        self.admission = AdmissionController(enabled=settings.ADMISSION_CONTROL)
+        self.upstream_ttfb = 2.0
+        self.upstream_latency = 8.0
+        self.worker_init_latency = 10.0
+        # ⏱️ 阶段追踪导出 (未配置 collector 时为 None)
+        self.trace_exporter: Optional[OTLPExporter] = None
+        if settings.TRACING_ENABLED and settings.TRACING_OTLP_ENDPOINT:
+            self.trace_exporter = OTLPExporter(settings.TRACING_OTLP_ENDPOINT, settings.TRACING_SERVICE_NAME)
+        # 📈 浏览器池弹性伸缩
+        self.autoscaler: Optional[PoolAutoscaler] = None
+        if settings.POOL_AUTOSCALE:
+            self.autoscaler = self._create_autoscaler()
+        # ♻️ 后台轮换用满 / 超龄的窗口，并为每个身份常备热备窗口
+        self.recycler = WorkerRecycler(
+            self.pool,
+            self.identities,
+            create=self._new_worker,
+            rebuild=lambda worker: self._recycle_worker(worker, delay=0),
+            spares=settings.WORKER_HOT_SPARES,
+            max_uses=settings.CONTEXT_MAX_USES,
+            max_age=settings.WORKER_MAX_AGE,
+            interval=settings.WORKER_RECYCLE_INTERVAL,
+        )
+        # 🧩 浏览器分片：每个分片一个 Chromium 进程，崩溃后只重启该分片并并发重建它的窗口
+        if settings.BROWSER_SHARD_ASSIGN not in ASSIGN_MODES:
+            raise ValueError(f"未知的分片分配方式: {settings.BROWSER_SHARD_ASSIGN} (可选: {', '.join(ASSIGN_MODES)})")
+        max_workers = max(self.autoscaler.max_size if self.autoscaler else settings.BROWSER_POOL_SIZE, len(self.identities))
+        shard_count = settings.BROWSER_SHARDS or auto_shard_count(max_workers, settings.BROWSER_SHARD_MEMORY_MB)
+        self.shards: List[BrowserShard] = [self._create_shard(i) for i in range(max(1, shard_count))]
+        self._next_shard = 0
+        # 🚫 窗口预热 / 铸造凭证时的资源拦截策略 (关闭时为 None)
+        self.resource_policy: Optional[ResourcePolicy] = None
+        if settings.RESOURCE_BLOCKING:
+            self.resource_policy = ResourcePolicy(
+                allow_types=settings.RESOURCE_ALLOW_TYPES,
+                allow_urls=settings.RESOURCE_ALLOW_URLS,
+                deny_urls=settings.RESOURCE_DENY_URLS,
+            )
+        # 不拦截时完整打开一次页面的下载字节数和预热耗时 (诊断模式下测得，用来计算每个窗口的节省量)
+        self.warmup_baseline: Optional[Dict[str, float]] = None
+        self.resource_diagnostics: Optional[Dict[str, Any]] = None
+        self._register_metrics()
+
+    def _create_rate_limiter(self, identity: str) -> BaseRateLimiter:
+        rate = settings.RATE_LIMIT_PER_MINUTE
+        if self.adaptive_rate:
+            rate = self.adaptive_rate.rate_for(identity)
+        return create_rate_limiter(settings.RATE_LIMIT_ALGORITHM, rate, settings.RATE_LIMIT_BURST)
+
+    def _create_shard(self, index: int) -> BrowserShard:
+        shard = BrowserShard(index)
+        shard.supervisor = BrowserSupervisor(
+            launch=self._launch_browser,
+            on_crash=lambda: self._on_shard_crash(shard),
+            rebuild=lambda browser: self._rebuild_shard(shard, browser),
+            name=shard.name,
+        )
+        return shard
+
+    def _create_autoscaler(self) -> PoolAutoscaler:
+        budget = settings.POOL_MEMORY_BUDGET_MB * 2**20
+        if budget <= 0:
+            budget = int(container_memory_limit() * 0.7)
+        return PoolAutoscaler(
+            self.pool,
+            spawn=self._spawn_worker,
+            close=self._retire_worker,
+            min_size=settings.POOL_MIN_SIZE,
+            max_size=settings.POOL_MAX_SIZE,
+            memory_budget=budget,
+            interval=settings.POOL_SCALE_INTERVAL,
+            idle_timeout=settings.POOL_IDLE_TIMEOUT,
+            scale_up_waiters=settings.POOL_SCALE_UP_WAITERS,
+            scale_up_cooldown=settings.POOL_SCALE_UP_COOLDOWN,
+        )
+
+    def _register_metrics(self):
+        """池子和限流器的瞬时状态在 /metrics 抓取时现取，不在请求路径上维护"""
+        registry = metrics.REGISTRY
+        registry.gauge(
+            "toolbaz_pool_workers", "浏览器窗口数 (按出口身份和状态)", ("identity", "state"),
+            collect=lambda: [
+                ({"identity": i.name, "state": state}, value)
+                for i in self.identities
+                for state, value in self.pool.group_stats(i.name).items()
+                if state in ("idle", "leased", "recycling")
+            ],
+        )
+        registry.gauge("toolbaz_pool_size", "浏览器窗口总数", collect=lambda: self.pool.size)
+        registry.gauge(
+            "toolbaz_pool_invariant_ok", "窗口池账目是否一致 (1 一致 / 0 不一致)",
+            collect=lambda: 1 if self.pool.check_invariant() else 0,
+        )
+        registry.gauge(
+            "toolbaz_pool_hot_spares", "预热好的热备窗口数 (按出口身份)", ("identity",),
+            collect=lambda: [({"identity": i.name}, self.recycler.spare_count(i.name)) for i in self.identities],
+        )
+        registry.gauge(
+            "toolbaz_pool_waiters", "正在排队等待窗口的请求数", ("identity",),
+            collect=lambda: [({"identity": i.name}, self.pool.waiters_for(i.name)) for i in self.identities],
+        )
+        registry.gauge(
+            "toolbaz_rate_limiter_tokens", "限流器当前可用额度 (负数表示已预订的未来时隙)", ("identity",),
+            collect=lambda: self._limiter_samples(lambda limiter: limiter.available()),
+        )
+        registry.gauge(
+            "toolbaz_rate_limiter_next_slot_seconds", "现在预订需要等待的秒数", ("identity",),
+            collect=lambda: self._limiter_samples(lambda limiter: limiter.peek()),
+        )
+        registry.gauge(
+            "toolbaz_rate_limiter_rate_per_minute", "限流器当前速率 (自适应限流学到的值)", ("identity",),
+            collect=lambda: self._limiter_samples(lambda limiter: limiter.rate_per_minute),
+        )
+        if self.fair_queue:
+            registry.gauge(
+                "toolbaz_fair_queue_waiting", "在加权公平队列里排队的请求数 (按 API Key)", ("key",),
+                collect=lambda: [
+                    ({"key": name}, stats["waiting"]) for name, stats in self.fair_queue.get_stats()["keys"].items()
+                ],
+            )
+        registry.gauge(
+            "toolbaz_browser_shard_up", "浏览器分片是否在线 (1 在线 / 0 崩溃后重启中)", ("shard",),
+            collect=lambda: [({"shard": s.name}, 1 if s.connected else 0) for s in self.shards],
+        )
+        registry.gauge(
+            "toolbaz_browser_shard_workers", "各浏览器分片上的窗口数", ("shard",),
+            collect=lambda: [({"shard": s.name}, self._shard_load(s)) for s in self.shards],
+        )
+        if self.autoscaler:
+            registry.gauge("toolbaz_browser_memory_bytes", "Chromium 进程树占用的内存",
+                           collect=lambda: self.autoscaler.memory)
+
+    def _limiter_samples(self, read) -> List[Any]:
+        return [({"identity": i.name}, read(i.rate_limiter)) for i in self.identities]
+
     async def initialize(self):
         """启动浏览器并创建池子"""
         self.running = True
-        logger.info(f"🚀 正在启动浏览器集群 (并发数: {settings.BROWSER_POOL_SIZE})...")
+        if self.adaptive_rate:
+            self.adaptive_rate.start()
+        if settings.CACHE_ENABLED:
+            self.cache = ResponseCache(
+                max_bytes=settings.CACHE_MAX_BYTES,
+                ttl=settings.CACHE_TTL,
+                sqlite_path=settings.CACHE_SQLITE_PATH,
+                disk_max_bytes=settings.CACHE_SQLITE_MAX_BYTES,
+                sweep_interval=settings.CACHE_SWEEP_INTERVAL,
+            )
+            self.cache.start()
+        initial_size = settings.BROWSER_POOL_SIZE
+        if self.autoscaler:
+            initial_size = min(max(initial_size, self.autoscaler.min_size), self.autoscaler.max_size)
+        logger.info(f"🚀 正在启动浏览器集群 (并发数: {initial_size}，Chromium 进程数: {len(self.shards)})...")
         self.playwright = await async_playwright().start()
+        browsers = await asyncio.gather(*(self._launch_browser() for _ in self.shards))
+        for shard, browser in zip(self.shards, browsers):
+            shard.browser = browser
+            shard.supervisor.watch(browser)
+
+        for identity in self.identities:
+            identity.http = PooledHttpClient(
+                http2=settings.UPSTREAM_HTTP2,
+                max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+                connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+                read_timeout=settings.UPSTREAM_WRITING_TIMEOUT,
+                write_timeout=settings.UPSTREAM_WRITE_TIMEOUT,
+                pool_timeout=settings.UPSTREAM_POOL_TIMEOUT,
+                proxy=identity.proxy_url,
+            )
+            if settings.UPSTREAM_PREWARM_CONNECTIONS > 0:
+                asyncio.create_task(identity.http.prewarm(self.api_base_url, settings.UPSTREAM_PREWARM_CONNECTIONS))
+
+        if self.resource_policy and self.resource_policy.enabled and settings.RESOURCE_BLOCKING_DIAGNOSTICS:
+            try:
+                await self.run_resource_diagnostics()
+            except Exception as e:
+                self.resource_policy.enabled = False
+                logger.error(f"❌ 资源拦截诊断出错，已关闭资源拦截: {e}")
+
+        # 每个身份至少一个窗口，其余轮流分配
+        for i in range(max(initial_size, len(self.identities))):
+            self._spawn_worker(self.identities[i % len(self.identities)])
+            await asyncio.sleep(1)
+        if self.autoscaler:
+            self.autoscaler.start()
+        self.recycler.start()
+
+        if settings.TOKEN_RESERVOIR_SIZE > 0:
+            for identity in self.identities:
+                identity.token_reservoir = TokenReservoir(
+                    mint=lambda identity=identity: self._mint_for_reservoir(identity),
+                    size=settings.TOKEN_RESERVOIR_SIZE,
+                    ttl=settings.TOKEN_RESERVOIR_TTL,
+                    min_ttl=settings.TOKEN_RESERVOIR_MIN_TTL,
+                    max_ttl=settings.TOKEN_RESERVOIR_MAX_TTL,
+                )
+                identity.token_reservoir.start()
         
+        logger.info(f"✅ 浏览器池启动指令已下发...")
+
+    async def _launch_browser(self):
         launch_args = [
             "--no-sandbox", 
             "--disable-setuid-sandbox", 
@@ -164,195 +476,792 @@ class ToolbazProvider:
             "--disable-gpu",
             "--disable-blink-features=AutomationControlled"
         ]
-        
-        self.browser = await self.playwright.chromium.launch(
+        return await self.playwright.chromium.launch(
             headless=True,
             args=launch_args
         )
 
-        for i in range(settings.BROWSER_POOL_SIZE):
-            worker = BrowserWorker(self.browser)
-            asyncio.create_task(self._init_and_push_worker(worker))
-            await asyncio.sleep(1)
-        
-        logger.info(f"✅ 浏览器池启动指令已下发...")
+    def _shard_load(self, shard: BrowserShard) -> int:
+        return sum(1 for worker in self.pool.workers() if worker.shard is shard)
 
-    async def _init_and_push_worker(self, worker: BrowserWorker):
-        if not self.running:
-            return
+    def _pick_shard(self) -> Optional[BrowserShard]:
+        """为新窗口选一个在线的分片：窗口最少的 (load) 或轮流 (round_robin)；全部分片都在重启时返回 None"""
+        online = [shard for shard in self.shards if shard.connected]
+        if not online:
+            return None
+        if settings.BROWSER_SHARD_ASSIGN == "round_robin":
+            shard = online[self._next_shard % len(online)]
+            self._next_shard += 1
+            return shard
+        return min(online, key=self._shard_load)
 
-        success = await worker.init()
-        if success:
-            if self.running:
-                await self.pool.put(worker)
+    def _new_worker(self, identity: EgressIdentity, shard: Optional[BrowserShard] = None) -> BrowserWorker:
+        shard = shard or self._pick_shard()
+        if shard is None:
+            raise BrowserCrashedError("Browser crashed and is restarting. Retry shortly.")
+        return BrowserWorker(shard.browser, identity, shard, self.resource_policy)
+
+    async def run_resource_diagnostics(self) -> Dict[str, Any]:
+        """
+        🔍 资源拦截诊断：同一身份下依次预热一个不拦截、一个按策略拦截的临时窗口 (都等到网络空闲)，
+        对比下载字节数和打开页面的耗时，列出被拦截的请求，再用拦截后的窗口铸造一次凭证确认 token.php 仍然接受。
+        开启拦截时启动阶段会自动执行：拦截后的窗口预热或铸造凭证失败 (不论原因) 都关闭拦截，
+        之后 (重新) 预热的窗口都不再拦截，宁可多下载一些资源也不让拦截弄坏凭证。
+        """
+        identity = self.identities[0]
+        shard = self._pick_shard()
+        probes = {
+            "unblocked": BrowserWorker(shard.browser, identity, shard, ResourcePolicy.allow_all()),
+            "blocked": BrowserWorker(shard.browser, identity, shard, self.resource_policy, record_blocked=True),
+        }
+        logger.info("🔍 资源拦截诊断：分别预热不拦截 / 拦截的临时窗口...")
+        results: Dict[str, Dict[str, Any]] = {}
+        token_error = None
+        try:
+            for name, probe in probes.items():
+                if not await probe.init():
+                    results[name] = {"ready": False}
+                    continue
+                try:
+                    await probe.page.wait_for_load_state("networkidle", timeout=15000)
+                except PlaywrightError:
+                    pass
+                await probe.resources.settle()
+                results[name] = {
+                    "ready": True,
+                    "bytes": probe.resources.bytes,
+                    "warmup_seconds": round(probe.warmup_seconds, 3),
+                    "requests": probe.resources.allowed,
+                    "blocked": dict(probe.resources.blocked),
+                }
+            if results["blocked"]["ready"]:
+                try:
+                    await self._mint_security_token(probes["blocked"])
+                except MintError as e:
+                    token_error = str(e)
             else:
-                await worker.close()
+                token_error = "拦截后窗口预热失败"
+        finally:
+            for probe in probes.values():
+                await probe.close()
+
+        token_ok = token_error is None
+        report = {
+            **results,
+            "blocked_urls": probes["blocked"].resources.blocked_urls if probes["blocked"].resources else [],
+            "token_ok": token_ok,
+            "token_error": token_error,
+        }
+        unblocked, blocked = results["unblocked"], results["blocked"]
+        if unblocked["ready"]:
+            self.warmup_baseline = {"bytes": unblocked["bytes"], "warmup_seconds": unblocked["warmup_seconds"]}
+            if blocked["ready"]:
+                report["bytes_saved"] = unblocked["bytes"] - blocked["bytes"]
+                report["seconds_saved"] = round(unblocked["warmup_seconds"] - blocked["warmup_seconds"], 3)
+        for url in report["blocked_urls"]:
+            logger.debug(f"🚫 已拦截: {url}")
+        if not token_ok:
+            self.resource_policy.enabled = False
+            logger.error(f"❌ 拦截资源后铸造凭证失败，已关闭资源拦截 (可把所需资源加入 RESOURCE_ALLOW_URLS): {token_error}")
         else:
-            if not self.running:
-                return
+            logger.info(
+                f"✅ 拦截后凭证可用，每个窗口预热节省 {report.get('bytes_saved', 0) / 1024:.0f}KB / "
+                f"{report.get('seconds_saved', 0):.2f}s (共拦截 {probes['blocked'].resources.blocked_total} 个请求)"
+            )
+        self.resource_diagnostics = report
+        return report
+
+    def _resource_stats(self) -> Optional[Dict[str, Any]]:
+        if not self.resource_policy:
+            return None
+        baseline = self.warmup_baseline
+        workers = {}
+        for worker in self.pool.workers():
+            if not worker.resources:
+                continue
+            report = {
+                "warmup_seconds": round(worker.warmup_seconds, 3),
+                "warmup_bytes": worker.warmup_bytes,
+                "bytes": worker.resources.bytes,
+                "blocked": worker.resources.blocked_total,
+            }
+            if baseline:
+                report["bytes_saved"] = baseline["bytes"] - worker.resources.bytes
+                report["seconds_saved"] = round(baseline["warmup_seconds"] - worker.warmup_seconds, 3)
+            workers[worker.id] = report
+        return {
+            "enabled": self.resource_policy.enabled,
+            "allow_types": sorted(self.resource_policy.allow_types),
+            "baseline": baseline,
+            "diagnostics": self.resource_diagnostics,
+            "workers": workers,
+        }
+
+    def _is_stale(self, worker: BrowserWorker) -> bool:
+        """窗口属于所在分片已经崩溃的旧浏览器"""
+        return worker.browser is not worker.shard.browser
+
+    def _on_shard_crash(self, shard: BrowserShard):
+        """
+        某个分片的 Chromium 断开：该分片的窗口和热备随之失效，立即移出池子，其余分片照常服务；
+        已租出的窗口归还时会因为属于旧浏览器而被丢弃。
+        某个身份已经没有任何窗口 (或全部分片都已崩溃) 时，正在排队的请求以 BrowserCrashedError 快速失败。
+        """
+        shard.browser = None
+        workers = [worker for worker in self.pool.workers() if worker.shard is shard]
+        for worker in workers:
+            self.pool.remove(worker)
+        shard.rebuild_plan = [worker.identity for worker in workers]
+        exc = BrowserCrashedError("Browser crashed and is restarting. Retry shortly.")
+        if not any(s.connected for s in self.shards):
+            self.recycler.pause()
+            self.pool.fail_waiters(exc)
+        else:
+            self.recycler.discard(lambda spare: spare.shard is shard)
+            for identity in self.identities:
+                if not self.pool.workers(identity.name):
+                    self.pool.fail_waiters(exc, identity.name)
+        logger.warning(f"💥 [{shard.name}] 已作废 {len(workers)} 个窗口，等待该浏览器重启...")
+
+    async def _rebuild_shard(self, shard: BrowserShard, browser):
+        """在分片的新浏览器里并发重建崩溃前的全部窗口 (池子里没有窗口的身份各补一个)"""
+        shard.browser = browser
+        plan = list(shard.rebuild_plan)
+        for identity in self.identities:
+            if identity not in plan and not self.pool.workers(identity.name):
+                plan.append(identity)
+        workers = [self._new_worker(identity, shard) for identity in plan]
+        for worker in workers:
+            self.pool.register(worker)
+
+        async def init_one(worker: BrowserWorker):
+            if await self._init_and_push_worker(worker):
+                shard.supervisor.mark_serving()
+
+        await asyncio.gather(*(init_one(worker) for worker in workers))
+        if self.recycler.paused:
+            self.recycler.resume()
+
+    def _spawn_worker(self, identity: Optional[EgressIdentity] = None):
+        """登记一个新窗口并在后台初始化，完成后放入池子 (不指定身份时补给排队最多的身份)"""
+        if not any(shard.connected for shard in self.shards):
+            # 浏览器正在重启，重建完成后池子会恢复原有规模
+            return
+        if identity is None:
+            identity = max(
+                self.identities,
+                key=lambda i: (self.pool.waiters_for(i.name) - self.pool.group_stats(i.name)["recycling"],
+                               -self.pool.group_stats(i.name)["size"]),
+            )
+        worker = self._new_worker(identity)
+        self.pool.register(worker)
+        asyncio.create_task(self._init_and_push_worker(worker))
+
+    async def _retire_worker(self, worker: BrowserWorker):
+        """缩容：窗口已移出池子 (空闲状态，没有进行中的请求)，直接关闭上下文"""
+        await worker.close()
+
+    async def _init_and_push_worker(self, worker: BrowserWorker) -> bool:
+        """初始化窗口并放入池子，失败每 10 秒重试；服务关闭或浏览器已重启 (窗口作废) 时放弃。返回是否已入池"""
+        while self.running and not self._is_stale(worker):
+            started = time.monotonic()
+            success = await worker.init()
+            if success and self.running and not self._is_stale(worker):
+                self.worker_init_latency = 0.8 * self.worker_init_latency + 0.2 * (time.monotonic() - started)
+                self.pool.put(worker)
+                return True
+            if success:
+                break
             logger.warning(f"⚠️ Worker-{worker.id} 初始化失败，10秒后重试...")
             await asyncio.sleep(10)
-            await self._init_and_push_worker(worker)
-
-    async def _wait_for_rate_limit(self):
-        """🔥 核心限流逻辑：确保每分钟不超过5次请求"""
-        async with self.rate_limit_lock:
-            current_time = time.time()
-            # 清理超过60秒的旧记录
-            self.request_timestamps = [t for t in self.request_timestamps if current_time - t < 60]
-            
-            # 限制为每分钟 5 次 (留1次余量，设为4次比较安全)
-            MAX_REQUESTS_PER_MINUTE = 4 
-            
-            if len(self.request_timestamps) >= MAX_REQUESTS_PER_MINUTE:
-                # 计算需要等待的时间
-                oldest_request = self.request_timestamps[0]
-                wait_time = 60 - (current_time - oldest_request) + 1
-                if wait_time > 0:
-                    logger.warning(f"🚦 触发速率限制 (5req/min)，正在排队等待 {wait_time:.2f} 秒...")
-                    await asyncio.sleep(wait_time)
-            
-            # 记录这次请求的时间
-            self.request_timestamps.append(time.time())
+        self.pool.remove(worker)
+        await worker.close()
+        return False
+
+    def _reserve_rate_slot(self, identity: EgressIdentity) -> RateReservation:
+        """🔥 核心限流逻辑：O(1) 预订时隙，等待在调用方自己的协程里进行，排队的请求互不阻塞"""
+        limiter = identity.rate_limiter
+        reservation = limiter.reserve()
+        metrics.RATE_LIMIT_WAIT_SECONDS.observe(reservation.delay)
+        if reservation.delay > 0:
+            logger.warning(f"🚦 [{identity.name}] 触发速率限制 ({limiter.rate_per_minute:g}req/min)，已预订 {reservation.delay:.2f} 秒后的时隙...")
+        return reservation
 
     def _clean_response_text(self, text: str) -> str:
-        if not text: return ""
-        text = text.replace("<br>", "\n").replace("<br/>", "\n").replace("<br />", "\n")
-        text = html.unescape(text)
-        text = re.sub(r'^\[model:.*?\]\s*', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'^Toolbaz.*?:', '', text, flags=re.IGNORECASE)
-        return text.strip()
-
-    async def chat_completion(self, request_data: Dict[str, Any]):
+        return clean_response_text(text)
+
+    def _build_headers(self, session_id: str) -> Dict[str, str]:
+        return {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            "Origin": settings.TOOLBAZ_BASE_URL.rstrip("/"),
+            "Referer": settings.TOOLBAZ_WRITER_URL,
+            "X-Requested-With": "XMLHttpRequest",
+            "Cookie": f"SessionID={session_id}"
+        }
+
+    async def _mint_security_token(self, worker: BrowserWorker) -> SecurityToken:
+        """用指定窗口铸造一组完整凭证 (浏览器取 Token + token.php 换 capcha，都走该窗口的出口)"""
+        http = worker.identity.http
+        http_identity = worker.identity.name
+        # 用满 CONTEXT_MAX_USES 次的窗口由 WorkerRecycler 在空闲时轮换，失败的窗口由调用方换掉，这里都不同步重建
+        try:
+            security_data = await worker.get_token_data()
+        except Exception as e:
+            raise MintError("page_error", f"Token生成失败: {e}")
+        if security_data.get("error"):
+            raise MintError(security_data.get("cause", "page_error"), f"Token生成失败: {security_data['error']}")
+
+        session_id = security_data["sessionId"]
+        payload_token = security_data["token"]
+
+        with tracing.span("token_api"):
+            try:
+                token_resp = await http.post(
+                    self.api_token_url,
+                    data={"session_id": session_id, "token": payload_token},
+                    headers=self._build_headers(session_id),
+                    timeout=http.stage_timeout(settings.UPSTREAM_TOKEN_TIMEOUT)
+                )
+            except httpx.HTTPError as e:
+                metrics.UPSTREAM_RESPONSES.inc(identity=http_identity, endpoint="token", status="error")
+                raise MintError("token_api_network", f"Token API 网络错误: {e}", worker_fault=False)
+        metrics.UPSTREAM_RESPONSES.inc(identity=http_identity, endpoint="token", status=str(token_resp.status_code))
+
+        if token_resp.status_code != 200:
+            raise MintError("token_api_status", f"Token API 状态码错误: {token_resp.status_code}", worker_fault=False)
+
+        try:
+            token_json = token_resp.json()
+        except ValueError:
+            raise MintError("token_api_status", f"Token API 返回格式错误: {token_resp.text[:100]}", worker_fault=False)
+        if not token_json.get("success"):
+            # 窗口算出的 token 被拒：多半是页面状态坏了
+            raise MintError("token_api_rejected", f"Token API 拒绝: {token_json}")
+
+        return SecurityToken(session_id=session_id, payload_token=payload_token, capcha_token=token_json["token"])
+
+    @asynccontextmanager
+    async def lease_worker(self, identity: EgressIdentity):
+        """
+        租用窗口的唯一入口：无论正常结束、出错、被取消 (超时/客户端断开) 还是生成器被关闭，
+        窗口都一定会归还或送去重置，池子不会越用越小。
+        """
+        with tracing.span("pool_wait"):
+            worker: BrowserWorker = await self.pool.get(identity.name)
+        try:
+            yield worker
+        except Exception as e:
+            if not getattr(e, "worker_fault", True):
+                # 不是窗口的问题 (如 token.php 网络错误)：窗口照常归还
+                self._return_worker(worker)
+                raise
+            # 窗口本身出了问题：送去后台重置
+            logger.error(f"❌ [Worker-{worker.id}] 处理出错，送去后台重置: {e}")
+            self._schedule_recycle(worker)
+            raise
+        except BaseException:
+            # 取消 / 生成器关闭：窗口没坏，直接归还
+            self._return_worker(worker)
+            logger.info(f"🔙 窗口 [Worker-{worker.id}] 已归还 (请求被取消)")
+            raise
+        else:
+            self._return_worker(worker)
+            logger.info(f"🔙 窗口 [Worker-{worker.id}] 已归还")
+
+    def _return_worker(self, worker: BrowserWorker):
+        if self._is_stale(worker):
+            # 浏览器在租用期间崩溃：旧窗口已随池子一起作废，不再放回
+            return
+        self.pool.put(worker)
+
+    async def _lease_and_mint(self, identity: EgressIdentity) -> SecurityToken:
+        """③ 即时租用：只在真正需要铸造凭证时才占用浏览器窗口，铸完立即归还"""
+        logger.info(f"⏳ 正在等待空闲浏览器窗口 [{identity.name}] (当前可用: {self.pool.qsize(identity.name)})...")
+        try:
+            async with self.lease_worker(identity) as worker:
+                logger.info(f"🤖 使用窗口 [Worker-{worker.id}] 铸造凭证...")
+                started = time.monotonic()
+                token = await self._mint_security_token(worker)
+        except MintError as e:
+            self.mint_failures[e.cause] = self.mint_failures.get(e.cause, 0) + 1
+            metrics.MINT_FAILURES.inc(identity=identity.name, cause=e.cause)
+            raise
+        self.mint_latency = 0.8 * self.mint_latency + 0.2 * (time.monotonic() - started)
+        return token
+
+    async def _mint_for_reservoir(self, identity: EgressIdentity) -> Optional[SecurityToken]:
+        """凭证池补货：只在该身份没有请求排队等窗口时借用空闲窗口"""
+        if self.pool.waiters_for(identity.name) > 0 or self.pool.empty(identity.name):
+            return None
+        return await self._lease_and_mint(identity)
+
+    async def _acquire_security_token(
+        self, identity: EgressIdentity, reservation: RateReservation, use_reservoir: bool = True
+    ):
+        """
+        在时隙到来前"刚好来得及"的时刻拿凭证：优先凭证池，未命中再即时租用窗口铸造
+        (use_reservoir=False 时只现场铸造，预铸凭证被拒后重试用)。返回 (凭证, 是否来自凭证池)
+        """
+        lead = reservation.delay - self.mint_latency
+        if lead > 0:
+            with tracing.span("limiter"):
+                await asyncio.sleep(lead)
+
+        reservoir = identity.token_reservoir if use_reservoir else None
+        security = reservoir.pop() if reservoir else None
+        if security is not None:
+            logger.info("🪙 命中预铸凭证，跳过 Token 获取")
+            tracing.annotate("reservoir_hit", True)
+            return security, True
+        attempts = max(1, settings.MINT_MAX_ATTEMPTS)
+        for attempt in range(1, attempts + 1):
+            try:
+                with tracing.span("mint"):
+                    return await self._lease_and_mint(identity), False
+            except MintError as e:
+                if attempt >= attempts:
+                    raise
+                # 失败的窗口已送去后台重置 (或由热备顶替)：立即改用预铸凭证或下一个空闲窗口
+                self.mint_failovers += 1
+                logger.warning(f"🔁 [{identity.name}] 凭证铸造失败 ({e.cause})，立即换窗口重试 ({attempt}/{attempts})")
+                security = reservoir.pop() if reservoir else None
+                if security is not None:
+                    metrics.MINT_FAILOVERS.inc(target="reservoir")
+                    tracing.annotate("failover", "reservoir")
+                    return security, True
+                metrics.MINT_FAILOVERS.inc(target="worker")
+                tracing.annotate("failover", "worker")
+
+    async def _send_writing_request(
+        self, identity: EgressIdentity, security: SecurityToken, model: str, formatted_text: str, stream: bool
+    ) -> httpx.Response:
+        """用凭证所属身份的连接调用 writing.php；stream=True 时收到响应头即返回，出错时才读完正文"""
+        http, http_identity = identity.http, identity.name
+        request = http.build_request(
+            "POST",
+            self.api_writing_url,
+            data={
+                "text": formatted_text,
+                "capcha": security.capcha_token,
+                "model": model,
+                "session_id": security.session_id
+            },
+            headers=self._build_headers(security.session_id),
+            timeout=http.stage_timeout(settings.UPSTREAM_WRITING_TIMEOUT)
+        )
+        try:
+            resp = await http.send(request, stream=stream)
+        except httpx.HTTPError:
+            metrics.UPSTREAM_RESPONSES.inc(identity=http_identity, endpoint="writing", status="error")
+            raise
+        metrics.UPSTREAM_RESPONSES.inc(identity=http_identity, endpoint="writing", status=str(resp.status_code))
+        if stream and resp.status_code != 200:
+            await resp.aread()
+            await resp.aclose()
+        return resp
+
+    @staticmethod
+    def _capcha_rejected(resp: httpx.Response) -> bool:
+        """writing.php 拒绝了凭证 (过期 / 无效)：401 / 403，或正文提到 capcha 的 4xx；5xx 与凭证无关"""
+        if resp.status_code in (401, 403):
+            return True
+        return 400 <= resp.status_code < 500 and "capcha" in resp.text.lower()
+
+    def _admit(self, request_data: Dict[str, Any]):
+        """① 准入：解析请求，得到 (model, formatted_text, stream)；不认识的模型直接 400"""
         model = request_data.get("model", settings.DEFAULT_MODEL)
+        if model not in settings.MODELS:
+            raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
         messages = request_data.get("messages", [])
         stream = request_data.get("stream", True)
         
         last_user_content = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "Hello")
         padding = "\u3164"
         formatted_text = f"{padding} : {last_user_content}{padding}"
+        return model, formatted_text, stream
 
-        # 1. 获取 Worker
-        logger.info(f"⏳ 正在等待空闲浏览器窗口 (当前可用: {self.pool.qsize()})...")
-        worker: BrowserWorker = await self.pool.get()
-        
+    async def chat_completion(
+        self,
+        request_data: Dict[str, Any],
+        http_request: Optional[Request] = None,
+        api_key: Optional[ApiKey] = None,
+        timeout: Optional[float] = None,
+    ):
+        """
+        传入 FastAPI 的 Request 时会监听客户端连接：客户端一旦断开，排队等待和在途的上游调用都会被取消，
+        尚未发出的请求会退还限流时隙。api_key 决定请求在公平队列里的权重；
+        timeout 为该请求的时间预算，预计赶不上时直接拒绝 (见 _admission_check)。
+        """
+        trace = tracing.start_trace("chat.completion", self.trace_exporter) if settings.TRACING_ENABLED else None
+        deadline = time.monotonic() + (timeout if timeout is not None else settings.REQUEST_TIMEOUT)
         try:
-            logger.info(f"🤖 使用窗口 [Worker-{worker.id}] 处理请求...")
-            
-            if worker.uses_count > settings.CONTEXT_MAX_USES:
-                logger.info(f"♻️ 窗口 [Worker-{worker.id}] 使用次数过多，正在重建...")
-                await worker.init()
+            return await run_until_disconnect(
+                self._chat_pipeline(request_data, http_request, api_key, deadline),
+                http_request, settings.DISCONNECT_POLL_INTERVAL
+            )
+        except ClientDisconnected:
+            self.client_disconnects += 1
+            logger.warning("🔌 客户端已断开，已放弃该请求")
+            raise
+        finally:
+            if trace is not None:
+                trace.detach()
+                if not trace.deferred:
+                    trace.end()
 
-            # 2. 获取凭证
-            security_data = await worker.get_token_data()
-            if security_data.get("error"):
-                logger.error(f"❌ [Worker-{worker.id}] Token获取失败: {security_data.get('error')}")
-                await worker.init()
-                security_data = await worker.get_token_data()
-                if security_data.get("error"):
-                    raise Exception(f"Token生成失败: {security_data['error']}")
-
-            session_id = security_data["sessionId"]
-            payload_token = security_data["token"]
-
-            # 🔥 3. 在发送请求前，执行限流检查
-            await self._wait_for_rate_limit()
-
-            # 4. 发送 HTTP 请求
-            async with httpx.AsyncClient() as client:
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Origin": "https://toolbaz.com",
-                    "Referer": "https://toolbaz.com/writer/chat-gpt-alternative",
-                    "X-Requested-With": "XMLHttpRequest",
-                    "Cookie": f"SessionID={session_id}"
-                }
+    def _cache_allowed(self, request_data: Dict[str, Any], http_request: Optional[Request]) -> bool:
+        """请求体 cache: false 或 Cache-Control: no-cache / no-store 时跳过缓存"""
+        if self.cache is None or request_data.get("cache", True) is False:
+            return False
+        if http_request is not None:
+            cache_control = http_request.headers.get("cache-control", "").lower()
+            if "no-cache" in cache_control or "no-store" in cache_control:
+                return False
+        return True
 
-                token_resp = await client.post(
-                    self.api_token_url,
-                    data={"session_id": session_id, "token": payload_token},
-                    headers=headers,
-                    timeout=20
+    async def _chat_pipeline(
+        self,
+        request_data: Dict[str, Any],
+        http_request: Optional[Request] = None,
+        api_key: Optional[ApiKey] = None,
+        deadline: Optional[float] = None,
+    ):
+        """① 准入后查缓存，未命中再加入 (或发起) 一次上游调用，按 stream 参数组装成 JSON 或 SSE"""
+        model, formatted_text, stream = self._admit(request_data)
+
+        cache_key = None
+        if self._cache_allowed(request_data, http_request):
+            cache_key = make_cache_key(model, formatted_text.strip())
+            with tracing.span("cache"):
+                entry = await self.cache.get(cache_key)
+            if entry is not None:
+                logger.info("💾 命中响应缓存，无需调用上游")
+                return await self._respond(CompletionBroadcast.from_text(entry.text), model, stream, {"X-Cache": "HIT"})
+
+        flight_key = (model, formatted_text.strip())
+        if deadline is not None and not self.single_flight.in_flight(flight_key):
+            # 只有会产生新上游调用的请求才需要准入 (合并到进行中的调用不额外占用额度)
+            decision = self._admission_check(api_key, stream, deadline - time.monotonic())
+            if not decision.admitted:
+                logger.warning(f"🚪 拒绝请求 ({decision.status_code}): {decision.reason}，建议 {decision.retry_after_header}s 后重试")
+                return JSONResponse(
+                    {"error": f"Request rejected: {decision.reason}. Retry later."},
+                    status_code=decision.status_code,
+                    headers={"Retry-After": decision.retry_after_header},
                 )
-                
-                if token_resp.status_code != 200:
-                    raise ValueError(f"Token API 状态码错误: {token_resp.status_code}")
-                
-                token_json = token_resp.json()
-                if not token_json.get("success"):
-                    raise ValueError(f"Token API 拒绝: {token_json}")
-                
-                capcha_token = token_json["token"]
-
-                chat_resp = await client.post(
-                    self.api_writing_url,
-                    data={
-                        "text": formatted_text,
-                        "capcha": capcha_token,
-                        "model": model,
-                        "session_id": session_id
-                    },
-                    headers=headers,
-                    timeout=120
+            admission = PendingAdmission(self.admission)
+        else:
+            admission = None
+
+        flight = self.single_flight.join(
+            flight_key,
+            lambda broadcast: self._produce_completion(model, formatted_text, broadcast, cache_key, api_key, admission)
+        )
+        if admission is not None:
+            flight.add_done_callback(admission.settle)
+        return await self._respond(flight, model, stream, {"X-Cache": "MISS"} if cache_key else None)
+
+    async def run_completion(self, request_data: Dict[str, Any], api_key: Optional[ApiKey] = None) -> CompletionBroadcast:
+        """
+        不组装 HTTP 响应的补全调用 (异步任务用)：查缓存，未命中则加入或发起上游调用。
+        不做准入检查；返回的广播已为调用方订阅好，用完需 unsubscribe()。
+        """
+        model, formatted_text, _ = self._admit(request_data)
+        cache_key = None
+        if self._cache_allowed(request_data, None):
+            cache_key = make_cache_key(model, formatted_text.strip())
+            entry = await self.cache.get(cache_key)
+            if entry is not None:
+                return CompletionBroadcast.from_text(entry.text)
+        return self.single_flight.join(
+            (model, formatted_text.strip()),
+            lambda broadcast: self._produce_completion(model, formatted_text, broadcast, cache_key, api_key)
+        )
+
+    def estimate_wait(self, api_key: Optional[ApiKey] = None, stream: bool = True) -> Optional[float]:
+        """
+        新发起一次上游调用，预计多少秒后能拿到首个字节 (stream) / 完整结果。
+        = 开始时间 (见 estimate_start) + writing.php 耗时；无法服务时返回 None。
+        """
+        start = self.estimate_start(api_key)
+        if start is None:
+            return None
+        return start + (self.upstream_ttfb if stream else self.upstream_latency)
+
+    def estimate_start(self, api_key: Optional[ApiKey] = None) -> Optional[float]:
+        """
+        新发起一次上游调用，预计多少秒后发出 writing.php 请求：
+        max(排在前面的请求消化完后轮到自己的时隙, 等窗口 + 铸造凭证)；
+        没有任何可用窗口且凭证池为空时返回 None。
+        """
+        ahead = self.admission.pending
+        if self.fair_queue:
+            ahead += self.fair_queue.ahead(api_key.name if api_key else ANONYMOUS, api_key.weight if api_key else 1.0)
+        slot_wait = self.scheduler.estimate_start(ahead)
+
+        ready_workers = self.pool.qsize() + self.pool.leased
+        pooled_tokens = sum(len(i.token_reservoir) for i in self.identities if i.token_reservoir)
+        if pooled_tokens > ahead:
+            token_wait = 0.0
+        elif ready_workers == 0:
+            return None
+        else:
+            # 排队等窗口的请求按窗口数平摊，每个占用一次铸造的时间
+            token_wait = (self.pool.waiters / ready_workers + 1) * self.mint_latency
+        return max(slot_wait, token_wait)
+
+    def _admission_check(
+        self, api_key: Optional[ApiKey], stream: bool, budget: float
+    ) -> AdmissionDecision:
+        estimated = self.estimate_wait(api_key, stream) if self.admission.enabled else 0.0
+        recovery = self.worker_init_latency + self.mint_latency
+        decision = self.admission.decide(estimated, budget, recovery)
+        tracing.annotate("estimated_wait", round(decision.estimated_wait, 3))
+        return decision
+
+    async def _respond(self, flight: CompletionBroadcast, model: str, stream: bool, headers: Optional[Dict[str, str]] = None):
+        """把一次 (可能与他人共享的) 上游调用组装成 JSON 或 SSE 响应"""
+        handed_over = False
+        trace = tracing.current_trace()
+        try:
+            try:
+                await flight.wait_started()
+            except QuotaLimitError:
+                logger.warning("⚠️ 触发 API 硬性限流，返回 429 给客户端")
+                return JSONResponse(
+                    {"error": "Rate limit exceeded (5 req/min). Please wait."},
+                    status_code=429, headers=self._timing_headers(trace, headers)
                 )
-                
+            except BrowserCrashedError as e:
+                logger.warning("⚠️ 浏览器正在重启，返回 503 给客户端")
+                return JSONResponse(
+                    {"error": str(e)}, status_code=503,
+                    headers=self._timing_headers(trace, {**(headers or {}), "Retry-After": str(math.ceil(self.worker_init_latency))})
+                )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+
+            request_id = f"chatcmpl-{uuid.uuid4()}"
+            if stream:
+                handed_over = True
+                if trace is not None:
+                    trace.deferred = True
+                return StreamingResponse(
+                    self._relay_flight(flight, request_id, model, trace), media_type="text/event-stream",
+                    headers=self._timing_headers(trace, headers)
+                )
+
+            try:
+                clean_text = await flight.result()
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+            body = {
+                "id": request_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": clean_text}, "finish_reason": "stop"}]
+            }
+            if trace is not None:
+                body["x_timings"] = trace.as_dict()
+            return JSONResponse(body, headers=self._timing_headers(trace, headers))
+        finally:
+            if not handed_over:
+                flight.unsubscribe()
+
+    @staticmethod
+    def _timing_headers(trace: Optional[tracing.RequestTrace], headers: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+        """附加 Server-Timing 响应头 (只含响应发出前已结束的阶段)"""
+        if trace is None:
+            return headers
+        return {**(headers or {}), "Server-Timing": trace.server_timing()}
+
+    async def _relay_flight(
+        self, flight: CompletionBroadcast, request_id: str, model: str, trace: Optional[tracing.RequestTrace] = None
+    ):
+        """把上游调用的文本片段 (从头回放) 转成 SSE 增量下发给当前订阅者"""
+        metrics.SSE_ACTIVE_STREAMS.inc()
+        sent_bytes = 0
+        try:
+            async for part in flight.replay():
+                chunk = create_sse_data(create_chat_completion_chunk(request_id, model, part))
+                sent_bytes += len(chunk)
+                yield chunk
+            chunk = create_sse_data(create_chat_completion_chunk(request_id, model, "", "stop"))
+            sent_bytes += len(chunk) + len(DONE_CHUNK)
+            yield chunk
+            yield DONE_CHUNK
+        finally:
+            metrics.SSE_ACTIVE_STREAMS.dec()
+            metrics.SSE_BYTES.inc(sent_bytes)
+            flight.unsubscribe()
+            if trace is not None:
+                trace.end()
+
+    async def _produce_completion(
+        self,
+        model: str,
+        formatted_text: str,
+        broadcast: CompletionBroadcast,
+        cache_key: Optional[str] = None,
+        api_key: Optional[ApiKey] = None,
+        admission: Optional[PendingAdmission] = None,
+    ):
+        """
+        单次上游调用：按 API Key 权重排队 → ② 预订限流时隙 → ③ 时隙临近时即时租用窗口铸造凭证 → ④ 归还窗口 →
+        调用 writing.php，清洗后的文本片段一到就发布给所有订阅者。排队等额度期间不占用任何浏览器窗口。
+        """
+        upstream_stream = settings.UPSTREAM_STREAMING
+        reservation: Optional[RateReservation] = None
+        ticket: Optional[FairTicket] = None
+        sent = False
+        # 预铸凭证被拒后已经现场铸造重试过一次
+        retried = False
+
+        def settle_admission():
+            if admission is not None:
+                admission.settle()
+
+        try:
+            if self.fair_queue:
+                # 进入公平队列后由队列本身计数 (两步之间没有 await，不会被其他请求插入)
+                settle_admission()
+                with tracing.span("fair_queue"):
+                    ticket = await self.fair_queue.acquire(
+                        api_key.name if api_key else ANONYMOUS, api_key.weight if api_key else 1.0
+                    )
+            while True:
+                # ② 选出最早有时隙的出口身份，只占位不等待
+                identity = self.scheduler.pick()
+                tracing.annotate("identity", identity.name)
+                reservation = self._reserve_rate_slot(identity)
+                settle_admission()
+                sent = False
+
+                # ③ + ④ 凭证 (窗口在 _lease_and_mint 内部用完即还)
+                security, from_reservoir = await self._acquire_security_token(
+                    identity, reservation, use_reservoir=not retried
+                )
+
+                # 🔥 等到自己的时隙再发送
+                with tracing.span("limiter"):
+                    await reservation.wait()
+                sent = True
+                if ticket:
+                    # 时隙已用上，名额让给下一个排队的请求
+                    ticket.release()
+
+                # 发送 HTTP 请求 (流式模式下只等到响应头，正文边到边转发)
+                sent_at = time.monotonic()
+                with tracing.span("writing_api"):
+                    chat_resp = await self._send_writing_request(
+                        identity, security, model, formatted_text, stream=upstream_stream
+                    )
+                ttfb = time.monotonic() - sent_at
+
                 # 🔥 专门捕获 400 Quota Limit 错误
                 if chat_resp.status_code == 400 and "quota limit" in chat_resp.text:
-                    logger.warning("⚠️ 触发 API 硬性限流，返回 429 给客户端")
-                    # 归还 worker，因为 worker 本身没问题，是 IP 没额度了
-                    await self.pool.put(worker)
-                    return JSONResponse({"error": "Rate limit exceeded (5 req/min). Please wait."}, status_code=429)
+                    metrics.UPSTREAM_QUOTA_LIMITS.inc(identity=identity.name)
+                    if self.adaptive_rate:
+                        self.adaptive_rate.on_quota_limit(
+                            identity.name, identity.rate_limiter, reservation
+                        )
+                    raise QuotaLimitError(chat_resp.text[:100])
+
+                if from_reservoir and self._capcha_rejected(chat_resp):
+                    # 预铸凭证已过期：记录下来用于学习有效期，然后跳过凭证池现场铸造重试 (只重试这一次，
+                    # 重试拿到的凭证不会再来自凭证池)
+                    identity.token_reservoir.report_rejected(security)
+                    retried = True
+                    logger.warning(f"🪙 [{identity.name}] 预铸凭证被拒 ({chat_resp.status_code})，现场铸造重试...")
+                    continue
 
                 if chat_resp.status_code != 200:
                     raise ValueError(f"Writing API 错误: {chat_resp.status_code} - {chat_resp.text[:100]}")
-                
-                clean_text = self._clean_response_text(chat_resp.text)
-                request_id = f"chatcmpl-{uuid.uuid4()}"
-
-                # 5. 返回结果
-                if not stream:
-                    await self.pool.put(worker)
-                    logger.info(f"🔙 窗口 [Worker-{worker.id}] 已归还")
-                    return JSONResponse({
-                        "id": request_id,
-                        "object": "chat.completion",
-                        "created": int(time.time()),
-                        "model": model,
-                        "choices": [{"index": 0, "message": {"role": "assistant", "content": clean_text}, "finish_reason": "stop"}]
-                    })
-
-                async def stream_generator():
-                    try:
-                        chunk_size = 20
-                        for i in range(0, len(clean_text), chunk_size):
-                            part = clean_text[i:i+chunk_size]
-                            yield create_sse_data(create_chat_completion_chunk(request_id, model, part))
-                            await asyncio.sleep(0.02)
-                        yield create_sse_data(create_chat_completion_chunk(request_id, model, "", "stop"))
-                        yield DONE_CHUNK
-                    finally:
-                        await self.pool.put(worker)
-                        logger.info(f"🔙 窗口 [Worker-{worker.id}] 已归还 (流结束)")
-
-                return StreamingResponse(stream_generator(), media_type="text/event-stream")
 
+                if from_reservoir:
+                    identity.token_reservoir.report_accepted(security)
+                self.upstream_ttfb = 0.8 * self.upstream_ttfb + 0.2 * ttfb
+                if self.adaptive_rate:
+                    self.adaptive_rate.on_success(identity.name, identity.rate_limiter, reservation)
+                break
+
+            broadcast.mark_started()
+            if upstream_stream:
+                cleaner = StreamingTextCleaner()
+                try:
+                    with tracing.span("writing_body"):
+                        async for raw in chat_resp.aiter_text():
+                            part = cleaner.feed(raw)
+                            if part:
+                                broadcast.publish(part)
+                        tail = cleaner.flush()
+                        if tail:
+                            broadcast.publish(tail)
+                finally:
+                    await chat_resp.aclose()
+            else:
+                with tracing.span("clean"):
+                    clean_text = self._clean_response_text(chat_resp.text)
+                chunk_size = 20
+                for i in range(0, len(clean_text), chunk_size):
+                    broadcast.publish(clean_text[i:i+chunk_size])
+            broadcast.finish()
+            self.upstream_latency = 0.8 * self.upstream_latency + 0.2 * (time.monotonic() - sent_at)
+
+            full_text = "".join(broadcast.pieces)
+            if cache_key and self.cache and full_text:
+                await self.cache.set(cache_key, model, full_text)
+
+        except asyncio.CancelledError:
+            if reservation and not sent:
+                # 被取消 (超时 / 客户端断开) 时上游请求还没发出：是最后一个预订才退还时隙，
+                # 排在中间的留下空档，后面的请求保持原有间隔
+                if reservation.cancel():
+                    self.disconnect_refunds += 1
+                    logger.info("↩️ 请求已取消，限流时隙已退还")
+                else:
+                    logger.info("↩️ 请求已取消，时隙排在其他预订之前，保留空档不退还")
+            broadcast.fail(asyncio.CancelledError())
+            raise
+        except QuotaLimitError as e:
+            broadcast.fail(e)
         except Exception as e:
-            logger.error(f"❌ [Worker-{worker.id}] 处理严重错误: {e}")
-            asyncio.create_task(self._recycle_worker(worker))
-            raise HTTPException(status_code=500, detail=str(e))
+            if reservation and not sent:
+                # 上游请求还没发出，是最后一个预订时退还时隙 (否则保留空档)
+                reservation.cancel()
+            logger.error(f"❌ 处理严重错误: {e}")
+            broadcast.fail(e)
+        finally:
+            settle_admission()
+            if ticket:
+                ticket.release()
+
+    def _schedule_recycle(self, worker: BrowserWorker):
+        if self._is_stale(worker):
+            return
+        # 有热备窗口时直接顶上，坏掉的窗口关闭即可
+        if self.recycler.replace(worker):
+            return
+        self.pool.mark_recycling(worker)
+        asyncio.create_task(self._recycle_worker(worker))
 
-    async def _recycle_worker(self, worker: BrowserWorker):
+    async def _recycle_worker(self, worker: BrowserWorker, delay: float = 5.0):
         """后台回收并重置 Worker"""
         logger.info(f"🔧 [Worker-{worker.id}] 正在后台重置...")
-        await asyncio.sleep(5)
-        success = await worker.init()
-        if success:
-            await self.pool.put(worker)
-            logger.info(f"✅ [Worker-{worker.id}] 重置成功并归还池子")
-        else:
+        await asyncio.sleep(delay)
+        while self.running and not self._is_stale(worker):
+            success = await worker.init()
+            if self._is_stale(worker):
+                break
+            if success:
+                self.pool.put(worker)
+                logger.info(f"✅ [Worker-{worker.id}] 重置成功并归还池子")
+                return
             logger.error(f"💀 [Worker-{worker.id}] 重置失败，尝试再次重置...")
             await asyncio.sleep(10)
-            await self._recycle_worker(worker)
+        self.pool.remove(worker)
+        await worker.close()
 
     async def get_models(self):
         return JSONResponse({
@@ -363,12 +1272,66 @@ class ToolbazProvider:
             ]
         })
 
+    async def get_cache_info(self, limit: int = 100) -> Dict[str, Any]:
+        if not self.cache:
+            return {"enabled": False}
+        info = {"enabled": True, **self.cache.get_stats(), "items": self.cache.list_entries(limit)}
+        if self.cache.disk:
+            info["disk_entries"] = await self.cache.disk.count()
+            info["disk_bytes"] = await self.cache.disk.size()
+        return info
+
+    async def purge_cache(self, key: Optional[str] = None) -> int:
+        return await self.cache.purge(key) if self.cache else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """运行状态统计"""
+        return {
+            "pool": {**self.pool.get_stats(), "configured_size": settings.BROWSER_POOL_SIZE},
+            "autoscaler": self.autoscaler.get_stats() if self.autoscaler else None,
+            "browser": {
+                "assign": settings.BROWSER_SHARD_ASSIGN,
+                "shards": {shard.name: shard.get_stats(self._shard_load(shard)) for shard in self.shards},
+            },
+            "recycler": self.recycler.get_stats(),
+            "resources": self._resource_stats(),
+            "mint_latency": round(self.mint_latency, 3),
+            "mint_failures": dict(self.mint_failures),
+            "mint_failovers": self.mint_failovers,
+            "upstream_ttfb": round(self.upstream_ttfb, 3),
+            "upstream_latency": round(self.upstream_latency, 3),
+            "admission": self.admission.get_stats(),
+            "client_disconnects": self.client_disconnects,
+            "cancelled_slot_refunds": self.disconnect_refunds,
+            "egress": {
+                i.name: {**i.get_stats(), "assigned": self.scheduler.assigned[i.name]} for i in self.identities
+            },
+            "adaptive_rate": self.adaptive_rate.get_stats() if self.adaptive_rate else None,
+            "fair_queue": self.fair_queue.get_stats() if self.fair_queue else None,
+            "single_flight": self.single_flight.get_stats(),
+            "cache": self.cache.get_stats() if self.cache else None,
+            "tracing": self.trace_exporter.get_stats() if self.trace_exporter else None,
+        }
+
     async def close(self):
         self.running = False
-        while not self.pool.empty():
-            worker = await self.pool.get()
+        for shard in self.shards:
+            await shard.supervisor.stop()
+        await self.recycler.stop()
+        if self.autoscaler:
+            await self.autoscaler.stop()
+        if self.adaptive_rate:
+            await self.adaptive_rate.stop()
+        for identity in self.identities:
+            await identity.aclose()
+        if self.trace_exporter:
+            await self.trace_exporter.aclose()
+        if self.cache:
+            self.cache.close()
+        for worker in self.pool.drain():
             await worker.close()
-        if self.browser:
-            await self.browser.close()
+        for shard in self.shards:
+            if shard.browser:
+                await shard.browser.close()
         if self.playwright:
-            await self.playwright.stop()
\ No newline at end of file
+            await self.playwright.stop()
\ No newline at end of file
@@ -0,0 +1,224 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Set
+from loguru import logger
+
+from app.core import metrics
+
+# 查询时表示 "所有分组"
+_ALL = object()
+
+
+class WorkerPool:
+    """
+    浏览器窗口池：替代裸 asyncio.Queue，记录每个窗口当前所处的状态
+    (idle 空闲 / leased 已租出 / recycling 初始化或重置中)，
+    任何时刻都应满足 total == idle + leased + recycling。
+    空闲窗口按后进先出租用：负载低时热点集中在少数窗口上，其余窗口保持空闲，便于缩容。
+
+    窗口按 key (如出口身份) 分组：租用时指定分组，只会拿到该组的窗口；
+    不传 key 函数时所有窗口属于同一个默认分组 (None)。
+    """
+    def __init__(self, key: Optional[Callable[[Any], Hashable]] = None):
+        self._key = key or (lambda worker: None)
+        self._workers: Dict[str, Any] = {}
+        self._idle: Dict[Hashable, Deque[Any]] = {}
+        self._leased: Set[str] = set()
+        self._recycling: Set[str] = set()
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = {}
+        # 📊 统计
+        self.leases = 0
+        # 进入违反状态的次数 (持续违反期间不重复计数)
+        self.invariant_violations = 0
+        self._invariant_ok = True
+
+    # --- 状态查询 ---
+    def qsize(self, key: Hashable = _ALL) -> int:
+        """空闲窗口数；指定 key 时只统计该分组"""
+        if key is _ALL:
+            return sum(len(q) for q in self._idle.values())
+        return len(self._idle.get(key, ()))
+
+    def empty(self, key: Hashable = _ALL) -> bool:
+        return self.qsize(key) == 0
+
+    @property
+    def size(self) -> int:
+        return len(self._workers)
+
+    @property
+    def waiters(self) -> int:
+        return sum(self.waiters_for(key) for key in self._waiters)
+
+    def waiters_for(self, key: Hashable) -> int:
+        return sum(1 for f in self._waiters.get(key, ()) if not f.done())
+
+    @property
+    def leased(self) -> int:
+        return len(self._leased)
+
+    @property
+    def recycling(self) -> int:
+        return len(self._recycling)
+
+    def idle_workers(self, key: Hashable) -> List[Any]:
+        """该分组当前空闲的窗口 (快照)"""
+        return list(self._idle.get(key, ()))
+
+    def workers(self, key: Hashable = _ALL):
+        if key is _ALL:
+            return list(self._workers.values())
+        return [w for w in self._workers.values() if self._key(w) == key]
+
+    def group_stats(self, key: Hashable) -> Dict[str, int]:
+        workers = self.workers(key)
+        return {
+            "size": len(workers),
+            "idle": self.qsize(key),
+            "leased": sum(1 for w in workers if w.id in self._leased),
+            "recycling": sum(1 for w in workers if w.id in self._recycling),
+            "waiting": self.waiters_for(key),
+        }
+
+    # --- 状态迁移 ---
+    def register(self, worker):
+        """登记一个新窗口 (尚在初始化中，计入 recycling)"""
+        self._workers[worker.id] = worker
+        self._recycling.add(worker.id)
+
+    def put(self, worker):
+        """窗口可用：优先直接交给同组的排队者，否则放回空闲队列"""
+        if worker.id not in self._workers:
+            self.register(worker)
+        self._leased.discard(worker.id)
+        self._recycling.discard(worker.id)
+        key = self._key(worker)
+        waiters = self._waiters.get(key)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                self._leased.add(worker.id)
+                self.leases += 1
+                waiter.set_result(worker)
+                return
+        worker.last_used = time.monotonic()
+        self._idle.setdefault(key, deque()).append(worker)
+
+    def get_nowait(self, key: Hashable = None):
+        idle = self._idle.get(key)
+        if not idle:
+            raise asyncio.QueueEmpty
+        worker = idle.pop()
+        self._leased.add(worker.id)
+        self.leases += 1
+        return worker
+
+    async def get(self, key: Hashable = None):
+        """租用一个窗口；排队期间被取消不会丢失任何窗口"""
+        if self._idle.get(key) and not self.waiters_for(key):
+            return self.get_nowait(key)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 窗口已经交到手上但请求被取消了：转交给下一个人
+                self.put(waiter.result())
+            raise
+
+    def retire_idle(self, idle_for: float = 0.0, keep_per_key: int = 1):
+        """
+        移出最久未使用的空闲窗口 (闲置不足 idle_for 秒则不动)，返回该窗口或 None。
+        窗口数不超过 keep_per_key 的分组不参与：缩容不会让某个出口身份一个窗口都不剩。
+        """
+        oldest = None
+        for key, idle in self._idle.items():
+            if not idle or len(self.workers(key)) <= keep_per_key:
+                continue
+            if oldest is None or idle[0].last_used < oldest.last_used:
+                oldest = idle[0]
+        if oldest is None or time.monotonic() - oldest.last_used < idle_for:
+            return None
+        self.remove(oldest)
+        return oldest
+
+    def take_idle(self, worker) -> bool:
+        """把一个空闲窗口移出空闲队列并标记为 recycling；窗口已被租出或不在池中时返回 False"""
+        try:
+            self._idle.get(self._key(worker), deque()).remove(worker)
+        except ValueError:
+            return False
+        self._recycling.add(worker.id)
+        return True
+
+    def mark_recycling(self, worker):
+        self._leased.discard(worker.id)
+        self._recycling.add(worker.id)
+
+    def remove(self, worker):
+        """彻底移出池子 (关闭 / 缩容)"""
+        self._workers.pop(worker.id, None)
+        self._leased.discard(worker.id)
+        self._recycling.discard(worker.id)
+        try:
+            self._idle.get(self._key(worker), deque()).remove(worker)
+        except ValueError:
+            pass
+
+    def drain(self, exc: Optional[BaseException] = None):
+        """取出全部窗口 (关闭 / 浏览器崩溃时使用)；排队者被取消，传入 exc 时改为以该异常失败"""
+        workers = self.workers()
+        for worker in workers:
+            self.remove(worker)
+        self.fail_waiters(exc)
+        return workers
+
+    def fail_waiters(self, exc: Optional[BaseException] = None, key: Hashable = _ALL):
+        """让排队者 (指定 key 时只有该分组的) 以 exc 失败，不传 exc 时取消"""
+        keys = list(self._waiters) if key is _ALL else [key]
+        for k in keys:
+            for waiter in self._waiters.pop(k, ()):
+                if not waiter.done():
+                    if exc is not None:
+                        waiter.set_exception(exc)
+                    else:
+                        waiter.cancel()
+
+    # --- 账目校验 ---
+    def check_invariant(self) -> bool:
+        idle = [w for q in self._idle.values() for w in q]
+        idle_ids = {w.id for w in idle}
+        ok = (
+            len(idle_ids) == len(idle)
+            and not (idle_ids & self._leased)
+            and not (idle_ids & self._recycling)
+            and not (self._leased & self._recycling)
+            and idle_ids | self._leased | self._recycling == set(self._workers)
+        )
+        if not ok and self._invariant_ok:
+            self.invariant_violations += 1
+            metrics.POOL_INVARIANT_VIOLATIONS.inc()
+            logger.error(
+                f"❌ 窗口池账目不一致: total={len(self._workers)} idle={len(idle)} "
+                f"leased={len(self._leased)} recycling={len(self._recycling)}"
+            )
+        self._invariant_ok = ok
+        return ok
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            "size": self.size,
+            "idle": self.qsize(),
+            "leased": self.leased,
+            "recycling": self.recycling,
+            "waiting": self.waiters,
+            "leases": self.leases,
+            "invariant_ok": self.check_invariant(),
+            "invariant_violations": self.invariant_violations,
+        }
+        groups = {self._key(w) for w in self._workers.values()} | set(self._waiters)
+        if groups - {None}:
+            stats["groups"] = {str(key): self.group_stats(key) for key in sorted(groups, key=str)}
+        return stats
@@ -0,0 +1,192 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from loguru import logger
+
+from app.core import metrics
+from app.providers.browser_supervisor import BrowserCrashedError
+from app.providers.egress import EgressIdentity
+from app.providers.worker_pool import WorkerPool
+
+
+class WorkerRecycler:
+    """
+    窗口轮换 (不在请求路径上)：后台定期检查空闲窗口，用满 max_uses 次或存活超过 max_age 秒的窗口会被替换：
+      - 有同身份的热备窗口 → 热备窗口直接放进池子，旧窗口移出后关闭，再在后台预热一个新的热备
+      - 没有热备 (spares=0) → 该身份没人排队时把旧窗口移出，原地重建
+    每个身份常备 spares 个预热好的窗口 (不在池子里，不接请求)；窗口出错需要重置时也先用热备顶上。
+    """
+    def __init__(
+        self,
+        pool: WorkerPool,
+        identities: List[EgressIdentity],
+        create: Callable[[EgressIdentity], Any],
+        rebuild: Callable[[Any], Awaitable[None]],
+        spares: int = 1,
+        max_uses: int = 50,
+        max_age: float = 0.0,
+        interval: float = 5.0,
+    ):
+        self.pool = pool
+        self.identities = identities
+        self._create = create
+        self._rebuild = rebuild
+        self.spares = max(0, spares)
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.interval = interval
+        self._ready: Dict[str, List[Any]] = {i.name: [] for i in identities}
+        self._warming: Dict[str, int] = {i.name: 0 for i in identities}
+        self._tasks: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        # 浏览器重启期间暂停 (没有可用的浏览器来预热热备)
+        self.paused = False
+
+        # 📊 统计
+        self.spare_swaps = 0
+        self.inplace_rebuilds = 0
+        self.failure_swaps = 0
+        self.spare_init_failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            self._top_up()
+            logger.info(f"♻️ 窗口轮换已启动 (每个身份热备 {self.spares} 个，上限 {self.max_uses} 次 / {self.max_age or '不限'} 秒)")
+
+    async def stop(self):
+        tasks = [self._task, *self._tasks] if self._task else list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        for ready in self._ready.values():
+            while ready:
+                await ready.pop().close()
+
+    def pause(self):
+        """浏览器崩溃：丢弃所有热备 (随浏览器一起失效)，停止预热和原地重建"""
+        self.paused = True
+        for task in list(self._tasks):
+            task.cancel()
+        for ready in self._ready.values():
+            ready.clear()
+
+    def discard(self, predicate: Callable[[Any], bool]):
+        """丢弃符合条件的热备 (如所在的浏览器分片已崩溃)，随后在其余分片上补齐"""
+        for name, ready in self._ready.items():
+            self._ready[name] = [spare for spare in ready if not predicate(spare)]
+        self._top_up()
+
+    def resume(self):
+        """新浏览器就绪：重新补齐热备"""
+        self.paused = False
+        self._top_up()
+
+    def spare_count(self, identity: str) -> int:
+        return len(self._ready.get(identity, ()))
+
+    def expired(self, worker) -> str:
+        """需要轮换的原因 ("uses" / "age")，不需要时返回空字符串"""
+        if self.max_uses and worker.uses_count >= self.max_uses:
+            return "uses"
+        if self.max_age and worker.created_at and time.time() - worker.created_at >= self.max_age:
+            return "age"
+        return ""
+
+    def replace(self, worker, reason: str = "failure") -> bool:
+        """用热备顶替一个已移出服务的窗口 (租出或空闲状态均可)；没有热备时返回 False"""
+        name = worker.identity.name
+        ready = self._ready.get(name)
+        if self.paused or not ready:
+            return False
+        spare = ready.pop()
+        self.pool.remove(worker)
+        self.pool.put(spare)
+        self._background(worker.close())
+        if reason == "failure":
+            self.failure_swaps += 1
+        else:
+            self.spare_swaps += 1
+        metrics.WORKER_RECYCLES.inc(reason=reason, mode="spare")
+        logger.info(f"♻️ [{name}] 热备窗口 [Worker-{spare.id}] 顶替 [Worker-{worker.id}] ({reason})")
+        self._top_up()
+        return True
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.step()
+            except Exception as e:
+                logger.error(f"❌ 窗口轮换出错: {e}")
+
+    def step(self):
+        """执行一轮检查：补齐热备，轮换空闲的过期窗口"""
+        if self.paused:
+            return
+        self._top_up()
+        for identity in self.identities:
+            name = identity.name
+            for worker in self.pool.idle_workers(name):
+                reason = self.expired(worker)
+                if not reason:
+                    continue
+                if self._ready[name]:
+                    self.replace(worker, reason)
+                elif self.spares == 0 and self.pool.waiters_for(name) == 0 and self.pool.take_idle(worker):
+                    self.inplace_rebuilds += 1
+                    metrics.WORKER_RECYCLES.inc(reason=reason, mode="inplace")
+                    logger.info(f"♻️ [{name}] 窗口 [Worker-{worker.id}] 已{'用满' if reason == 'uses' else '超龄'}，后台重建...")
+                    self._background(self._rebuild(worker))
+                # 热备还在预热：旧窗口继续服务，下一轮再换
+
+    def _top_up(self):
+        if self.paused:
+            return
+        for identity in self.identities:
+            name = identity.name
+            for _ in range(self.spares - len(self._ready[name]) - self._warming[name]):
+                self._warming[name] += 1
+                self._background(self._warm(identity))
+
+    async def _warm(self, identity: EgressIdentity):
+        name = identity.name
+        try:
+            while True:
+                try:
+                    spare = self._create(identity)
+                except BrowserCrashedError as e:
+                    # 所有浏览器分片都在重启：放弃这次预热，resume() 时会重新补齐
+                    self.spare_init_failures += 1
+                    logger.warning(f"⚠️ [{name}] 浏览器不可用，暂停预热热备窗口: {e}")
+                    return
+                try:
+                    ok = await spare.init()
+                except asyncio.CancelledError:
+                    await spare.close()
+                    raise
+                if ok:
+                    self._ready[name].append(spare)
+                    logger.info(f"🔥 [{name}] 热备窗口 [Worker-{spare.id}] 已就绪")
+                    return
+                self.spare_init_failures += 1
+                await asyncio.sleep(10)
+        finally:
+            self._warming[name] -= 1
+
+    def _background(self, coro: Awaitable):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_uses": self.max_uses,
+            "max_age": self.max_age or None,
+            "spares": {name: {"ready": len(ready), "warming": self._warming[name]} for name, ready in self._ready.items()},
+            "spare_swaps": self.spare_swaps,
+            "failure_swaps": self.failure_swaps,
+            "inplace_rebuilds": self.inplace_rebuilds,
+            "spare_init_failures": self.spare_init_failures,
+        }
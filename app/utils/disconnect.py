@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Awaitable, Optional
+from fastapi import Request
+
+
+class ClientDisconnected(Exception):
+    """客户端在结果返回前已断开连接"""
+
+
+async def _wait_for_disconnect(request: Request, interval: float):
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def run_until_disconnect(coro: Awaitable[Any], request: Optional[Request], interval: float = 0.5) -> Any:
+    """
+    执行 coro，同时监听客户端连接；一旦客户端断开就取消 coro 并抛出 ClientDisconnected，
+    让排队中的等待、在途的上游调用都能及时停下来释放资源。
+    """
+    task = asyncio.ensure_future(coro)
+    if request is None:
+        return await task
+
+    watcher = asyncio.create_task(_wait_for_disconnect(request, interval))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if task in done:
+        return task.result()
+    if watcher.exception() is not None:
+        # 检测本身出错时不影响正常处理
+        return await task
+
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    raise ClientDisconnected()
@@ -0,0 +1,134 @@
+import time
+import asyncio
+import inspect
+from typing import Dict, Any, Optional
+from loguru import logger
+import httpx
+
+
+def _proxy_kwargs(proxy: Optional[str]) -> Dict[str, Any]:
+    """httpx 0.26 起改用 proxy=，之前的版本 (requirements 里的 0.25) 只认 proxies="""
+    if not proxy:
+        return {}
+    if "proxy" in inspect.signature(httpx.AsyncClient.__init__).parameters:
+        return {"proxy": proxy}
+    return {"proxies": proxy}
+
+
+class PooledHttpClient:
+    """
+    进程内共享的长连接 httpx 客户端：统一连接池/超时配置，
+    并通过 httpcore 的 trace 钩子统计连接复用率和握手耗时。
+    """
+    def __init__(
+        self,
+        http2: bool = False,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 120.0,
+        write_timeout: float = 20.0,
+        pool_timeout: float = 10.0,
+        proxy: Optional[str] = None,
+    ):
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("⚠️ 未安装 h2 (pip install 'httpx[http2]')，已退回 HTTP/1.1")
+                http2 = False
+        self.http2 = http2
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout
+        )
+        self.proxy = proxy
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=self.timeout,
+            **_proxy_kwargs(proxy),
+        )
+
+        # 📊 统计
+        self.requests = 0
+        self.new_connections = 0
+        self.handshake_total = 0.0
+        self.handshake_max = 0.0
+
+    def stage_timeout(self, read: float) -> httpx.Timeout:
+        """按阶段覆盖读超时，其余沿用全局配置"""
+        return httpx.Timeout(
+            connect=self.timeout.connect, read=read, write=self.timeout.write, pool=self.timeout.pool
+        )
+
+    def _make_trace(self):
+        started: Dict[str, float] = {}
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            if event_name == "connection.connect_tcp.started":
+                started["connect"] = time.perf_counter()
+            elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                if "connect" in started:
+                    started["done"] = time.perf_counter()
+        trace.started = started
+        return trace
+
+    def _record(self, trace):
+        self.requests += 1
+        started = trace.started
+        if "connect" in started:
+            self.new_connections += 1
+            elapsed = started.get("done", time.perf_counter()) - started["connect"]
+            self.handshake_total += elapsed
+            self.handshake_max = max(self.handshake_max, elapsed)
+
+    def build_request(self, method: str, url: str, **kwargs) -> httpx.Request:
+        trace = self._make_trace()
+        extensions = kwargs.pop("extensions", {}) or {}
+        extensions["trace"] = trace
+        return self.client.build_request(method, url, extensions=extensions, **kwargs)
+
+    async def send(self, request: httpx.Request, stream: bool = False) -> httpx.Response:
+        trace = request.extensions.get("trace")
+        try:
+            return await self.client.send(request, stream=stream)
+        finally:
+            if trace is not None:
+                self._record(trace)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.send(self.build_request("POST", url, **kwargs))
+
+    async def prewarm(self, url: str, connections: int = 1):
+        """启动时预先建立到上游的连接 (DNS + TCP + TLS)，后续请求直接复用"""
+        count = 1 if self.http2 else max(1, connections)
+
+        async def _touch():
+            try:
+                resp = await self.send(self.build_request("HEAD", url, timeout=self.stage_timeout(10)))
+                await resp.aclose()
+            except Exception as e:
+                logger.warning(f"⚠️ 连接预热失败 ({url}): {e}")
+
+        await asyncio.gather(*[_touch() for _ in range(count)])
+        logger.info(f"🔌 已预热 {count} 条到 {url} 的连接")
+
+    def get_stats(self) -> Dict[str, Any]:
+        reused = self.requests - self.new_connections
+        return {
+            "http2": self.http2,
+            "proxy": bool(self.proxy),
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+            "avg_handshake_ms": round(self.handshake_total / self.new_connections * 1000, 2) if self.new_connections else 0.0,
+            "max_handshake_ms": round(self.handshake_max * 1000, 2),
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
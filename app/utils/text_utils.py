@@ -0,0 +1,92 @@
+import re
+import html
+
+_BR_TAGS = ("<br>", "<br/>", "<br />")
+_MODEL_PREFIX = re.compile(r'^\[model:.*?\]\s*', flags=re.IGNORECASE)
+_TOOLBAZ_PREFIX = re.compile(r'^Toolbaz.*?:', flags=re.IGNORECASE)
+# 末尾可能被截断的 HTML 实体 / 标签，需要等下一块数据再处理
+_PARTIAL_ENTITY = re.compile(r'&[#a-zA-Z0-9]{0,10}$')
+_PARTIAL_TAG = re.compile(r'<[brBR /]{0,5}$')
+
+
+def _convert(text: str) -> str:
+    for tag in _BR_TAGS:
+        text = text.replace(tag, "\n")
+    return html.unescape(text)
+
+
+def clean_response_text(text: str) -> str:
+    """清洗 writing.php 的完整返回内容"""
+    if not text: return ""
+    text = _convert(text)
+    text = _MODEL_PREFIX.sub('', text)
+    text = _TOOLBAZ_PREFIX.sub('', text)
+    return text.strip()
+
+
+class StreamingTextCleaner:
+    """
+    clean_response_text 的增量版本：上游数据一到就清洗并吐出，
+    只在必要时暂存 (开头的 [model:...] / Toolbaz...: 前缀、被截断的实体和 <br>、末尾空白)。
+    无论上游怎样分块，拼接起来的输出都与对完整文本调用 clean_response_text 相同。
+    前缀不设长度上限 (两个前缀的正则都只匹配到行尾)：以 "[model:" / "Toolbaz" 开头的回复，
+    要等到 "]" / ":"、换行或结束才开始输出。
+    """
+
+    def __init__(self):
+        self._raw = ""
+        self._prefix_done = False
+        self._head = ""
+        self._pending_ws = ""
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        self._raw += chunk
+        cut = len(self._raw)
+        for pattern in (_PARTIAL_ENTITY, _PARTIAL_TAG):
+            m = pattern.search(self._raw)
+            if m:
+                cut = min(cut, m.start())
+        ready, self._raw = self._raw[:cut], self._raw[cut:]
+        return self._emit(_convert(ready))
+
+    def flush(self) -> str:
+        text = _convert(self._raw)
+        self._raw = ""
+        out = self._emit(text, final=True)
+        self._pending_ws = ""
+        return out
+
+    def _emit(self, text: str, final: bool = False) -> str:
+        if not self._prefix_done:
+            self._head += text
+            text = self._resolve_prefix(final)
+            if text is None:
+                return ""
+        if not self._started:
+            # 开头空白直接丢弃 (与 strip() 的效果一致)
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        # 末尾空白先扣住，等后面出现正文再一起输出 (与 strip() 的效果一致)
+        text = self._pending_ws + text
+        body = text.rstrip()
+        self._pending_ws = text[len(body):]
+        return body
+
+    def _resolve_prefix(self, final: bool):
+        # 与 clean_response_text 一致：前缀必须从第一个字符开始，前面有空白就不算前缀
+        head = self._head
+        if not final:
+            # 可能还是 "[model:...]" / "Toolbaz...:" 的开头，继续等
+            if head.startswith("[") and "[model:".startswith(head.lower()[:7]) and "]" not in head and "\n" not in head:
+                return None
+            rest = _MODEL_PREFIX.sub('', head)
+            if "toolbaz".startswith(rest.lower()[:7]) and ":" not in rest and "\n" not in rest:
+                return None
+        head = _MODEL_PREFIX.sub('', head)
+        head = _TOOLBAZ_PREFIX.sub('', head)
+        self._prefix_done = True
+        self._head = ""
+        return head
@@ -0,0 +1,99 @@
+import math
+from typing import Any, Dict, Iterable, List
+
+
+class HdrHistogram:
+    """
+    精简版 HDR 直方图：对数分段 + 段内线性细分，在整个量程内保持固定的相对精度。
+    数值以微秒整数记录，默认 3 位有效数字 (相对误差 < 0.1%)。
+    """
+    def __init__(self, lowest: int = 1, highest: int = 3_600_000_000, significant_digits: int = 3):
+        self.lowest = lowest
+        self.highest = highest
+        self.significant_digits = significant_digits
+        # 每个对数段内的线性子桶数
+        self.sub_buckets = 2 ** math.ceil(math.log2(2 * 10 ** significant_digits))
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+
+    def _index(self, value: int) -> int:
+        if value < self.sub_buckets:
+            return value
+        exponent = value.bit_length() - int(math.log2(self.sub_buckets))
+        return (exponent << 32) | (value >> exponent)
+
+    def _value_at(self, index: int) -> int:
+        exponent = index >> 32
+        if exponent == 0:
+            return index
+        sub = index & 0xFFFFFFFF
+        # 取桶的中点作为代表值
+        return (sub << exponent) + (1 << (exponent - 1))
+
+    def record(self, value: float):
+        value = int(min(max(value, self.lowest), self.highest))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def record_seconds(self, seconds: float):
+        self.record(seconds * 1_000_000)
+
+    def percentile(self, percent: float) -> int:
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(self.total * percent / 100.0))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._value_at(index), self.max)
+        return self.max
+
+    def merge(self, other: "HdrHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        for attr, pick in (("min", min), ("max", max)):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            if theirs is not None:
+                setattr(self, attr, theirs if mine is None else pick(mine, theirs))
+
+    def summary(self, percentiles: Iterable[float] = (50, 90, 95, 99, 99.9)) -> Dict[str, Any]:
+        """以毫秒为单位的摘要"""
+        ms = lambda us: round(us / 1000.0, 3)
+        result: Dict[str, Any] = {
+            "count": self.total,
+            "min_ms": ms(self.min or 0),
+            "max_ms": ms(self.max or 0),
+            "mean_ms": ms(self.sum / self.total) if self.total else 0.0,
+        }
+        for p in percentiles:
+            result[f"p{p:g}_ms"] = ms(self.percentile(p))
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """完整的可序列化形式 (可用 from_dict 还原后再合并/比较)"""
+        return {
+            "significant_digits": self.significant_digits,
+            "counts": [[index, count] for index, count in sorted(self.counts.items())],
+            "min": self.min,
+            "max": self.max,
+            "sum": self.sum,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HdrHistogram":
+        hist = cls(significant_digits=data.get("significant_digits", 3))
+        counts: List[List[int]] = data.get("counts", [])
+        hist.counts = {index: count for index, count in counts}
+        hist.total = sum(hist.counts.values())
+        hist.min, hist.max, hist.sum = data.get("min"), data.get("max"), data.get("sum", 0)
+        return hist
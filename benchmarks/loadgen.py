@@ -0,0 +1,201 @@
+import time
+import uuid
+import random
+import asyncio
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.hdr import HdrHistogram
+
+
+@dataclass
+class LoadConfig:
+    base_url: str = "http://127.0.0.1:8000"
+    # open: 泊松到达 (开环)；closed: 固定并发，每个虚拟用户收到结果后立即发下一个 (闭环)
+    mode: str = "closed"
+    # 开环模式下的平均到达率 (次/秒)
+    rate: float = 1.0
+    # 闭环模式下的并发数；开环模式下的最大在途请求数
+    concurrency: int = 4
+    duration: float = 60.0
+    stream: bool = True
+    model: str = "toolbaz-v4.5-fast"
+    # 每个请求使用不同的 prompt (绕开缓存和请求合并)，设为 0~1 之间的值表示重复 prompt 的比例
+    duplicate_ratio: float = 0.0
+    api_key: str = ""
+    # 读取 /stats 用的管理员 key (/stats 只对管理员开放)，留空时沿用 api_key
+    admin_key: str = ""
+    request_timeout: float = 180.0
+    stats_interval: float = 0.5
+    seed: int = 0
+
+
+@dataclass
+class LoadResult:
+    config: Dict[str, Any]
+    started_at: float
+    elapsed: float
+    sent: int = 0
+    completed: int = 0
+    status_codes: Dict[str, int] = field(default_factory=dict)
+    errors: Dict[str, int] = field(default_factory=dict)
+    ttfb: HdrHistogram = field(default_factory=HdrHistogram)
+    latency: HdrHistogram = field(default_factory=HdrHistogram)
+    pool_samples: List[Dict[str, float]] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        ok = self.status_codes.get("200", 0)
+        utilisation = [s["utilisation"] for s in self.pool_samples if s.get("utilisation") is not None]
+        waiting = [s["waiting"] for s in self.pool_samples if s.get("waiting") is not None]
+        return {
+            "sent": self.sent,
+            "completed": self.completed,
+            "succeeded": ok,
+            "throughput_rps": round(ok / self.elapsed, 4) if self.elapsed else 0.0,
+            "status_codes": self.status_codes,
+            "errors": self.errors,
+            "ttfb": self.ttfb.summary(),
+            "latency": self.latency.summary(),
+            "pool_utilisation_mean": round(sum(utilisation) / len(utilisation), 4) if utilisation else None,
+            "pool_utilisation_max": round(max(utilisation), 4) if utilisation else None,
+            "pool_waiting_max": max(waiting) if waiting else None,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "config": self.config,
+            "started_at": self.started_at,
+            "elapsed": round(self.elapsed, 3),
+            "summary": self.summary(),
+            "histograms": {"ttfb": self.ttfb.to_dict(), "latency": self.latency.to_dict()},
+            "pool_samples": self.pool_samples,
+        }
+
+
+class LoadGenerator:
+    """对 /v1/chat/completions 施加开环或闭环负载，记录 TTFB / 总耗时 / 状态码 / 池子利用率"""
+    def __init__(self, config: LoadConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.result = LoadResult(config=asdict(config), started_at=time.time(), elapsed=0.0)
+        self._prompts: List[str] = []
+
+    def _next_prompt(self) -> str:
+        if self._prompts and self.rng.random() < self.config.duplicate_ratio:
+            return self.rng.choice(self._prompts)
+        prompt = f"benchmark {uuid.uuid4().hex[:12]}: say something short"
+        self._prompts.append(prompt)
+        return prompt
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.config.api_key:
+            headers["Authorization"] = f"Bearer {self.config.api_key}"
+        return headers
+
+    def _stats_headers(self) -> Dict[str, str]:
+        key = self.config.admin_key or self.config.api_key
+        return {"Authorization": f"Bearer {key}"} if key else {}
+
+    async def _one_request(self, client: httpx.AsyncClient):
+        payload = {
+            "model": self.config.model,
+            "stream": self.config.stream,
+            "messages": [{"role": "user", "content": self._next_prompt()}],
+        }
+        if self.config.duplicate_ratio <= 0:
+            payload["cache"] = False
+        result = self.result
+        result.sent += 1
+        started = time.perf_counter()
+        first_byte: Optional[float] = None
+        try:
+            async with client.stream(
+                "POST", "/v1/chat/completions", json=payload, headers=self._headers()
+            ) as resp:
+                async for chunk in resp.aiter_bytes():
+                    if first_byte is None and chunk:
+                        first_byte = time.perf_counter()
+                status = str(resp.status_code)
+        except Exception as e:
+            status = "error"
+            name = type(e).__name__
+            result.errors[name] = result.errors.get(name, 0) + 1
+        finished = time.perf_counter()
+
+        result.completed += 1
+        result.status_codes[status] = result.status_codes.get(status, 0) + 1
+        if status == "200":
+            result.latency.record_seconds(finished - started)
+            result.ttfb.record_seconds((first_byte or finished) - started)
+
+    async def _closed_loop(self, client: httpx.AsyncClient, deadline: float):
+        async def user():
+            while time.monotonic() < deadline:
+                await self._one_request(client)
+        await asyncio.gather(*[user() for _ in range(self.config.concurrency)])
+
+    async def _open_loop(self, client: httpx.AsyncClient, deadline: float):
+        in_flight = asyncio.Semaphore(self.config.concurrency)
+        tasks = set()
+
+        async def fire():
+            try:
+                await self._one_request(client)
+            finally:
+                in_flight.release()
+
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.rng.expovariate(self.config.rate))
+            if time.monotonic() >= deadline:
+                break
+            if in_flight.locked():
+                # 到达时已达在途上限：记为被客户端丢弃，保持开环到达过程不受服务端速度影响
+                self.result.errors["client_overflow"] = self.result.errors.get("client_overflow", 0) + 1
+                continue
+            await in_flight.acquire()
+            task = asyncio.create_task(fire())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def _sample_pool(self, client: httpx.AsyncClient, stop: asyncio.Event):
+        t0 = time.monotonic()
+        while not stop.is_set():
+            try:
+                stats = (await client.get("/stats", headers=self._stats_headers(), timeout=5)).json()
+                pool = stats.get("pool") or {}
+                size = pool.get("size") or 0
+                self.result.pool_samples.append({
+                    "t": round(time.monotonic() - t0, 3),
+                    "idle": pool.get("idle"),
+                    "leased": pool.get("leased"),
+                    "waiting": pool.get("waiting"),
+                    "utilisation": (pool.get("leased", 0) / size) if size else None,
+                })
+            except Exception:
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.config.stats_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> LoadResult:
+        limits = httpx.Limits(max_connections=self.config.concurrency + 4)
+        timeout = httpx.Timeout(self.config.request_timeout)
+        async with httpx.AsyncClient(base_url=self.config.base_url, limits=limits, timeout=timeout) as client:
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(self._sample_pool(client, stop))
+            started = time.monotonic()
+            deadline = started + self.config.duration
+            if self.config.mode == "open":
+                await self._open_loop(client, deadline)
+            else:
+                await self._closed_loop(client, deadline)
+            self.result.elapsed = time.monotonic() - started
+            stop.set()
+            await sampler
+        return self.result
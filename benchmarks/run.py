@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+/v1/chat/completions 端到端压测
+
+默认会自动拉起本地 Toolbaz 模拟器 (tools.toolbaz_emulator) 和 main:app，
+把服务指向模拟器后施加负载；也可以用 --target 压一个已经在跑的服务。
+
+用法:
+    # 闭环：8 个并发用户，流式，跑 60 秒，结果存为基线
+    python -m benchmarks.run --boot --mode closed --concurrency 8 --stream --out baseline.json
+
+    # 开环：泊松到达 2 次/秒，非流式，对比基线 (退化超过 10% 时退出码为 1)
+    python -m benchmarks.run --boot --mode open --rate 2 --no-stream --compare baseline.json --threshold 0.1
+
+    # 服务端参数通过环境变量透传，例如:
+    BROWSER_POOL_SIZE=4 RATE_LIMIT_PER_MINUTE=60 python -m benchmarks.run --boot ...
+
+    # 服务开启了 API Key 时，请求用 --api-key，读取 /stats 需要管理员 key (主 key 即可)
+    API_MASTER_KEY=sk-admin python -m benchmarks.run --boot --api-key sk-admin ...
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.loadgen import LoadConfig, LoadGenerator
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 对比时检查的指标：(路径, 越大越好?)
+COMPARED_METRICS: List[Tuple[str, bool]] = [
+    ("ttfb.p50_ms", False),
+    ("ttfb.p95_ms", False),
+    ("ttfb.p99_ms", False),
+    ("latency.p50_ms", False),
+    ("latency.p95_ms", False),
+    ("latency.p99_ms", False),
+    ("throughput_rps", True),
+]
+
+
+# 记录到结果里的服务端配置 (通过环境变量透传给 main:app)
+_SERVER_ENV_KEYS = {
+    "BROWSER_POOL_SIZE",
+    "CONTEXT_MAX_USES",
+    "RATE_LIMIT_ALGORITHM",
+    "RATE_LIMIT_PER_MINUTE",
+    "RATE_LIMIT_BURST",
+    "TOKEN_RESERVOIR_SIZE",
+    "UPSTREAM_STREAMING",
+    "UPSTREAM_HTTP2",
+    "SINGLE_FLIGHT_ENABLED",
+    "CACHE_ENABLED",
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, timeout: float, proc: subprocess.Popen):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"进程提前退出 (code={proc.returncode}): {' '.join(proc.args)}")
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise TimeoutError(f"等待 {url} 就绪超时")
+
+
+def _stats_headers(args) -> Dict[str, str]:
+    """/stats 只对管理员开放：带上 --admin-key (留空时用 --api-key)"""
+    key = args.admin_key or args.api_key
+    return {"Authorization": f"Bearer {key}"} if key else {}
+
+
+def _wait_pool_ready(base_url: str, timeout: float, headers: Dict[str, str]):
+    """等浏览器池至少有一个 worker 初始化完成，避免把冷启动算进结果"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            resp = httpx.get(f"{base_url}/stats", headers=headers, timeout=2)
+            if resp.status_code in (401, 403):
+                raise PermissionError(f"/stats 需要管理员 API Key (--admin-key / --api-key): HTTP {resp.status_code}")
+            pool = resp.json().get("pool") or {}
+            if pool.get("idle", 0) > 0:
+                return
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("等待浏览器池就绪超时")
+
+
+@contextmanager
+def boot_stack(args):
+    """启动模拟器 + main:app，退出时一并关闭"""
+    emulator_port = args.emulator_port or _free_port()
+    app_port = args.app_port or _free_port()
+    emulator_url = f"http://127.0.0.1:{emulator_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    emulator_cmd = [sys.executable, "-m", "tools.toolbaz_emulator", "--port", str(emulator_port)]
+    emulator_cmd += args.emulator_arg or []
+    env = dict(os.environ)
+    env.update({
+        "TOOLBAZ_BASE_URL": emulator_url,
+        "TOOLBAZ_API_BASE_URL": emulator_url,
+    })
+    app_cmd = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning",
+    ]
+
+    procs: List[subprocess.Popen] = []
+    log = open(args.server_log, "ab") if args.server_log else subprocess.DEVNULL
+    try:
+        emulator = subprocess.Popen(emulator_cmd, cwd=REPO_ROOT, stdout=log, stderr=log)
+        procs.append(emulator)
+        _wait_http(f"{emulator_url}/", args.boot_timeout, emulator)
+        print(f"🧪 模拟器已启动: {emulator_url}")
+
+        app = subprocess.Popen(app_cmd, cwd=REPO_ROOT, env=env, stdout=log, stderr=log)
+        procs.append(app)
+        _wait_http(f"{app_url}/health", args.boot_timeout, app)
+        _wait_pool_ready(app_url, args.boot_timeout, _stats_headers(args))
+        print(f"🚀 服务已启动: {app_url}")
+        yield app_url, emulator_url
+    finally:
+        for proc in reversed(procs):
+            if proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        if log is not subprocess.DEVNULL:
+            log.close()
+
+
+def _lookup(summary: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = summary
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """逐项对比，返回每个指标的变化；regression=True 表示比基线差了超过 threshold"""
+    rows = []
+    for path, higher_is_better in COMPARED_METRICS:
+        old = _lookup(baseline["summary"], path)
+        new = _lookup(current["summary"], path)
+        if old is None or new is None or old == 0:
+            rows.append({"metric": path, "baseline": old, "current": new, "change": None, "regression": False})
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        rows.append({
+            "metric": path,
+            "baseline": old,
+            "current": new,
+            "change": round(change, 4),
+            "regression": worse > threshold,
+        })
+    return rows
+
+
+def print_summary(summary: Dict[str, Any]):
+    print(f"\n📊 请求: 发出 {summary['sent']} / 完成 {summary['completed']} / 成功 {summary['succeeded']}")
+    print(f"   状态码: {summary['status_codes']}  错误: {summary['errors'] or '-'}")
+    print(f"   吞吐: {summary['throughput_rps']} req/s")
+    for name in ("ttfb", "latency"):
+        h = summary[name]
+        print(
+            f"   {name:<8} p50={h['p50_ms']}ms  p95={h['p95_ms']}ms  p99={h['p99_ms']}ms  "
+            f"max={h['max_ms']}ms  (n={h['count']})"
+        )
+    print(
+        f"   池子利用率: 平均 {summary['pool_utilisation_mean']}  峰值 {summary['pool_utilisation_max']}  "
+        f"最大排队 {summary['pool_waiting_max']}"
+    )
+
+
+def print_comparison(rows: List[Dict[str, Any]], threshold: float):
+    print(f"\n🔍 与基线对比 (阈值 {threshold:.0%}):")
+    for row in rows:
+        change = "n/a" if row["change"] is None else f"{row['change']:+.1%}"
+        flag = "❌ 退化" if row["regression"] else "✅"
+        print(f"   {row['metric']:<16} {row['baseline']!s:>10} -> {row['current']!s:<10} {change:>8}  {flag}")
+
+
+def parse_args(argv=None):
+    defaults = LoadConfig()
+    parser = argparse.ArgumentParser(description="/v1/chat/completions 端到端压测")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--boot", action="store_true", help="自动启动模拟器和 main:app (默认)")
+    target.add_argument("--target", help="压测已在运行的服务，如 http://127.0.0.1:7860")
+
+    parser.add_argument("--mode", choices=["open", "closed"], default=defaults.mode)
+    parser.add_argument("--rate", type=float, default=defaults.rate, help="开环到达率 (次/秒)")
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency)
+    parser.add_argument("--duration", type=float, default=defaults.duration, help="压测时长 (秒)")
+    parser.add_argument("--stream", dest="stream", action="store_true", default=defaults.stream)
+    parser.add_argument("--no-stream", dest="stream", action="store_false")
+    parser.add_argument("--model", default=defaults.model)
+    parser.add_argument("--duplicate-ratio", type=float, default=defaults.duplicate_ratio,
+                        help="重复 prompt 的比例 (>0 时会命中缓存/请求合并)")
+    parser.add_argument("--api-key", default=defaults.api_key)
+    parser.add_argument("--admin-key", default=defaults.admin_key,
+                        help="读取 /stats 用的管理员 key (留空时用 --api-key)")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+    parser.add_argument("--out", help="结果 JSON 输出路径")
+    parser.add_argument("--compare", help="基线 JSON 路径")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定退化的相对变化阈值")
+
+    parser.add_argument("--emulator-port", type=int, default=0)
+    parser.add_argument("--app-port", type=int, default=0)
+    parser.add_argument("--emulator-arg", action="append",
+                        help="透传给模拟器的参数，如 --emulator-arg=--quota-per-minute=0")
+    parser.add_argument("--boot-timeout", type=float, default=120.0)
+    parser.add_argument("--server-log", help="子进程日志输出文件")
+    return parser.parse_args(argv)
+
+
+async def _run_load(base_url: str, args) -> Dict[str, Any]:
+    config = LoadConfig(
+        base_url=base_url,
+        mode=args.mode,
+        rate=args.rate,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        stream=args.stream,
+        model=args.model,
+        duplicate_ratio=args.duplicate_ratio,
+        api_key=args.api_key,
+        admin_key=args.admin_key,
+        seed=args.seed,
+    )
+    print(
+        f"⏱️ {config.mode}-loop, "
+        f"{'rate=' + str(config.rate) + '/s' if config.mode == 'open' else 'concurrency=' + str(config.concurrency)}, "
+        f"{'stream' if config.stream else 'non-stream'}, {config.duration}s -> {base_url}"
+    )
+    result = await LoadGenerator(config).run()
+    data = result.to_dict()
+    try:
+        # 附上服务端在压测结束时的统计，便于分析
+        async with httpx.AsyncClient(timeout=5) as client:
+            resp = await client.get(f"{base_url}/stats", headers=_stats_headers(args))
+            resp.raise_for_status()
+            data["server_stats"] = resp.json()
+    except Exception:
+        data["server_stats"] = None
+    return data
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.target:
+        data = asyncio.run(_run_load(args.target.rstrip("/"), args))
+    else:
+        with boot_stack(args) as (app_url, emulator_url):
+            data = asyncio.run(_run_load(app_url, args))
+            try:
+                data["emulator_stats"] = httpx.get(f"{emulator_url}/__emulator/stats", timeout=5).json()
+            except (httpx.HTTPError, ValueError):
+                data["emulator_stats"] = None
+        data["server_env"] = {k: v for k, v in os.environ.items() if k in _SERVER_ENV_KEYS}
+
+    print_summary(data["summary"])
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(baseline, data, args.threshold)
+        data["comparison"] = {"baseline": args.compare, "threshold": args.threshold, "metrics": rows}
+        print_comparison(rows, args.threshold)
+        if any(row["regression"] for row in rows):
+            exit_code = 1
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 结果已保存: {args.out}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,27 +6,64 @@ HuggingFace Spaces 增强版本
 
 import sys
 import os
+import math
 import logging
 import asyncio
 from contextlib import asynccontextmanager
 import time
+from typing import Any, Dict, Optional
 
 # 添加app目录到Python路径
 sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi import FastAPI, Request, Depends, Header, HTTPException, UploadFile, File, Form
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 # 导入原始的ToolbazProvider
 from app.core.config import settings
+from app.core import metrics
+from app.core.api_keys import ApiKey, KeyRing
+from app.core.admission import parse_timeout
+from app.core.jobs import JobManager, JobStore, JobQueueFull, WebhookURLError, check_webhook_url
+from app.core.batches import BatchManager, BatchStore, BatchRequestError
+from app.utils.sse_utils import create_sse_data, create_chat_completion_chunk, DONE_CHUNK
 from app.providers.toolbaz_provider import ToolbazProvider
+from app.utils.disconnect import ClientDisconnected
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("toolbaz-hf-enhanced")
 
 provider = ToolbazProvider()
+keyring = KeyRing(settings.API_MASTER_KEY, settings.API_KEYS)
+
+# 异步任务：按提交者的 API Key 走同一条公平队列 / 限流路径
+job_manager: Optional[JobManager] = None
+if settings.JOBS_ENABLED:
+    job_manager = JobManager(
+        run=lambda job: provider.run_completion(job.request, keyring.get(job.owner)),
+        estimate_start=lambda job: provider.estimate_start(keyring.get(job.owner)),
+        store=JobStore(settings.JOBS_DB_PATH),
+        max_pending=settings.JOBS_MAX_PENDING,
+        max_attempts=settings.JOBS_MAX_ATTEMPTS,
+        retention=settings.JOBS_RETENTION,
+        webhook_timeout=settings.JOBS_WEBHOOK_TIMEOUT,
+        webhook_retries=settings.JOBS_WEBHOOK_RETRIES,
+        webhook_allowed_hosts=settings.JOBS_WEBHOOK_ALLOWED_HOSTS,
+    )
+
+# 批处理：以提交者 key 的低权重后台身份排队，拥塞时让着交互式请求
+batch_manager: Optional[BatchManager] = None
+if settings.BATCHES_ENABLED:
+    batch_manager = BatchManager(
+        run=lambda owner, body: provider.run_completion(body, keyring.background(owner, settings.BATCH_PRIORITY)),
+        store=BatchStore(settings.BATCH_DIR),
+        concurrency=settings.BATCH_CONCURRENCY or len(provider.identities) * settings.FAIR_QUEUE_SLOTS_PER_IDENTITY,
+        max_attempts=settings.BATCH_MAX_ATTEMPTS,
+        max_requests=settings.BATCH_MAX_REQUESTS,
+        max_file_bytes=settings.BATCH_MAX_FILE_BYTES,
+    )
 
 # 用于存储请求状态
 request_status = {}
@@ -37,6 +74,10 @@ async def lifespan(app: FastAPI):
     try:
         await provider.initialize()
         logger.info("✅ ToolbazProvider初始化成功")
+        if job_manager:
+            await job_manager.start()
+        if batch_manager:
+            await batch_manager.start()
         yield
     except Exception as e:
         logger.error(f"❌ ToolbazProvider初始化失败: {e}")
@@ -45,6 +86,10 @@ async def lifespan(app: FastAPI):
     finally:
         logger.info("🔄 正在关闭浏览器资源...")
         try:
+            if job_manager:
+                await job_manager.stop()
+            if batch_manager:
+                await batch_manager.stop()
             await provider.close()
         except:
             pass
@@ -636,20 +681,23 @@ async def root():
 async def health():
     """健康检查"""
     try:
-        # 检查provider状态
-        if hasattr(provider, 'browser_pool') and provider.browser_pool:
+        # 检查浏览器池状态：至少有一个窗口初始化完成 (空闲或正在使用) 才算可用
+        pool = provider.pool.get_stats()
+        if pool["idle"] + pool["leased"] > 0:
             return {
                 "status": "🟢 服务正常运行",
                 "success": True,
                 "version": "v3.1.0",
-                "environment": "HuggingFace Spaces - 增强版"
+                "environment": "HuggingFace Spaces - 增强版",
+                "pool": pool
             }
         else:
             return {
                 "status": "🟡 浏览器正在初始化",
                 "success": False,
                 "version": "v3.1.0",
-                "environment": "HuggingFace Spaces - 初始化中"
+                "environment": "HuggingFace Spaces - 初始化中",
+                "pool": pool
             }
     except Exception as e:
         return {
@@ -659,25 +707,69 @@ async def health():
             "environment": "HuggingFace Spaces - 错误"
         }
 
+async def verify_key(authorization: str = Header(None)) -> ApiKey:
+    """校验 Authorization: Bearer <key>，返回对应的调用方 (未配置 key 时为 anonymous)"""
+    api_key = keyring.authenticate(authorization)
+    if api_key is None:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+    return api_key
+
+async def verify_admin(api_key: ApiKey = Depends(verify_key)) -> ApiKey:
+    """管理接口 (运行状态、缓存内容) 只对管理员 key 开放：缓存里是所有调用方的提示词"""
+    if not api_key.admin:
+        raise HTTPException(status_code=403, detail="Admin API key required")
+    return api_key
+
+def quota_exceeded(api_key: ApiKey) -> Optional[JSONResponse]:
+    """占用一次该 key 的每分钟配额，超出时返回 429 响应"""
+    retry_after = api_key.take_quota()
+    if retry_after <= 0:
+        return None
+    logger.warning(f"🚫 [{api_key.name}] 超出每分钟请求配额")
+    return JSONResponse(
+        {"error": f"API key quota exceeded ({api_key.quota_per_minute:g} req/min)."},
+        status_code=429,
+        headers={"Retry-After": str(math.ceil(retry_after))}
+    )
+
+def unknown_model(data: Dict[str, Any]) -> Optional[JSONResponse]:
+    """模型不在 MODELS 里时返回 400 响应 (模型名来自客户端，不能原样进入缓存键、指标和上游请求)"""
+    model = data.get("model", settings.DEFAULT_MODEL)
+    if model in settings.MODELS:
+        return None
+    return JSONResponse(
+        {"error": f"Unknown model: {model}. Available models: {', '.join(settings.MODELS)}"}, status_code=400
+    )
+
 # 增强版聊天完成接口
 @app.post("/v1/chat/completions")
-async def enhanced_chat_completions(request: Request):
+async def enhanced_chat_completions(request: Request, api_key: ApiKey = Depends(verify_key)):
     """增强版聊天完成接口，带更好的超时和进度处理"""
     try:
         data = await request.json()
         
         # 检查请求ID
         request_id = request.headers.get("X-Request-ID", str(int(time.time())))
-        logger.info(f"🆔 处理请求 [{request_id}]: {data.get('model', 'unknown')}")
+        logger.info(f"🆔 处理请求 [{request_id}] ({api_key.name}): {data.get('model', 'unknown')}")
+
+        # 每个 key 的请求配额
+        rejected = unknown_model(data) or quota_exceeded(api_key)
+        if rejected:
+            return rejected
         
-        # 设置超时处理
+        # 设置超时处理：X-Request-Timeout 或默认预算，预计赶不上时 provider 会直接返回 429 / 503
+        timeout = parse_timeout(
+            request.headers.get("X-Request-Timeout"), settings.REQUEST_TIMEOUT, settings.REQUEST_TIMEOUT_MAX
+        )
         try:
-            # 使用原始provider但添加更长的超时
             result = await asyncio.wait_for(
-                provider.chat_completion(data), 
-                timeout=120.0  # 120秒超时
+                provider.chat_completion(data, request, api_key, timeout), 
+                timeout=timeout
             )
             return result
+        except ClientDisconnected:
+            logger.info(f"🔌 请求 [{request_id}] 客户端已断开")
+            return JSONResponse({"error": "Client closed request"}, status_code=499)
         except asyncio.TimeoutError:
             logger.error(f"⏰ 请求 [{request_id}] 超时")
             return JSONResponse(
@@ -695,12 +787,188 @@ async def enhanced_chat_completions(request: Request):
         logger.error(f"🚨 全局错误: {e}")
         return JSONResponse({"error": f"Request processing failed: {str(e)}"}, status_code=500)
 
+async def find_job(job_id: str, api_key: ApiKey, wait: float = 0):
+    """按 ID 取任务 (wait > 0 时长轮询)；不存在或不属于该 key 时 404"""
+    if job_manager is None:
+        raise HTTPException(status_code=404, detail="Jobs are disabled")
+    if wait > 0:
+        job = await job_manager.wait(job_id, min(wait, settings.JOBS_LONG_POLL_MAX))
+    else:
+        job = await job_manager.get(job_id)
+    if job is None or job.owner != api_key.name:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/v1/jobs")
+async def create_job(request: Request, api_key: ApiKey = Depends(verify_key)):
+    """提交异步任务 (请求体同 /v1/chat/completions，可带 webhook_url)，立即返回任务 ID 和预计开始时间"""
+    if job_manager is None:
+        raise HTTPException(status_code=404, detail="Jobs are disabled")
+    data = await request.json()
+    webhook_url = data.pop("webhook_url", None)
+    if webhook_url:
+        try:
+            await check_webhook_url(webhook_url, settings.JOBS_WEBHOOK_ALLOWED_HOSTS)
+        except WebhookURLError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+    rejected = unknown_model(data) or quota_exceeded(api_key)
+    if rejected:
+        return rejected
+    try:
+        job = await job_manager.submit(api_key.name, data.get("model", settings.DEFAULT_MODEL), data, webhook_url)
+    except JobQueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "30"})
+
+    logger.info(f"📋 已提交异步任务 [{job.id}] ({api_key.name}): {job.model}")
+    body = job.to_dict()
+    if job.estimated_start_at is not None:
+        body["estimated_start_in"] = round(max(0.0, job.estimated_start_at - time.time()), 3)
+    return JSONResponse(body, status_code=202, headers={"Location": f"/v1/jobs/{job.id}"})
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0, api_key: ApiKey = Depends(verify_key)):
+    """查询任务；?wait=秒 为长轮询，任务结束或超时后返回"""
+    job = await find_job(job_id, api_key, wait)
+    return job.to_dict()
+
+@app.get("/v1/jobs/{job_id}/stream")
+async def stream_job(job_id: str, api_key: ApiKey = Depends(verify_key)):
+    """以 SSE (chat.completion.chunk) 形式跟随任务输出，已完成的任务直接回放结果"""
+    job = await find_job(job_id, api_key)
+
+    async def events():
+        request_id = f"chatcmpl-{job.id}"
+        try:
+            async for piece in job_manager.stream(job):
+                yield create_sse_data(create_chat_completion_chunk(request_id, job.model, piece))
+            yield create_sse_data(create_chat_completion_chunk(request_id, job.model, "", "stop"))
+        except Exception as e:
+            yield create_sse_data({"error": str(e)})
+        yield DONE_CHUNK
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.delete("/v1/jobs/{job_id}")
+async def cancel_job(job_id: str, api_key: ApiKey = Depends(verify_key)):
+    """取消排队中或运行中的任务"""
+    job = await find_job(job_id, api_key)
+    job = await job_manager.cancel(job.id)
+    return job.to_dict()
+
+def require_batches() -> BatchManager:
+    if batch_manager is None:
+        raise HTTPException(status_code=404, detail="Batches are disabled")
+    return batch_manager
+
+@app.post("/v1/files")
+async def upload_file(
+    file: UploadFile = File(...), purpose: str = Form(...), api_key: ApiKey = Depends(verify_key)
+):
+    """上传批处理输入文件 (JSONL，purpose=batch)"""
+    manager = require_batches()
+    content = await file.read()
+    try:
+        stored = await manager.create_file(api_key.name, file.filename or "input.jsonl", purpose, content)
+    except BatchRequestError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    logger.info(f"📦 已上传批处理文件 [{stored.id}] ({api_key.name}): {stored.filename}, {stored.bytes} 字节")
+    return stored.to_dict()
+
+@app.get("/v1/files/{file_id}")
+async def get_file(file_id: str, api_key: ApiKey = Depends(verify_key)):
+    stored = await require_batches().get_file(api_key.name, file_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return stored.to_dict()
+
+@app.get("/v1/files/{file_id}/content")
+async def get_file_content(file_id: str, api_key: ApiKey = Depends(verify_key)):
+    manager = require_batches()
+    stored = await manager.get_file(api_key.name, file_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(manager.file_path(stored), media_type="application/jsonl", filename=stored.filename)
+
+@app.delete("/v1/files/{file_id}")
+async def delete_file(file_id: str, api_key: ApiKey = Depends(verify_key)):
+    deleted = await require_batches().delete_file(api_key.name, file_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"id": file_id, "object": "file", "deleted": True}
+
+@app.post("/v1/batches")
+async def create_batch(request: Request, api_key: ApiKey = Depends(verify_key)):
+    """创建批任务：{"input_file_id", "endpoint": "/v1/chat/completions", "completion_window": "24h"}"""
+    manager = require_batches()
+    data = await request.json()
+    rejected = quota_exceeded(api_key)
+    if rejected:
+        return rejected
+    try:
+        batch = await manager.create_batch(
+            api_key.name,
+            str(data.get("input_file_id", "")),
+            str(data.get("endpoint", "/v1/chat/completions")),
+            str(data.get("completion_window", "24h")),
+            data.get("metadata"),
+        )
+    except BatchRequestError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    logger.info(f"📦 已创建批任务 [{batch.id}] ({api_key.name}): 输入文件 {batch.input_file_id}")
+    return batch.to_dict()
+
+@app.get("/v1/batches")
+async def list_batches(limit: int = 20, api_key: ApiKey = Depends(verify_key)):
+    batches = await require_batches().list_batches(api_key.name, max(1, min(limit, 100)))
+    return {"object": "list", "data": [batch.to_dict() for batch in batches]}
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, api_key: ApiKey = Depends(verify_key)):
+    batch = await require_batches().get_batch(api_key.name, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch.to_dict()
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, api_key: ApiKey = Depends(verify_key)):
+    """取消批任务：已完成的请求保留在结果文件里"""
+    batch = await require_batches().cancel_batch(api_key.name, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch.to_dict()
+
 @app.get("/v1/models")
 async def list_models():
     """使用原始ToolbazProvider的模型列表接口"""
     return await provider.get_models()
 
+@app.get("/stats")
+async def stats(api_key: ApiKey = Depends(verify_admin)):
+    """运行状态统计 (浏览器池、凭证池等)"""
+    return {
+        **provider.get_stats(),
+        "api_keys": keyring.get_stats(),
+        "jobs": job_manager.get_stats() if job_manager else None,
+        "batches": batch_manager.get_stats() if batch_manager else None,
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 指标 (文本格式)"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/v1/cache")
+async def cache_info(limit: int = 100, api_key: ApiKey = Depends(verify_admin)):
+    """查看响应缓存"""
+    return await provider.get_cache_info(limit)
+
+@app.delete("/v1/cache")
+async def cache_purge(key: Optional[str] = None, api_key: ApiKey = Depends(verify_admin)):
+    """清空响应缓存 (带 key 参数时只删除该条)"""
+    return {"purged": await provider.purge_cache(key)}
+
 if __name__ == "__main__":
     logger.info("🚀 启动Toolbaz-2API HF增强版...")
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=7860, log_level="info")
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=7860, log_level="info")
\ No newline at end of file
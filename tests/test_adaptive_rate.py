@@ -0,0 +1,48 @@
+import pytest
+
+from app.core import rate_limiter
+from app.core.adaptive_rate import AdaptiveRateController
+from app.core.rate_limiter import create_rate_limiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_controller():
+    return AdaptiveRateController(initial_rate=4, min_rate=0.5, max_rate=5, increase=0.1, decrease=0.5)
+
+
+def test_success_without_queueing_keeps_rate(clock):
+    controller = make_controller()
+    limiter = create_rate_limiter("gcra", controller.rate_for("direct"))
+    for _ in range(20):
+        reservation = limiter.reserve()
+        controller.on_success("direct", limiter, reservation)
+        clock[0] += 60
+    assert controller.rate_for("direct") == 4
+    assert controller.get_stats()["rates"]["direct"]["successes"] == 20
+
+
+def test_success_while_queued_increases_rate_up_to_cap(clock):
+    controller = make_controller()
+    limiter = create_rate_limiter("gcra", controller.rate_for("direct"))
+    reservations = [limiter.reserve() for _ in range(20)]
+    for reservation in reservations:
+        clock[0] = max(clock[0], reservation.slot_at)
+        controller.on_success("direct", limiter, reservation)
+    assert controller.rate_for("direct") == 5
+    assert limiter.rate_per_minute == 5
+
+
+def test_first_request_of_a_backlog_counts_as_binding(clock):
+    controller = make_controller()
+    limiter = create_rate_limiter("gcra", controller.rate_for("direct"))
+    first = limiter.reserve()
+    limiter.reserve()
+    assert not first.queued
+    controller.on_success("direct", limiter, first)
+    assert controller.rate_for("direct") == pytest.approx(4.1)
@@ -0,0 +1,54 @@
+import asyncio
+
+from app.core.fair_queue import WeightedFairQueue
+
+
+def test_cancelled_tail_waiter_rolls_back_virtual_time():
+    async def scenario():
+        queue = WeightedFairQueue(lambda: 1)
+        holder = await queue.acquire("a")
+        waiters = [asyncio.create_task(queue.acquire("a")) for _ in range(3)]
+        await asyncio.sleep(0)
+        before = queue._tenants["a"].last_finish
+        waiters[-1].cancel()
+        await asyncio.gather(waiters[-1], return_exceptions=True)
+        assert queue._tenants["a"].last_finish == before - 1.0
+
+        # 排在中间的请求被取消不回滚：后面的请求已经按它之后的虚拟时间排好了
+        waiters[0].cancel()
+        await asyncio.gather(waiters[0], return_exceptions=True)
+        assert queue._tenants["a"].last_finish == before - 1.0
+
+        holder.release()
+        (await waiters[1]).release()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiters_do_not_push_tenant_behind_others():
+    async def scenario():
+        queue = WeightedFairQueue(lambda: 1)
+        holder = await queue.acquire("a")
+        abandoned = [asyncio.create_task(queue.acquire("a")) for _ in range(5)]
+        await asyncio.sleep(0)
+        for task in reversed(abandoned):
+            task.cancel()
+        await asyncio.gather(*abandoned, return_exceptions=True)
+
+        order = []
+
+        async def request(tenant):
+            ticket = await queue.acquire(tenant)
+            order.append(tenant)
+            ticket.release()
+
+        tasks = []
+        for tenant in ("b", "a", "b"):
+            tasks.append(asyncio.create_task(request(tenant)))
+            await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    # 没有回滚时 a 的虚拟完成时间被 5 个放弃的请求推到最后，会排在 b 的两个请求之后
+    assert asyncio.run(scenario()) == ["b", "a", "b"]
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.core import rate_limiter
+from app.core.rate_limiter import RATE_LIMITERS, create_rate_limiter
+
+RATE = 4
+WINDOW = 60.0
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", fake)
+    return fake
+
+
+def assert_window_bound(slots, rate=RATE):
+    """任意 60 秒窗口内的发送次数不超过 rate"""
+    slots = sorted(slots)
+    for first, last in zip(slots, slots[rate:]):
+        assert last - first >= WINDOW - 1e-9, slots
+
+
+@pytest.mark.parametrize("algorithm", list(RATE_LIMITERS))
+def test_refund_from_middle_keeps_window_bound(clock, algorithm):
+    limiter = create_rate_limiter(algorithm, RATE)
+    reservations = [limiter.reserve() for _ in range(5)]
+    assert not reservations[1].cancel()
+    assert not reservations[2].cancel()
+    reservations += [limiter.reserve() for _ in range(4)]
+    slots = [r.slot_at - clock.now for r in reservations if not r.cancelled]
+    assert len(slots) == 7
+    assert_window_bound(slots)
+
+
+@pytest.mark.parametrize("algorithm", list(RATE_LIMITERS))
+def test_refund_of_tail_frees_its_slot(clock, algorithm):
+    limiter = create_rate_limiter(algorithm, RATE)
+    first = limiter.reserve()
+    tail = limiter.reserve()
+    assert tail.cancel()
+    assert not tail.cancel()
+    again = limiter.reserve()
+    assert again.slot_at == pytest.approx(tail.slot_at)
+    assert_window_bound([first.slot_at, again.slot_at])
+    assert limiter.refunded == 1
+
+
+@pytest.mark.parametrize("algorithm", list(RATE_LIMITERS))
+def test_refund_after_later_reservation_is_ignored(clock, algorithm):
+    limiter = create_rate_limiter(algorithm, RATE)
+    reservations = [limiter.reserve() for _ in range(3)]
+    clock.now += 20
+    assert not reservations[0].cancel()
+    assert limiter.refunded == 0
+    later = limiter.reserve()
+    assert_window_bound([r.slot_at for r in reservations[1:]] + [later.slot_at])
+
+
+@pytest.mark.parametrize("algorithm", list(RATE_LIMITERS))
+def test_disconnect_while_queued_keeps_spacing(algorithm):
+    """排队中的请求被取消 (客户端断开) 后，后面的请求仍按原间隔发出"""
+    limiter = create_rate_limiter(algorithm, 600)
+    sent = []
+
+    async def request():
+        # 与 _produce_completion 相同：先预订时隙再等待，上游请求发出前被取消就退还时隙
+        reservation = limiter.reserve()
+        try:
+            await reservation.wait()
+        except asyncio.CancelledError:
+            reservation.cancel()
+            raise
+        sent.append(reservation.slot_at)
+
+    async def scenario():
+        first = [asyncio.create_task(request()) for _ in range(5)]
+        await asyncio.sleep(0)
+        first[1].cancel()
+        first[2].cancel()
+        later = [asyncio.create_task(request()) for _ in range(4)]
+        await asyncio.gather(*first, *later, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert len(sent) == 7
+    for earlier, later in zip(sorted(sent), sorted(sent)[1:]):
+        assert later - earlier >= limiter.interval - 1e-9
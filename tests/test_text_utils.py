@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from app.utils.text_utils import StreamingTextCleaner, clean_response_text
+
+SAMPLES = [
+    "",
+    "hi",
+    "  hi  ",
+    "[model:x] hi",
+    "  [model:x] hi",
+    "\n\nToolbaz: hi",
+    "Toolbaz: hi",
+    "[model:gpt-4o]  Toolbaz AI: hello<br>world",
+    "[MODEL:x]\nTOOLBAZ says: ok",
+    "[model:x]",
+    "[model:x] Tools are: fine",
+    "Toolbaz rocks\nnext: line",
+    "[model:x\nnot a prefix",
+    "[note] plain text",
+    "a &amp; b &lt;tag&gt; c&nbsp;d &#39;e&#39;",
+    "&amp;lt; stays escaped once",
+    "line one<br/>line two<br />line three<br>",
+    "trailing spaces   <br>   ",
+    "x<br><br>  <br>",
+]
+
+
+def stream(chunks):
+    cleaner = StreamingTextCleaner()
+    return "".join(cleaner.feed(chunk) for chunk in chunks) + cleaner.flush()
+
+
+def splits(text, parts):
+    """把 text 切成 parts 段 (允许空段) 的所有方式"""
+    if parts == 1:
+        yield [text]
+        return
+    for i in range(len(text) + 1):
+        for rest in splits(text[i:], parts - 1):
+            yield [text[:i]] + rest
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_single_chunk_matches_batch(text):
+    assert stream([text]) == clean_response_text(text)
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_every_split_matches_batch(text):
+    expected = clean_response_text(text)
+    parts = 3 if len(text) <= 30 else 2
+    for chunks in splits(text, parts):
+        assert stream(chunks) == expected, chunks
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_char_by_char_matches_batch(text):
+    assert stream(list(text)) == clean_response_text(text)
+
+
+def test_random_chunking_matches_batch():
+    rng = random.Random(0)
+    alphabet = ["[model:x]", "Toolbaz", ":", " ", "\n", "<br>", "<br />", "&amp;", "&lt;", "&#39;", "a", "b", "["]
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 5))))
+        chunks = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+        assert stream(chunks) == clean_response_text(text), chunks
+
+
+@pytest.mark.parametrize("text", [
+    "Toolbaz " + "x" * 400 + ": hi",
+    "Toolbaz " + "x" * 400 + "\nnext: line",
+    "Toolbaz " + "x" * 400,
+    "[model:" + "x" * 400 + "] Toolbaz says: hi",
+])
+def test_long_prefix_matches_batch(text):
+    expected = clean_response_text(text)
+    assert stream([text[i:i + 16] for i in range(0, len(text), 16)]) == expected
+    assert stream(list(text)) == expected
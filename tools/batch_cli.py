@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+批处理命令行：把 JSONL 里的一批聊天请求交给服务的 /v1/batches 跑完，结果按输入顺序写成 JSONL
+
+输入每行可以是 OpenAI 批处理格式 ({"custom_id", "method", "url", "body"})，
+也可以直接是聊天请求体 ({"model", "messages"})，后者按行号生成 custom_id (line-1, line-2, ...)。
+输出每行: {"custom_id", "status": completed|failed|missing, "status_code", "response", "error"}
+
+用法:
+    python -m tools.batch_cli run prompts.jsonl -o results.jsonl --base-url http://127.0.0.1:8000 --api-key sk-xxx
+    python -m tools.batch_cli status batch_xxx
+    python -m tools.batch_cli cancel batch_xxx
+
+run 会把批任务 ID 记在 <输出文件>.batch 里：命令中断后用同样的参数再跑一次，会接着等同一个批任务，而不是重新提交。
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+ENDPOINT = "/v1/chat/completions"
+
+
+def load_requests(path: str) -> Tuple[bytes, List[str]]:
+    """读入并规范化输入文件，返回 (上传内容, 按顺序的 custom_id)"""
+    lines: List[str] = []
+    order: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, raw in enumerate(f, start=1):
+            if not raw.strip():
+                continue
+            item = json.loads(raw)
+            if "body" not in item:
+                item = {"custom_id": f"line-{line_no}", "method": "POST", "url": ENDPOINT, "body": item}
+            order.append(item["custom_id"])
+            lines.append(json.dumps(item, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8"), order
+
+
+def download(client: httpx.Client, file_id: str) -> Dict[str, Dict[str, Any]]:
+    resp = client.get(f"/v1/files/{file_id}/content")
+    resp.raise_for_status()
+    records = {}
+    for raw in resp.text.splitlines():
+        if raw.strip():
+            record = json.loads(raw)
+            records[record["custom_id"]] = record
+    return records
+
+
+def write_results(path: str, order: List[str], records: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    counts = {"completed": 0, "failed": 0, "missing": 0}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for custom_id in order:
+            record = records.get(custom_id)
+            response = (record or {}).get("response") or {}
+            status_code = response.get("status_code")
+            if record is None:
+                status = "missing"
+            elif status_code == 200:
+                status = "completed"
+            else:
+                status = "failed"
+            counts[status] += 1
+            f.write(json.dumps({
+                "custom_id": custom_id,
+                "status": status,
+                "status_code": status_code,
+                "response": response.get("body") if status == "completed" else None,
+                "error": None if status == "completed" else ((record or {}).get("error") or response.get("body")),
+            }, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return counts
+
+
+def print_batch(batch: Dict[str, Any]):
+    counts = batch["request_counts"]
+    done = counts["completed"] + counts["failed"]
+    print(f"{batch['id']}: {batch['status']}  {done}/{counts['total']} (成功 {counts['completed']}，失败 {counts['failed']})")
+
+
+def run(client: httpx.Client, args) -> int:
+    content, order = load_requests(args.input)
+    digest = hashlib.sha256(content).hexdigest()
+    state_path = f"{args.output}.batch"
+
+    batch_id = None
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("input_sha256") == digest:
+            batch_id = state["batch_id"]
+            print(f"↻ 继续等待已提交的批任务 {batch_id}")
+
+    if batch_id is None:
+        resp = client.post(
+            "/v1/files", files={"file": (os.path.basename(args.input), content, "application/jsonl")}, data={"purpose": "batch"}
+        )
+        resp.raise_for_status()
+        file_id = resp.json()["id"]
+        resp = client.post("/v1/batches", json={
+            "input_file_id": file_id, "endpoint": ENDPOINT, "completion_window": args.completion_window,
+        })
+        resp.raise_for_status()
+        batch_id = resp.json()["id"]
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"batch_id": batch_id, "input_sha256": digest}, f)
+        print(f"📦 已提交 {len(order)} 个请求: {batch_id}")
+
+    last = None
+    while True:
+        resp = client.get(f"/v1/batches/{batch_id}")
+        resp.raise_for_status()
+        batch = resp.json()
+        progress = (batch["status"], batch["request_counts"]["completed"], batch["request_counts"]["failed"])
+        if progress != last:
+            print_batch(batch)
+            last = progress
+        if batch["status"] in ("completed", "failed", "expired", "cancelled"):
+            break
+        time.sleep(args.poll_interval)
+
+    if batch["status"] == "failed" and batch.get("errors"):
+        for error in batch["errors"]["data"]:
+            print(f"  第 {error.get('line')} 行: {error['message']}", file=sys.stderr)
+
+    records: Dict[str, Dict[str, Any]] = {}
+    for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+        if file_id:
+            records.update(download(client, file_id))
+    counts = write_results(args.output, order, records)
+    os.remove(state_path)
+    print(f"✅ 结果已写入 {args.output}: 成功 {counts['completed']}，失败 {counts['failed']}，未执行 {counts['missing']}")
+    return 0 if batch["status"] == "completed" and not counts["failed"] else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="通过 /v1/batches 批量执行 JSONL 里的聊天请求")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--api-key", default=os.environ.get("TOOLBAZ_API_KEY", "1"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="提交输入文件并等待结果")
+    run_parser.add_argument("input")
+    run_parser.add_argument("-o", "--output", required=True)
+    run_parser.add_argument("--completion-window", default="24h")
+    run_parser.add_argument("--poll-interval", type=float, default=5.0)
+
+    for name in ("status", "cancel"):
+        sub = commands.add_parser(name, help="查看批任务进度" if name == "status" else "取消批任务")
+        sub.add_argument("batch_id")
+
+    args = parser.parse_args()
+    with httpx.Client(base_url=args.base_url, headers={"Authorization": f"Bearer {args.api_key}"}, timeout=60) as client:
+        if args.command == "run":
+            sys.exit(run(client, args))
+        if args.command == "status":
+            resp = client.get(f"/v1/batches/{args.batch_id}")
+        else:
+            resp = client.post(f"/v1/batches/{args.batch_id}/cancel")
+        resp.raise_for_status()
+        print_batch(resp.json())
+
+
+if __name__ == "__main__":
+    main()
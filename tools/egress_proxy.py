@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+本地出口代理替身：配合 tools/toolbaz_emulator.py 测试多出口身份
+
+在连续的端口上启动 N 个极简 HTTP 正向代理，每个代理给经过的明文 HTTP 请求加上
+X-Emulator-Identity 头，模拟器据此把它们当作不同的客户端 IP 分别计额度。
+HTTPS 走 CONNECT 隧道原样转发 (无法注入头，仅用于连通性)。
+
+用法:
+    python -m tools.toolbaz_emulator --port 9100 &
+    python -m tools.egress_proxy --port 9200 --count 3 &
+
+    TOOLBAZ_BASE_URL=http://127.0.0.1:9100 TOOLBAZ_API_BASE_URL=http://127.0.0.1:9100 \\
+    EGRESS_PROXIES='["http://127.0.0.1:9200","http://127.0.0.1:9201","http://127.0.0.1:9202"]' \\
+    python main.py
+"""
+
+import asyncio
+import argparse
+from typing import List, Tuple
+from urllib.parse import urlsplit
+
+IDENTITY_HEADER = "X-Emulator-Identity"
+# 逐跳头，转发前去掉
+HOP_BY_HOP = {"proxy-connection", "proxy-authorization", "connection", "keep-alive"}
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+
+async def _relay(client_reader, client_writer, upstream_reader, upstream_writer):
+    await asyncio.gather(
+        _pipe(client_reader, upstream_writer),
+        _pipe(upstream_reader, client_writer),
+    )
+
+
+def _parse_head(head: bytes) -> Tuple[str, str, str, List[Tuple[str, str]]]:
+    lines = head.decode("latin-1").split("\r\n")
+    method, target, version = lines[0].split(" ", 2)
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers.append((name.strip(), value.strip()))
+    return method, target, version, headers
+
+
+class EgressProxy:
+    """
+    单个代理实例。为了实现简单，每个客户端连接只转发一个请求，
+    并要求上游在响应后关闭连接 (Connection: close)。
+    """
+    def __init__(self, identity: str):
+        self.identity = identity
+        self.requests = 0
+        self.tunnels = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        method, target, version, headers = _parse_head(head[:-4])
+
+        if method.upper() == "CONNECT":
+            host, _, port = target.rpartition(":")
+            try:
+                up_reader, up_writer = await asyncio.open_connection(host, int(port))
+            except OSError:
+                writer.write(b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
+                writer.close()
+                return
+            self.tunnels += 1
+            writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            await writer.drain()
+            await _relay(reader, writer, up_reader, up_writer)
+            return
+
+        url = urlsplit(target)
+        if not url.hostname:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            writer.close()
+            return
+        port = url.port or (443 if url.scheme == "https" else 80)
+        path = url.path or "/"
+        if url.query:
+            path += f"?{url.query}"
+        try:
+            up_reader, up_writer = await asyncio.open_connection(url.hostname, port)
+        except OSError:
+            writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n")
+            writer.close()
+            return
+
+        self.requests += 1
+        out = [f"{method} {path} {version}"]
+        out += [f"{k}: {v}" for k, v in headers if k.lower() not in HOP_BY_HOP and k.lower() != IDENTITY_HEADER.lower()]
+        out += [f"{IDENTITY_HEADER}: {self.identity}", "Connection: close"]
+        up_writer.write(("\r\n".join(out) + "\r\n\r\n").encode("latin-1"))
+        await up_writer.drain()
+        await _relay(reader, writer, up_reader, up_writer)
+
+
+async def serve(host: str, port: int, count: int, prefix: str):
+    servers = []
+    for i in range(count):
+        proxy = EgressProxy(f"{prefix}-{i + 1}")
+        server = await asyncio.start_server(proxy.handle, host, port + i)
+        servers.append(server)
+        print(f"🌍 出口代理 {proxy.identity} 监听 http://{host}:{port + i}")
+    await asyncio.gather(*(s.serve_forever() for s in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地出口代理替身 (多出口身份测试用)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200, help="第一个代理的端口，其余依次递增")
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--prefix", default="egress", help="身份名前缀")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.count, args.prefix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+本地 Toolbaz 上游模拟器：离线压测 / 调试用
+
+同时扮演 toolbaz.com (写作页) 和 data.toolbaz.com (token.php / writing.php)：
+  - 写作页定义确定性的 xA1pY()，并下发 SessionID cookie
+  - token.php 校验 xA1pY token，签发带有效期的 capcha
+  - writing.php 按配置的延迟分布、分块节奏流式返回，支持 quota limit 400 和错误注入
+
+用法:
+    python -m tools.toolbaz_emulator --port 9100 --quota-per-minute 5 --chunk-interval uniform:0.02,0.08
+
+然后让服务指向模拟器:
+    TOOLBAZ_BASE_URL=http://127.0.0.1:9100 TOOLBAZ_API_BASE_URL=http://127.0.0.1:9100 python main.py
+"""
+
+import time
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+from collections import defaultdict, deque
+from dataclasses import dataclass, asdict
+from typing import Deque, Dict
+
+from fastapi import FastAPI, Form, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+
+
+class LatencyDistribution:
+    """
+    延迟分布，格式 "<类型>:<参数>"，单位秒:
+      const:0.1 | uniform:0.05,0.2 | normal:0.5,0.1 | lognormal:-1.0,0.5 | exp:0.3
+    """
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("const", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "const":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(p[0], p[1])
+        else:
+            value = rng.expovariate(1.0 / p[0])
+        return max(0.0, value)
+
+    def __repr__(self):
+        return self.spec
+
+
+@dataclass
+class EmulatorConfig:
+    page_latency: str = "const:0.05"
+    token_latency: str = "uniform:0.05,0.15"
+    first_byte_latency: str = "uniform:0.2,0.6"
+    chunk_interval: str = "uniform:0.02,0.08"
+    chunk_chars: int = 24
+    response_chars: int = 400
+    # 每个出口身份每分钟允许的 writing.php 次数 (0 不限)
+    quota_per_minute: int = 5
+    # capcha 有效期 (秒)
+    capcha_ttl: float = 300.0
+    # 注入错误的概率
+    writing_error_rate: float = 0.0
+    token_error_rate: float = 0.0
+    seed: int = 0
+
+
+XA1PY_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Toolbaz Emulator Writer</title>
+<script>
+  // 确定性 token：由 SessionID 推导，token.php 可直接校验
+  window.xA1pY = function () {
+    const m = document.cookie.match(/(?:^|; )SessionID=([^;]+)/);
+    return btoa("emu:" + (m ? m[1] : ""));
+  };
+</script></head>
+<body><h1>Toolbaz Emulator</h1><textarea id="input"></textarea></body></html>
+"""
+
+
+def expected_token(session_id: str) -> str:
+    return base64.b64encode(f"emu:{session_id}".encode()).decode()
+
+
+def create_app(config: EmulatorConfig) -> FastAPI:
+    app = FastAPI(title="Toolbaz Emulator")
+    rng = random.Random(config.seed)
+    page_latency = LatencyDistribution(config.page_latency)
+    token_latency = LatencyDistribution(config.token_latency)
+    first_byte_latency = LatencyDistribution(config.first_byte_latency)
+    chunk_interval = LatencyDistribution(config.chunk_interval)
+
+    capchas: Dict[str, tuple] = {}
+    quota_windows: Dict[str, Deque[float]] = defaultdict(deque)
+    stats: Dict[str, int] = defaultdict(int)
+
+    def identity_of(request: Request) -> str:
+        # 本地代理替身会带上 X-Emulator-Identity，用来区分不同出口 IP
+        return request.headers.get("x-emulator-identity") or (request.client.host if request.client else "unknown")
+
+    def take_quota(identity: str) -> bool:
+        if config.quota_per_minute <= 0:
+            return True
+        now = time.monotonic()
+        window = quota_windows[identity]
+        while window and now - window[0] >= 60:
+            window.popleft()
+        if len(window) >= config.quota_per_minute:
+            return False
+        window.append(now)
+        return True
+
+    def render_answer(prompt: str, model: str) -> str:
+        prompt = prompt.replace("\u3164", "").strip(" :")
+        seeded = random.Random(f"{model}:{prompt}")
+        words = ["toolbaz", "emulator", "stream", "chunk", "latency", "quota", "token", "&amp;", "<br>"]
+        body = f"[model: {model}] Echo: {prompt}<br>"
+        while len(body) < config.response_chars:
+            body += seeded.choice(words) + " "
+        return body
+
+    @app.api_route("/", methods=["GET", "HEAD"])
+    async def root():
+        return PlainTextResponse("toolbaz emulator")
+
+    @app.get("/writer/chat-gpt-alternative", response_class=HTMLResponse)
+    async def writer(request: Request):
+        stats["page"] += 1
+        await asyncio.sleep(page_latency.sample(rng))
+        response = HTMLResponse(XA1PY_PAGE)
+        if not request.cookies.get("SessionID"):
+            response.set_cookie("SessionID", uuid.uuid4().hex[:36], path="/")
+        return response
+
+    @app.post("/token.php")
+    async def token(session_id: str = Form(...), token: str = Form(...)):
+        stats["token"] += 1
+        await asyncio.sleep(token_latency.sample(rng))
+        if rng.random() < config.token_error_rate:
+            stats["token_injected_errors"] += 1
+            return PlainTextResponse("injected error", status_code=500)
+        if token != expected_token(session_id):
+            stats["token_rejected"] += 1
+            return JSONResponse({"success": False, "error": "invalid token"})
+        capcha = uuid.uuid4().hex
+        capchas[capcha] = (session_id, time.monotonic())
+        return JSONResponse({"success": True, "token": capcha})
+
+    @app.post("/writing.php")
+    async def writing(
+        request: Request,
+        text: str = Form(...),
+        capcha: str = Form(...),
+        model: str = Form(...),
+        session_id: str = Form(...),
+    ):
+        stats["writing"] += 1
+        issued = capchas.pop(capcha, None)
+        if issued is None or issued[0] != session_id:
+            stats["writing_invalid_capcha"] += 1
+            return PlainTextResponse("invalid capcha", status_code=403)
+        if time.monotonic() - issued[1] > config.capcha_ttl:
+            stats["writing_expired_capcha"] += 1
+            return PlainTextResponse("capcha expired", status_code=403)
+        if not take_quota(identity_of(request)):
+            stats["writing_quota_limit"] += 1
+            return PlainTextResponse("quota limit", status_code=400)
+        if rng.random() < config.writing_error_rate:
+            stats["writing_injected_errors"] += 1
+            return PlainTextResponse("injected error", status_code=500)
+
+        answer = render_answer(text, model)
+        delays = [chunk_interval.sample(rng) for _ in range(0, len(answer), config.chunk_chars)]
+        first_byte = first_byte_latency.sample(rng)
+
+        async def body():
+            await asyncio.sleep(first_byte)
+            for i, delay in zip(range(0, len(answer), config.chunk_chars), delays):
+                if i:
+                    await asyncio.sleep(delay)
+                yield answer[i:i + config.chunk_chars].encode("utf-8")
+            stats["writing_completed"] += 1
+
+        return StreamingResponse(body(), media_type="text/html; charset=utf-8")
+
+    @app.get("/__emulator/stats")
+    async def emulator_stats():
+        return {"config": asdict(config), "counters": dict(stats)}
+
+    return app
+
+
+def main():
+    defaults = EmulatorConfig()
+    parser = argparse.ArgumentParser(description="本地 Toolbaz 上游模拟器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    config = EmulatorConfig(**{k: getattr(args, k) for k in asdict(defaults)})
+
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()